@@ -0,0 +1,365 @@
+"""
+Append-only archive of the raw BGG API responses, so a new field can be parsed out
+of the stored XML instead of crawling hundreds of thousands of items again.
+
+Every response is compressed on its own, with zstd if the optional zstandard package
+is installed and gzip otherwise, and appended to the segment file of the writing
+process; a new segment is started once it reaches XML_ARCHIVE_SEGMENT_MB. Next to
+every segment an index file holds one fixed-size record per requested ID: the ID,
+the offset and length of the compressed response in the segment and the time it
+was written. The latest written response of an ID is its current data; segment
+order does not tell, since long-running writers append to segments opened before
+those of newer processes.
+
+The archive is opt-in: it grows with every download, the stats refresh included,
+by roughly the compressed size of the responses. XmlArchive.compact drops the
+responses that a later one has replaced for all their IDs.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+XML_ARCHIVE = os.getenv("XML_ARCHIVE", "false").lower() == "true"
+XML_ARCHIVE_DIR = os.getenv("XML_ARCHIVE_DIR", "xml_archive")
+XML_ARCHIVE_SEGMENT_BYTES = int(os.getenv("XML_ARCHIVE_SEGMENT_MB", "64")) * 2**20
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 9
+# Segment file extension by codec; segments of both codecs can be mixed
+CODECS = {".zst": "zstd", ".gz": "gzip"}
+# item ID, offset and length of the compressed response, length of the response,
+# write time in nanoseconds
+INDEX_RECORD = struct.Struct("<qQIIq")
+
+
+@dataclass
+class ArchivedResponse:
+    """
+    The location of one archived response.
+
+    Attributes:
+        segment: The path of the segment file.
+        offset: The position of the compressed response in the segment.
+        length: The length of the compressed response.
+        raw_length: The length of the response.
+        written_ns: The time the response was archived, in nanoseconds.
+        item_ids: The IDs requested with the response, not all of which need to exist.
+    """
+
+    segment: str
+    offset: int
+    length: int
+    raw_length: int
+    written_ns: int
+    item_ids: list
+
+    @property
+    def location(self) -> tuple:
+        return self.segment, self.offset
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # a gzip member
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data, 31)
+
+
+def segment_codec(path: str) -> str:
+    return CODECS[os.path.splitext(path)[1]]
+
+
+class XmlArchive:
+    """
+    Writer and reader of the archive in one directory.
+
+    Segments are named after their creation time and the writing process, so several
+    crawler processes append to their own files without locking, and sorting the names
+    orders the responses from oldest to newest. Since gzip members can be concatenated,
+    a gzip segment is also a valid .gz file of all its responses.
+
+    Args:
+        directory: The archive directory, created on first write.
+        segment_bytes: The size after which a new segment is started.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = XML_ARCHIVE_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.codec = "zstd" if zstandard is not None else "gzip"
+        self.segment = None
+        self.index = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def open_segment(self) -> None:
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        extension = {codec: extension for extension, codec in CODECS.items()}[self.codec]
+        name = f"{time.time_ns():020d}-{os.getpid()}"
+        self.segment = open(os.path.join(self.directory, name + extension), "ab")
+        self.index = open(os.path.join(self.directory, name + ".idx"), "ab")
+        self.pid = os.getpid()
+
+    def close(self) -> None:
+        for file in (self.segment, self.index):
+            if file is not None:
+                file.close()
+        self.segment = self.index = None
+
+    def append(self, item_ids: Iterable[int], data: bytes) -> None:
+        """
+        Archives one API response. The index is written after the response, so a
+        crash in between leaves an unindexed tail that readers ignore.
+
+        Args:
+            item_ids: The IDs requested with the response.
+            data: The response body.
+        """
+        compressed = compress(data, self.codec)
+        with self.lock:
+            # a forked process starts its own segment instead of sharing the parent's
+            if self.segment is None or self.pid != os.getpid():
+                self.open_segment()
+            elif self.segment.tell() >= self.segment_bytes:
+                self.open_segment()
+            offset = self.segment.tell()
+            self.segment.write(compressed)
+            self.segment.flush()
+            written_ns = time.time_ns()
+            self.index.write(
+                b"".join(
+                    INDEX_RECORD.pack(item_id, offset, len(compressed), len(data), written_ns)
+                    for item_id in item_ids
+                )
+            )
+            self.index.flush()
+
+    def segments(self) -> list:
+        """
+        Returns:
+            The paths of the segment files, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if os.path.splitext(name)[1] in CODECS
+        )
+
+    def responses(self, segment: str) -> Iterator[ArchivedResponse]:
+        """
+        Reads the index of a segment.
+
+        Yields:
+            The archived responses of the segment in the order they were written,
+            skipping a torn write at the end.
+        """
+        size = os.path.getsize(segment)
+        with open(os.path.splitext(segment)[0] + ".idx", "rb") as index_file:
+            index = index_file.read()
+        index = index[: len(index) - len(index) % INDEX_RECORD.size]
+        response = None
+        for item_id, offset, length, raw_length, written_ns in INDEX_RECORD.iter_unpack(index):
+            if response is not None and response.offset == offset:
+                response.item_ids.append(item_id)
+                continue
+            if response is not None:
+                yield response
+            response = None
+            if offset + length <= size:
+                response = ArchivedResponse(
+                    segment, offset, length, raw_length, written_ns, [item_id]
+                )
+        if response is not None:
+            yield response
+
+    def read_segment(self, segment: str) -> Iterator[tuple]:
+        """
+        Maps a segment into memory and slices out its compressed responses.
+
+        Yields:
+            Tuples of the ArchivedResponse and its compressed bytes.
+        """
+        with open(segment, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for response in self.responses(segment):
+                    yield response, mapped[response.offset : response.offset + response.length]
+
+    def latest_locations(self, responses: dict = None) -> dict:
+        """
+        Finds the latest written response of every ID, ties broken by segment and
+        offset so every reader picks the same one.
+
+        Args:
+            responses: The responses of every segment, read from the indexes if not given.
+
+        Returns:
+            A dictionary mapping item IDs to the location (segment, offset) of their
+            latest response.
+        """
+        if responses is None:
+            responses = {segment: self.responses(segment) for segment in self.segments()}
+        latest = {}
+        for segment_responses in responses.values():
+            for response in segment_responses:
+                key = (response.written_ns, *response.location)
+                for item_id in response.item_ids:
+                    if item_id not in latest or latest[item_id] < key:
+                        latest[item_id] = key
+        return {item_id: key[1:] for item_id, key in latest.items()}
+
+    def compact(self) -> dict:
+        """
+        Keeps only the latest archived response of every ID. Each older segment is
+        copied without its replaced responses, under a name that sorts in its old
+        place, before the original is deleted, so a crash leaves at worst a
+        duplicate. The newest segment of every writing process is left alone since
+        it may still be appended to.
+
+        Returns:
+            A dictionary with the number of segments rewritten and deleted, the
+            responses dropped and the compressed bytes of the older segments before and
+            after.
+        """
+        stats = {"rewritten": 0, "deleted": 0, "dropped": 0, "bytes_before": 0, "bytes_after": 0}
+        segments = self.segments()
+        responses = {segment: list(self.responses(segment)) for segment in segments}
+        latest = self.latest_locations(responses)
+        # names are {time}-{pid} when written and {time}-{pid}-{generation} when compacted
+        active = {}
+        for segment in segments:
+            parts = os.path.basename(os.path.splitext(segment)[0]).split("-")
+            if len(parts) == 2:
+                active[parts[1]] = segment
+        for segment in segments:
+            if segment in active.values():
+                continue
+            kept = []
+            for response in responses[segment]:
+                item_ids = [i for i in response.item_ids if latest[i] == response.location]
+                if item_ids:
+                    kept.append((response, item_ids))
+            stats["bytes_before"] += sum(response.length for response in responses[segment])
+            stats["bytes_after"] += sum(response.length for response, _ in kept)
+            if len(kept) == len(responses[segment]):
+                continue
+            stats["dropped"] += len(responses[segment]) - len(kept)
+            stem, extension = os.path.splitext(segment)
+            if kept:
+                parts = os.path.basename(stem).split("-")
+                generation = int(parts[2]) + 1 if len(parts) > 2 else 1
+                new_stem = os.path.join(self.directory, f"{parts[0]}-{parts[1]}-{generation}")
+                with open(segment, "rb") as source, open(
+                    new_stem + extension + ".tmp", "wb"
+                ) as target, open(new_stem + ".idx.tmp", "wb") as index:
+                    for response, item_ids in kept:
+                        source.seek(response.offset)
+                        offset = target.tell()
+                        target.write(source.read(response.length))
+                        index.write(
+                            b"".join(
+                                INDEX_RECORD.pack(
+                                    i,
+                                    offset,
+                                    response.length,
+                                    response.raw_length,
+                                    response.written_ns,
+                                )
+                                for i in item_ids
+                            )
+                        )
+                    for file in (target, index):
+                        file.flush()
+                        os.fsync(file.fileno())
+                os.replace(new_stem + ".idx.tmp", new_stem + ".idx")
+                os.replace(new_stem + extension + ".tmp", new_stem + extension)
+                stats["rewritten"] += 1
+            else:
+                stats["deleted"] += 1
+            os.remove(segment)
+            os.remove(stem + ".idx")
+        return stats
+
+    def disk_bytes(self) -> int:
+        """
+        Returns:
+            The size of the segment and index files, cheap enough for every scrape.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        with os.scandir(self.directory) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+    def find(self, item_id: int) -> Optional[bytes]:
+        """
+        Returns the latest written response requested with an item ID, or None.
+        Scans the indexes of every segment.
+        """
+        latest = None
+        for segment in self.segments():
+            for response in self.responses(segment):
+                if item_id in response.item_ids and (
+                    latest is None or latest.written_ns <= response.written_ns
+                ):
+                    latest = response
+        if latest is None:
+            return None
+        with open(latest.segment, "rb") as file:
+            file.seek(latest.offset)
+            return decompress(file.read(latest.length), segment_codec(latest.segment))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The number of segments, responses and requested IDs, the compressed and
+            uncompressed size of the responses and the compression ratio.
+        """
+        stats = {"segments": 0, "responses": 0, "item_ids": 0, "bytes": 0, "raw_bytes": 0}
+        for segment in self.segments():
+            stats["segments"] += 1
+            for response in self.responses(segment):
+                stats["responses"] += 1
+                stats["item_ids"] += len(response.item_ids)
+                stats["bytes"] += response.length
+                stats["raw_bytes"] += response.raw_length
+        stats["ratio"] = round(stats["raw_bytes"] / stats["bytes"], 1) if stats["bytes"] else 0
+        return stats
+
+
+xml_archive = XmlArchive(XML_ARCHIVE_DIR)
+
+
+def archive_response(item_ids: str, data: bytes) -> None:
+    """
+    Archives an API response if XML_ARCHIVE is enabled. A failed write is reported
+    and ignored, the archive must never stop a download.
+
+    Args:
+        item_ids: The comma-separated IDs of the request.
+        data: The response body.
+    """
+    if not XML_ARCHIVE:
+        return
+    try:
+        xml_archive.append([int(item_id) for item_id in item_ids.split(",")], data)
+    except (OSError, ValueError) as err:
+        print(f"Could not archive the response for IDs {item_ids[:40]}: {err}")
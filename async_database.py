@@ -0,0 +1,57 @@
+import functools
+import os
+from typing import Awaitable, Callable
+
+import anyio
+
+import catalog
+import database
+import search
+
+# Number of worker threads running database calls for the route handlers.
+# Matches the connection pool (pool size + overflow), more threads would only
+# wait for a connection.
+DB_THREADS = int(
+    os.getenv("DB_THREADS", str(database.POOL_SIZE + database.MAX_OVERFLOW))
+)
+
+db_limiter = anyio.CapacityLimiter(DB_THREADS)
+
+
+def offload(func: Callable) -> Callable[..., Awaitable]:
+    """
+    Wraps a blocking database function into a coroutine that runs it in a worker thread,
+    so a slow query only occupies its thread and never the event loop.
+
+    Args:
+        func: The blocking function.
+
+    Returns:
+        An async function with the same arguments and result.
+    """
+
+    @functools.wraps(func)
+    async def run(*args, **kwargs):
+        return await anyio.to_thread.run_sync(
+            functools.partial(func, *args, **kwargs), limiter=db_limiter
+        )
+
+    return run
+
+
+# The data access path of the route handlers, all calls run in worker threads
+get_item = offload(database.get_item)
+get_ranked_items = offload(database.get_ranked_items)
+get_items_by_id = offload(database.get_items_by_id)
+get_sorted_items = offload(catalog.get_sorted_items)
+get_owned_items = offload(database.get_owned_items)
+get_faceted_items = offload(database.get_faceted_items)
+get_filtered_items = offload(database.get_filtered_items)
+get_similar_items = offload(database.get_similar_items)
+get_play_dates = offload(database.get_play_dates)
+get_plays = offload(database.get_plays)
+get_crawl_summary = offload(database.get_crawl_summary)
+search_items = offload(search.search_items)
+update_item_ownership = offload(database.update_item_ownership)
+update_times_played = offload(database.update_times_played)
+update_comments = offload(database.update_comments)
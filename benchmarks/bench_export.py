@@ -0,0 +1,72 @@
+"""
+Measures the peak memory and rows per second of the streaming export at growing catalog sizes.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_export.py --items 20000 100000
+
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated.
+Peak memory is the peak of Python allocations (tracemalloc) plus, for the
+Parquet and Arrow formats, the peak of the pyarrow memory pool.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+
+import database
+import export
+from bench_insert import make_batch
+
+
+def fill_catalog(items: int) -> None:
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    for start_id in range(1, items + 1, 5000):
+        database.insert_items_data(make_batch(start_id, min(5000, items + 1 - start_id)))
+
+
+def run(export_format: str) -> tuple:
+    arrow_pool = export.pyarrow.default_memory_pool() if export.pyarrow else None
+    arrow_base = arrow_pool.max_memory() if arrow_pool else 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    written = 0
+    for chunk in export.export_catalog(export_format, []):
+        written += len(chunk)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if arrow_pool and export_format in ("parquet", "arrow"):
+        peak += arrow_pool.max_memory() - arrow_base
+    return elapsed, peak, written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, nargs="+", default=[10000, 50000])
+    args = parser.parse_args()
+
+    formats = ["ndjson", "csv"] + (["parquet", "arrow"] if export.pyarrow else [])
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    print(f"{'rows':>8} {'format':<8} {'rows/s':>10} {'peak MB':>9} {'output MB':>10}")
+    for items in args.items:
+        fill_catalog(items)
+        for export_format in formats:
+            elapsed, peak, written = run(export_format)
+            print(
+                f"{items:>8} {export_format:<8} {items / elapsed:>10.0f} "
+                f"{peak / 2**20:>9.1f} {written / 2**20:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compares the body bytes on the wire and the latency of typical pages sent uncompressed,
+gzip and brotli compressed, and revalidated with If-None-Match (304).
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_http.py --items 20000
+
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated, filled with
+the games of the recorded sample response (benchmarks/data/thing_sample.xml) under
+new IDs, their descriptions shuffled so pages do not repeat the same text.
+"no validators" is the uncompressed page with the ETag lookup switched off,
+the cost of serving a page before conditional requests.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+os.environ["INGEST_ON_STARTUP"] = "false"
+os.environ["REFRESH_INTERVAL_HOURS"] = "0"
+
+import httpx
+from sqlalchemy import event
+
+import bgg_api
+import database
+import http_cache
+from bench_load import start_server
+
+SAMPLE_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "thing_sample.xml")
+PAGES = (
+    ("ranking, 50 games", "/items?limit=50"),
+    ("search", "/search?search=catan"),
+    ("owned", "/owned"),
+    ("all, 100 games JSON", "/items/all?limit=100"),
+    ("one game JSON", "/items/{item_id}"),
+)
+MODES = ("no validators", "identity", "gzip", "br", "304")
+
+
+def fill_catalog(items: int) -> None:
+    generator = random.Random(1)
+    with open(SAMPLE_XML, encoding="utf-8") as sample:
+        samples = list(bgg_api.parse_games_data(sample.read()).values())
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    for start_id in range(1, items + 1, 2000):
+        batch = {}
+        for item_id in range(start_id, min(start_id + 2000, items + 1)):
+            data = dict(generator.choice(samples))
+            words = data["description"].split()
+            generator.shuffle(words)
+            data.update(
+                item_id=item_id,
+                name=f"{data['name']} {item_id}",
+                description=" ".join(words),
+                owned=item_id % 100 == 0,
+                bayes_average=round(generator.uniform(5, 8), 3),
+                average_weight=round(generator.uniform(1, 5), 2),
+                users_rated=generator.randint(30, 100000),
+            )
+            batch[item_id] = data
+        database.insert_items_data(batch)
+
+
+def measure(http: httpx.Client, path: str, mode: str, rounds: int) -> tuple:
+    """
+    Requests a page in a mode and returns the bytes on the wire and the median latency.
+    """
+    headers = {"accept-encoding": "gzip" if mode == "gzip" else "identity"}
+    if mode == "br":
+        headers["accept-encoding"] = "br"
+    if mode == "304":
+        headers["if-none-match"] = http.get(path).headers.get("etag", "")
+    saved_validators = dict(http_cache.validators)
+    if mode == "no validators":
+        http_cache.validators.clear()
+    try:
+        times = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            response = http.get(path, headers=headers)
+            times.append(time.perf_counter() - started)
+    finally:
+        http_cache.validators.update(saved_validators)
+    if response.status_code not in (200, 304):
+        raise RuntimeError(f"{path} returned {response.status_code}")
+    if mode == "304" and response.status_code != 304:
+        raise RuntimeError(f"{path} was not revalidated")
+    return response.num_bytes_downloaded, statistics.median(times) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--query-latency", type=float, default=0, help="milliseconds")
+    parser.add_argument("--port", type=int, default=8124)
+    args = parser.parse_args()
+
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    if http_cache.brotli is None:
+        print("brotli is not installed, br requests fall back to identity.")
+    fill_catalog(args.items)
+    if args.query_latency:
+
+        @event.listens_for(database.engine, "before_cursor_execute")
+        def network_round_trip(*_):
+            time.sleep(args.query_latency / 1000)
+
+    server = start_server(args.port)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as http:
+            print(f"{'page':<22}" + "".join(f"{mode:>22}" for mode in MODES))
+            for label, path in PAGES:
+                path = path.format(item_id=args.items // 2)
+                http.get(path)  # warms the result cache and the template
+                cells = []
+                for mode in MODES:
+                    size, latency = measure(http, path, mode, args.rounds)
+                    cells.append(f"{size:>9} B {latency:>6.2f} ms")
+                print(f"{label:<22}" + "".join(f"{cell:>22}" for cell in cells))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
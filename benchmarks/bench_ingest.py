@@ -0,0 +1,185 @@
+"""
+Measures the ingestion pipeline against the local fake BGG API: fetch, parse and
+insert throughput and the end-to-end crawl time.
+
+Usage:
+    python benchmarks/bench_ingest.py --max-id 20000 --database-url sqlite postgresql://localhost/bench
+    python benchmarks/bench_ingest.py --output run.json --compare previous.json
+
+Every database in --database-url ("sqlite" is a temporary SQLite file) is measured
+in its own process; all tables of the target databases are dropped and recreated.
+The fake API options (latency, 429s, 5xx errors, ID gaps) are those of fake_bgg.py.
+Results can be written as JSON and compared with an earlier run.
+The crawl also reports the utilization and capacity of every ingestion pipeline
+stage; set PIPELINE_PARSERS to compare parsing in threads and in processes.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bgg import add_option_arguments, options_from_arguments, start_fake_bgg
+
+# Metrics where a higher value is better
+THROUGHPUT_METRICS = (
+    "fetch_items_per_second",
+    "parse_items_per_second",
+    "insert_rows_per_second",
+    "crawl_items_per_second",
+)
+# Metrics where a lower value is better
+DURATION_METRICS = ("crawl_seconds", "legacy_crawl_seconds")
+
+
+def measure_stages(args: argparse.Namespace) -> dict:
+    """
+    Runs the stages against the database of DATABASE_URL. Imports the application
+    modules only now, so they pick up the database and API URL of this process.
+    """
+    import bgg_api
+    import database
+
+    database.metadata.drop_all(database.engine)
+    database.create_database_tables()
+    results = {"database": database.engine.url.render_as_string(hide_password=True)}
+    batches = [
+        ",".join(str(item_id) for item_id in range(start_id, start_id + args.batch_size))
+        for start_id in range(1, args.stage_items + 1, args.batch_size)
+    ]
+
+    # fetch: sequential requests over one pooled session, no rate limit
+    session = bgg_api.create_session(1)
+    stats = {"retries": 0}
+    started = time.perf_counter()
+    responses = [bgg_api.get_api_data(ids, session, None, stats) for ids in batches]
+    fetch_seconds = time.perf_counter() - started
+    session.close()
+
+    started = time.perf_counter()
+    parsed = [bgg_api.parse_games_data(response) for response in responses]
+    parse_seconds = time.perf_counter() - started
+    items = sum(len(batch) for batch in parsed)
+
+    started = time.perf_counter()
+    for batch in parsed:
+        database.insert_items_data(batch)
+    insert_seconds = time.perf_counter() - started
+
+    results.update(
+        fetch_items_per_second=items / fetch_seconds,
+        fetch_megabytes=sum(len(response) for response in responses) / 2**20,
+        fetch_retries=stats["retries"],
+        parse_items_per_second=items / parse_seconds,
+        insert_rows_per_second=items / insert_seconds,
+    )
+
+    # end to end: the harvester crawling the whole fake ID space into empty tables
+    database.metadata.drop_all(database.engine)
+    database.create_database_tables()
+    crawl = bgg_api.harvest_new_data(
+        0, workers=args.workers, rate=args.rate, burst=args.workers
+    )
+    results.update(
+        crawl_seconds=crawl["seconds"],
+        crawl_items=crawl["items"],
+        crawl_items_per_second=crawl["items_per_second"],
+        crawl_retries=crawl["retries"],
+    )
+    # which pipeline stage limited the crawl, see pipeline.StageStats
+    for name, stage in crawl.get("stages", {}).items():
+        results[f"crawl_{name}_busy"] = stage["utilization"]
+        results[f"crawl_{name}_capacity"] = stage["capacity_items_per_second"]
+    if args.legacy:
+        database.metadata.drop_all(database.engine)
+        database.create_database_tables()
+        started = time.perf_counter()
+        bgg_api.get_new_data(0)
+        results["legacy_crawl_seconds"] = time.perf_counter() - started
+    return results
+
+
+def run_database(database_url: str, api_url: str, args: argparse.Namespace) -> dict:
+    """
+    Measures one database in a child process with its own DATABASE_URL.
+    """
+    if database_url == "sqlite":
+        database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "BGG_API_URL": api_url,
+        "HARVEST_MAX_BATCH_SIZE": str(args.batch_size),
+        "HARVEST_BATCH_SIZE": str(args.batch_size),
+        "BGG_MAX_RETRIES": "20",
+    }
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", *sys.argv[1:]],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def print_results(results: list, baseline: list = None) -> None:
+    previous = {result["database"].split(":")[0]: result for result in baseline or []}
+    for result in results:
+        print(f"\n{result['database']}")
+        before = previous.get(result["database"].split(":")[0], {})
+        for key, value in result.items():
+            if key == "database":
+                continue
+            line = f"  {key:<26} {value:>12.1f}"
+            if before.get(key):
+                change = (value - before[key]) / before[key] * 100
+                line += f"  {change:+7.1f}%"
+                if key in THROUGHPUT_METRICS:
+                    line += " better" if change > 0 else " worse"
+                elif key in DURATION_METRICS:
+                    line += " better" if change < 0 else " worse"
+            print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", nargs="+", default=["sqlite"])
+    parser.add_argument("--stage-items", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=100, help="requests per second")
+    parser.add_argument("--legacy", action="store_true", help="also time get_new_data")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    add_option_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_stages(args)))
+        return
+
+    server = start_fake_bgg(options_from_arguments(args))
+    try:
+        results = [run_database(url, server.url, args) for url in args.database_url]
+    finally:
+        server.shutdown()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)
+    print_results(results, baseline)
+    print(f"\nFake API: {server.stats}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares the rows per second of the bulk upsert in database.insert_items_data
+with the previous path that ran one SELECT and one INSERT per item.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_insert.py --items 20000
+
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+
+from sqlalchemy import insert, select
+
+import database
+
+
+def make_batch(start_id: int, size: int) -> dict:
+    """
+    Builds a batch of parsed items shaped like the output of parse_games_data.
+    """
+    batch = {}
+    for item_id in range(start_id, start_id + size):
+        batch[item_id] = {
+            "item_id": item_id,
+            "type": "boardgame",
+            "name": f"Game {item_id}",
+            "alternate_names": [f"Spiel {item_id}", f"Jeu {item_id}"],
+            "owned": False,
+            "times_played": 0,
+            "dates_played": "",
+            "comments": "",
+            "description": "A game about benchmarks. " * 40,
+            "yearpublished": "2001",
+            "minplayers": "2",
+            "maxplayers": "4",
+            "playingtime": "60",
+            "minplaytime": "30",
+            "maxplaytime": "60",
+            "age": "10",
+            "categories": ["Card Game", "Economic"],
+            "mechanics": ["Deck, Bag, and Pool Building", "Hand Management"],
+            "families": ["Theme: Benchmarks"],
+            "integrations": [],
+            "implementations": [],
+            "designers": ["Jane Doe"],
+            "artists": ["John Doe"],
+            "publishers": ["Bench Games", "(Public Domain)"],
+            "users_rated": item_id % 5000,
+            "average_rating": 6.5,
+            "bayes_average": 5.5 + (item_id % 100) / 100,
+            "bgg_rank": item_id,
+            "num_weights": 10,
+            "average_weight": 2.5,
+            "thumbnail": f"https://cf.geekdo-images.com/{item_id}_t.jpg",
+            "image": f"https://cf.geekdo-images.com/{item_id}.jpg",
+        }
+    return batch
+
+
+def insert_per_row(game_data: dict) -> None:
+    """
+    The previous insert path: one SELECT and one single-row INSERT per item.
+    """
+    with database.engine.begin() as conn:
+        for new_item_id, data in game_data.items():
+            if data["type"] in database.BOARDGAME_TYPES:
+                existing_game = conn.execute(
+                    select(database.Boardgame).where(
+                        database.Boardgame.c.item_id == new_item_id
+                    )
+                ).fetchone()
+                if not existing_game:
+                    conn.execute(
+                        insert(database.Boardgame).values(database.prepare_row(data))
+                    )
+
+
+def run(label: str, insert_batch, batches: list) -> None:
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    started = time.perf_counter()
+    for batch in batches:
+        insert_batch(batch)
+    elapsed = time.perf_counter() - started
+    rows = sum(len(batch) for batch in batches)
+    print(f"{label:<28} {rows:>8} rows {elapsed:>8.2f}s {rows / elapsed:>10.0f} rows/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    batches = [
+        make_batch(start, args.batch_size)
+        for start in range(1, args.items + 1, args.batch_size)
+    ]
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    run("per-row SELECT + INSERT", insert_per_row, batches)
+    run("bulk insert", database.insert_items_data, batches)
+    run(
+        "bulk upsert (update stats)",
+        lambda batch: database.insert_items_data(batch, update_stats=True),
+        batches,
+    )
+
+
+if __name__ == "__main__":
+    main()
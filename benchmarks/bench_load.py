@@ -0,0 +1,140 @@
+"""
+Load test: measures throughput and latency of the API with increasing numbers of concurrent clients.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_load.py --items 50000
+
+Serves the app with uvicorn in a background thread on a synthetic catalog and
+lets every client send requests back to back to a mix of uncached database routes
+(ID pages, facets, search, owned list). --query-latency adds a sleep to every
+query to simulate the network round trip to a remote database.
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated.
+"""
+import argparse
+import asyncio
+import os
+import random
+import threading
+import sys
+import tempfile
+import time
+
+import httpx
+import uvicorn
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+# measure the database path, not the result cache
+os.environ["CACHE_MAX_ENTRIES"] = "0"
+os.environ["INGEST_ON_STARTUP"] = "false"
+os.environ["REFRESH_INTERVAL_HOURS"] = "0"
+
+import database
+from bench_insert import make_batch
+
+MECHANICS = [f"Mechanic {number}" for number in range(40)]
+CATEGORIES = [f"Category {number}" for number in range(30)]
+
+
+def fill_catalog(items: int) -> None:
+    random.seed(1)
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    for start_id in range(1, items + 1, 5000):
+        batch = make_batch(start_id, min(5000, items + 1 - start_id))
+        for item_id, data in batch.items():
+            data["owned"] = item_id % 50 == 0
+            data["mechanics"] = random.sample(MECHANICS, 3)
+            data["categories"] = random.sample(CATEGORIES, 2)
+            data["bayes_average"] = round(random.uniform(5, 8), 3)
+        database.insert_items_data(batch)
+
+
+def request_path(items: int) -> str:
+    choice = random.random()
+    if choice < 0.4:
+        return f"/items/all?limit=20&skip={random.randint(0, items - 20)}"
+    if choice < 0.7:
+        return f"/items/facets?mechanics={random.choice(MECHANICS)}&limit=20"
+    if choice < 0.9:
+        return f"/search?search=Game {random.randint(1, items)}"
+    return "/owned"
+
+
+async def client(http: httpx.AsyncClient, items: int, deadline: float, latencies: list):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await http.get(request_path(items))
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_level(base_url: str, clients: int, items: int, seconds: float) -> dict:
+    latencies = []
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(
+            *(client(http, items, deadline, latencies) for _ in range(clients))
+        )
+    latencies.sort()
+    return {
+        "clients": clients,
+        "requests_per_second": len(latencies) / seconds,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def start_server(port: int) -> uvicorn.Server:
+    import main as app_module
+
+    server = uvicorn.Server(
+        uvicorn.Config(app_module.app, port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--query-latency", type=float, default=0, help="milliseconds")
+    parser.add_argument("--port", type=int, default=8123)
+    args = parser.parse_args()
+
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    fill_catalog(args.items)
+    if args.query_latency:
+
+        @event.listens_for(database.engine, "before_cursor_execute")
+        def network_round_trip(*_):
+            time.sleep(args.query_latency / 1000)
+
+    server = start_server(args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        print(f"{'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for clients in args.clients:
+            result = asyncio.run(run_level(base_url, clients, args.items, args.seconds))
+            print(
+                f"{result['clients']:>7} {result['requests_per_second']:>8.1f} "
+                f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+            )
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Measures parse throughput of bgg_api.parse_games_data against the previous
+XPath-based parser and checks that both produce the same output.
+
+Usage:
+    python benchmarks/bench_parse.py --items 20000 [--xml benchmarks/data/thing_sample.xml]
+
+The items of the sample response are repeated with new IDs until the
+requested number of items per response is reached.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from typing import Union
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import bgg_api
+
+SAMPLE_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "thing_sample.xml")
+
+
+def legacy_parse_games_data(xml_data: object):
+    """
+    Parses XML data containing board game information into a dictionary.
+
+    Args:
+        xml_data: The XML data to be parsed.
+
+    Returns:
+        A dictionary with item IDs as keys and dictionaries containing
+        parsed item data as values.
+    """
+    items_data = {}
+    root = ET.fromstring(xml_data)
+    for boardgame in root.findall("item"):
+        item_id = int(boardgame.get("id"))
+        items_data[item_id] = {
+            "item_id": item_id,
+            "type": boardgame.get("type"),
+            "name": get_value(boardgame, 'name[@type="primary"]'),
+            "alternate_names": get_all_values_list(boardgame, "name", "alternate"),
+            "owned": False,
+            "times_played": 0,
+            "dates_played": "",
+            "comments": "",
+            "description": "",
+            "yearpublished": get_value(boardgame, "yearpublished"),
+            "minplayers": get_value(boardgame, "minplayers"),
+            "maxplayers": get_value(boardgame, "maxplayers"),
+            "playingtime": get_value(boardgame, "playingtime"),
+            "minplaytime": get_value(boardgame, "minplaytime"),
+            "maxplaytime": get_value(boardgame, "maxplaytime"),
+            "age": get_value(boardgame, "minage"),
+            "categories": get_all_values_list(boardgame, "link", "boardgamecategory"),
+            "mechanics": get_all_values_list(boardgame, "link", "boardgamemechanic"),
+            "families": get_all_values_list(boardgame, "link", "boardgamefamily"),
+            "integrations": get_all_values_list(
+                boardgame, "link", "boardgameintegration"
+            ),
+            "implementations": get_all_values_list(
+                boardgame, "link", "boardgameimplementation"
+            ),
+            "designers": get_all_values_list(boardgame, "link", "boardgamedesigner"),
+            "artists": get_all_values_list(boardgame, "link", "boardgameartist"),
+            "publishers": get_all_values_list(boardgame, "link", "boardgamepublisher"),
+            "users_rated": bgg_api.value_to_int(
+                get_value(boardgame, "statistics/ratings/usersrated")
+            ),
+            "average_rating": bgg_api.value_to_float(
+                get_value(boardgame, "statistics/ratings/average")
+            ),
+            "bayes_average": bgg_api.value_to_float(
+                get_value(boardgame, "statistics/ratings/bayesaverage")
+            ),
+            "bgg_rank": bgg_api.value_to_int(
+                get_value(boardgame, 'statistics/ratings/ranks/rank[@type="subtype"]')
+            ),
+            "num_weights": bgg_api.value_to_int(
+                get_value(boardgame, "statistics/ratings/numweights")
+            ),
+            "average_weight": bgg_api.value_to_float(
+                get_value(boardgame, "statistics/ratings/averageweight")
+            ),
+            "thumbnail": "",
+            "image": "",
+        }
+        if boardgame.find("description") is not None:
+            items_data[item_id]["description"] = boardgame.find("description").text
+        if boardgame.find("thumbnail") is not None:
+            items_data[item_id]["thumbnail"] = boardgame.find("thumbnail").text
+        if boardgame.find("image") is not None:
+            items_data[item_id]["image"] = boardgame.find("image").text
+    return items_data
+
+
+def get_all_values_list(boardgame: ET.Element, tag_name: str, tag_type: str) -> list:
+    """
+    Retrieves a list of values from XML elements matching a specific tag name and type.
+
+    Args:
+        boardgame: The root XML element to search within.
+        tag_name: The name of the tags to search for.
+        tag_type: The type attribute value to match for the tags.
+
+    Returns:
+        A list of the values found in the matching tags.
+    """
+    all_values_list = []
+    for tag in boardgame.findall(tag_name + f'[@type="{tag_type}"]'):
+        all_values_list.append(tag.get("value"))
+    return all_values_list
+
+
+def get_value(element: ET.Element, tag_name: str) -> Union[str, int]:
+    """
+    Retrieves the value of a specific tag within an XML element.
+
+    Args:
+        element: The XML element to search within.
+        tag_name: The name of the tag to retrieve the value from.
+
+    Returns:
+        The value of the tag, or -1 if the tag is not found.
+    """
+    if element.find(tag_name) is not None:
+        return element.find(tag_name).get("value")
+    return -1
+
+
+def build_response(sample: str, items: int) -> str:
+    """
+    Repeats the <item> elements of a sample response with new IDs.
+    """
+    item_elements = re.findall(r"<item .*?</item>", sample, flags=re.S)
+    body = []
+    for number in range(items):
+        element = item_elements[number % len(item_elements)]
+        body.append(re.sub(r'id="\d+"', f'id="{number + 1}"', element, count=1))
+    header = sample[: sample.index("<item ")]
+    return header + "\n".join(body) + "\n</items>\n"
+
+
+def measure(label: str, parse, xml_data: str, items: int) -> dict:
+    started = time.perf_counter()
+    result = parse(xml_data)
+    elapsed = time.perf_counter() - started
+    # second run only for the allocation peak, tracemalloc slows parsing down
+    tracemalloc.start()
+    parse(xml_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<20} {items:>8} items {elapsed:>8.3f}s "
+        f"{items / elapsed:>10.0f} items/s  peak {peak / 2**20:>7.1f} MiB"
+    )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--xml", default=SAMPLE_XML)
+    args = parser.parse_args()
+
+    with open(args.xml, encoding="utf-8") as xml_file:
+        sample = xml_file.read()
+    assert legacy_parse_games_data(sample) == bgg_api.parse_games_data(sample)
+
+    xml_data = build_response(sample, args.items)
+    print(f"Response size: {len(xml_data) / 2**20:.1f} MiB")
+    legacy = measure("XPath parser", legacy_parse_games_data, xml_data, args.items)
+    streaming = measure("streaming parser", bgg_api.parse_games_data, xml_data, args.items)
+    assert list(legacy.items()) == list(streaming.items())
+    assert all(
+        list(legacy[item_id]) == list(streaming[item_id]) for item_id in legacy
+    )
+    print("Outputs are identical.")
+
+
+if __name__ == "__main__":
+    main()
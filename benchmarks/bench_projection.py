@@ -0,0 +1,103 @@
+"""
+Compares a 200-row search page read with every column against the list view projection:
+bytes transferred from the database, fetch time and item_table.html render time.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_projection.py --items 20000
+
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated.
+Bytes are the sizes of the fetched values (text as UTF-8, 8 bytes per number).
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+
+from jinja2 import Environment, FileSystemLoader
+from sqlalchemy import select
+
+import database
+import search
+from bench_insert import make_batch
+
+# BGG descriptions are a few kilobytes long
+DESCRIPTION = "A game about benchmarks, worker placement and engine building. " * 50
+
+
+def fill_catalog(items: int) -> None:
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    for start_id in range(1, items + 1, 5000):
+        batch = make_batch(start_id, min(5000, items + 1 - start_id))
+        for data in batch.values():
+            data["description"] = DESCRIPTION
+        database.insert_items_data(batch)
+
+
+def value_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bool):
+        return 1
+    return 8
+
+
+def measure(columns: list, item_ids: list, template, rounds: int) -> dict:
+    fetch_times, render_times = [], []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        with database.engine.begin() as conn:
+            rows = conn.execute(
+                select(*columns).where(database.Boardgame.c.item_id.in_(item_ids))
+            ).fetchall()
+        fetch_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        template.render(items=rows, plays={})
+        render_times.append(time.perf_counter() - started)
+    return {
+        "rows": len(rows),
+        "bytes": sum(value_size(value) for row in rows for value in row),
+        "fetch_ms": statistics.median(fetch_times) * 1000,
+        "render_ms": statistics.median(render_times) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    fill_catalog(args.items)
+    search.prepare_search(database.engine)
+    item_ids = [row.item_id for row in search.search_items("Game", limit=200)]
+    template = Environment(loader=FileSystemLoader(os.path.join(ROOT, "templates")))
+    template = template.get_template("item_table.html")
+
+    print(f"{'columns':<22} {'rows':>5} {'DB bytes':>10} {'fetch ms':>9} {'render ms':>10}")
+    for label, columns in (
+        ("all columns", list(database.Boardgame.columns)),
+        ("list view projection", database.list_view),
+    ):
+        result = measure(columns, item_ids, template, args.rounds)
+        print(
+            f"{label:<22} {result['rows']:>5} {result['bytes']:>10} "
+            f"{result['fetch_ms']:>9.2f} {result['render_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
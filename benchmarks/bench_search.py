@@ -0,0 +1,101 @@
+"""
+Measures search latency (p50/p99) of search.search_items on a synthetic catalog.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_search.py --items 300000
+
+Without DATABASE_URL a temporary SQLite database is used, searched through the
+in-process n-gram index. The boardgames table of the target database is dropped
+and recreated.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+
+import database
+import search
+
+WORDS = (
+    "catan settlers carcassonne pandemic ticket ride azul wingspan gloomhaven "
+    "terraforming mars dune imperium brass birmingham lancashire scythe root everdell "
+    "splendor agricola puerto rico power grid twilight struggle spirit island ark nova "
+    "castles burgundy great western trail orleans concordia kingdom builder dominion "
+    "race galaxy viticulture tzolkin caverna mombasa hansa teutonica lorenzo magnifico "
+    "underwater cities heat pedal metal sky team cascadia everdell oath arcs"
+).split()
+QUERIES = [
+    "catan",
+    "catn",
+    "carcasonne",
+    "pandemic legacy",
+    "spirit island",
+    "teraforming mars",
+    "dune imp",
+    "br",
+    "lorenzo il magnifico",
+    "underwater citys",
+]
+
+
+def fill_catalog(items: int) -> None:
+    random.seed(1)
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    batch = {}
+    for item_id in range(1, items + 1):
+        name = " ".join(
+            random.choice(WORDS).title() for _ in range(random.randint(1, 3))
+        )
+        batch[item_id] = {
+            "item_id": item_id,
+            "type": "boardgame",
+            "name": f"{name} {item_id % 997}",
+            "alternate_names": [f"{name} Edition {item_id % 13}"],
+            "users_rated": int(random.paretovariate(1.2)) - 1,
+        }
+        if len(batch) == 5000:
+            database.insert_items_data(batch)
+            batch = {}
+    database.insert_items_data(batch)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=300000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    started = time.perf_counter()
+    fill_catalog(args.items)
+    print(f"Filled {args.items} items in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    search.prepare_search(database.engine)
+    search.search_items("warm up")
+    print(f"Prepared search in {time.perf_counter() - started:.1f}s")
+
+    latencies = []
+    for _ in range(args.rounds):
+        for query in QUERIES:
+            started = time.perf_counter()
+            search.search_items(query)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{len(latencies)} searches: p50 {p50:.1f}ms, p99 {p99:.1f}ms")
+    for query in QUERIES[:4]:
+        print(f"{query!r}: {[row.name for row in search.search_items(query)[:3]]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares sorting the catalog snapshot with SQL ORDER BY for several sort keys,
+and reports the build time and memory footprint of the snapshot.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/bench_sort.py --items 100000
+
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated.
+Every sort is checked to return the same page as the database.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+
+from sqlalchemy import nulls_last, select
+
+import catalog
+import database
+from bench_insert import make_batch
+
+SORTS = (
+    "-bayes_average",
+    "-average_weight,yearpublished",
+    "-yearpublished,-users_rated",
+    "playingtime,-average_rating",
+    "-owned,name",
+)
+
+
+def fill_catalog(items: int) -> None:
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    generator = random.Random(1)
+    for start_id in range(1, items + 1, 5000):
+        batch = make_batch(start_id, min(5000, items + 1 - start_id))
+        for data in batch.values():
+            data["average_weight"] = round(generator.uniform(1, 5), 2)
+            data["yearpublished"] = generator.choice([None, *range(1990, 2025)])
+            data["playingtime"] = generator.choice([15, 30, 45, 60, 90, 120, 180])
+        database.insert_items_data(batch)
+
+
+def sql_page(sort: list, limit: int, skip: int) -> list:
+    columns = database.Boardgame.c
+    order = [
+        nulls_last(columns[column].desc() if descending else columns[column].asc())
+        for column, descending in sort
+    ]
+    query = select(columns.item_id).order_by(*order, columns.item_id)
+    with database.engine.connect() as conn:
+        return list(conn.execute(query.limit(limit).offset(skip)).scalars())
+
+
+def median_ms(func, rounds: int) -> float:
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--skip", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    fill_catalog(args.items)
+    snapshot = catalog.catalog_snapshot
+    snapshot.build()
+
+    print(f"{'sort':<32} {'snapshot ms':>12} {'SQL ms':>9}")
+    for spec in SORTS:
+        sort = catalog.parse_sort(spec)
+        page = snapshot.sorted_ids(sort, args.limit, args.skip)
+        if page != sql_page(sort, args.limit, args.skip):
+            print(f"{spec}: snapshot and database pages differ")
+        snapshot_ms = median_ms(
+            lambda: snapshot.sorted_ids(sort, args.limit, args.skip), args.rounds
+        )
+        sql_ms = median_ms(lambda: sql_page(sort, args.limit, args.skip), args.rounds)
+        print(f"{spec:<32} {snapshot_ms:>12.2f} {sql_ms:>9.2f}")
+
+    stats = snapshot.stats()
+    print(f"\nBuilt in {stats['build_seconds']:.2f}s, {stats['rows']} rows")
+    for column, size in stats["memory_bytes"].items():
+        print(f"  {column:<16} {size / 2**20:>8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
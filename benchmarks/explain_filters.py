@@ -0,0 +1,171 @@
+"""
+Checks with EXPLAIN that the common range filter combinations of /items/filter
+are answered from the right indexes: a year or weight range matching fewer than
+database.SELECTIVE_MATCHES games must be part of the index search key, and any
+other combination must walk the ranking index without sorting.
+
+Usage:
+    DATABASE_URL=postgresql://... python benchmarks/explain_filters.py --items 100000
+
+Without DATABASE_URL a temporary SQLite database is used.
+The boardgames table of the target database is dropped and recreated, filled with
+games whose player counts, play times, weights, ages and years follow BGG-like
+distributions, and analyzed so the planner sees realistic selectivities.
+Exits with status 1 if any combination is planned otherwise.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+
+from sqlalchemy import func, select, text
+
+import database
+from bench_insert import make_batch
+
+COMMON_FILTERS = (
+    {},
+    {"players": 3, "max_playtime": 60, "min_weight": 2, "max_weight": 3},
+    {"players": 2},
+    {"players": 4, "max_playtime": 45},
+    {"max_playtime": 30},
+    {"min_weight": 3.5},
+    {"min_weight": 1.5, "max_weight": 2.5, "max_age": 10},
+    {"max_age": 8},
+    {"min_year": 2020},
+    {"min_year": 1995, "max_year": 2000, "players": 2},
+    {"min_playtime": 120, "min_weight": 3},
+    {"players": 1, "max_playtime": 15, "min_weight": 3.5, "max_weight": 4},
+    {"min_year": 2030},
+    {"min_year": 2024, "max_year": 2024},
+    {"min_weight": 4.8},
+)
+
+
+def fill_catalog(items: int) -> None:
+    database.metadata.drop_all(database.engine, tables=[database.Boardgame])
+    database.create_database_tables()
+    generator = random.Random(1)
+    for start_id in range(1, items + 1, 5000):
+        batch = make_batch(start_id, min(5000, items + 1 - start_id))
+        for data in batch.values():
+            minplayers = generator.choice([1, 1, 2, 2, 2, 3, 4])
+            maxplaytime = generator.choice([0, 15, 20, 30, 45, 60, 60, 90, 120, 180, 240])
+            data.update(
+                minplayers=minplayers,
+                maxplayers=minplayers + generator.choice([0, 1, 2, 2, 3, 4, 6]),
+                minplaytime=maxplaytime // generator.choice([1, 1, 2]),
+                maxplaytime=maxplaytime,
+                playingtime=maxplaytime,
+                average_weight=generator.choice([0, round(generator.uniform(1, 5), 2)]),
+                age=generator.choice([0, 6, 8, 8, 10, 10, 12, 12, 14, 18]),
+                # drawn independently of the ID, so no plan relies on the physical
+                # order following the year
+                yearpublished=generator.randint(1970, 2025) if generator.random() > 0.05 else 0,
+            )
+        database.insert_items_data(batch)
+    with database.engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def explain(conn, query) -> tuple:
+    """
+    Returns the plan of a query as text, the search key of the boardgames table
+    (empty for a sequential scan) and whether the rows are sorted after reading.
+    """
+    compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+    if conn.dialect.name == "postgresql":
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+        nodes, lines, key, sorted_ = [plan[0]["Plan"]], [], "", False
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get("Plans", []))
+            target = node.get("Index Name", node.get("Relation Name", ""))
+            lines.append(f"{node['Node Type']} {target} {node.get('Index Cond', '')}")
+            key = key or node.get("Index Cond", "")
+            sorted_ = sorted_ or node["Node Type"] in ("Sort", "Incremental Sort")
+        return "; ".join(lines), key, sorted_
+    details = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+    key = ""
+    for detail in details:
+        if detail.startswith("SEARCH boardgames") and "(" in detail:
+            key = detail[detail.index("(") + 1 : detail.rindex(")")]
+    sorted_ = any("TEMP B-TREE" in detail for detail in details)
+    return "; ".join(details), key, sorted_
+
+
+def selective_columns(conn, filters: dict) -> list:
+    """
+    Returns the columns with a range index whose filters alone match fewer than
+    SELECTIVE_MATCHES games, counted without any index choice of the app.
+    """
+    columns = []
+    for column in database.RANGE_INDEXES:
+        conditions = database.range_conditions(
+            {
+                name: value
+                for name, value in filters.items()
+                if name in database.RANGE_FILTERS and database.RANGE_FILTERS[name][0] == column
+            }
+        )
+        if not conditions:
+            continue
+        matches = conn.execute(
+            select(func.count()).where(database.Boardgame.c.type == "boardgame", *conditions)
+        ).scalar()
+        if matches < database.SELECTIVE_MATCHES:
+            columns.append(column)
+    return columns
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"Database: {database.engine.url.render_as_string(hide_password=True)}")
+    fill_catalog(args.items)
+    failed = 0
+    for filters in COMMON_FILTERS:
+        with database.engine.connect() as conn:
+            index = None
+            if conn.dialect.name == "sqlite":
+                index = database.choose_filter_index(conn, filters)
+            query = database.filtered_items_query(filters, args.limit, index=index)
+            plan, key, sorted_ = explain(conn, query)
+            selective = selective_columns(conn, filters)
+        times = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            database.get_filtered_items(filters, args.limit)
+            times.append(time.perf_counter() - started)
+        if selective:
+            wrong = not any(column in key for column in selective)
+            status = "NO RANGE" if wrong else "ok"
+        else:
+            wrong = not key or sorted_
+            status = "SORTED" if sorted_ else "NO INDEX" if wrong else "ok"
+        failed += wrong
+        label = " ".join(f"{name}={value}" for name, value in filters.items()) or "ranking"
+        print(f"{status:<8} {statistics.median(times) * 1000:>7.2f} ms  {label}")
+        print(f"         {plan}")
+    if failed:
+        print(f"\n{failed} of {len(COMMON_FILTERS)} filter combinations use the wrong plan.")
+        sys.exit(1)
+    print(f"\nAll {len(COMMON_FILTERS)} filter combinations use the right indexes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Local stand-in for the BGG xmlapi2/thing endpoint, for benchmarks and offline runs.
+
+Usage:
+    python benchmarks/fake_bgg.py --port 8765 --max-id 50000 --latency 150 --throttle-rate 0.05
+    BGG_API_URL=http://127.0.0.1:8765/xmlapi2/thing uvicorn main:app
+
+Replays the items of a recorded response (benchmarks/data/thing_sample.xml by
+default) with the requested IDs, so responses have realistic sizes. Latency,
+429 and 5xx responses and missing IDs can be injected, all reproducibly seeded.
+With --local-images the thumbnail and image URLs point at the fake API, which
+serves a sample image, so the image proxy runs offline as well.
+"""
+import argparse
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "thing_sample.xml")
+# Served for every image path when the fake API hosts the images itself
+SAMPLE_IMAGE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "no_image.png"
+)
+BGG_IMAGE_HOST = "https://cf.geekdo-images.com"
+RESPONSE_HEADER = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<items termsofuse="https://boardgamegeek.com/xmlapi/termsofuse">'
+)
+
+
+@dataclass
+class FakeOptions:
+    """
+    Behaviour of the fake API.
+
+    Attributes:
+        max_id: IDs above this do not exist, which ends a crawl.
+        latency: Base response time in seconds.
+        latency_per_item: Additional response time per returned item in seconds.
+        jitter: Random extra response time of up to this many seconds.
+        throttle_rate: Share of requests answered with 429 Too Many Requests.
+        error_rate: Share of requests answered with 503 Service Unavailable.
+        retry_after: Retry-After header of 429 responses in seconds, None to omit it.
+        gap_rate: Share of IDs that do not exist, e.g. deleted items.
+        gap_every: Every gap_every IDs a run of gap_length IDs does not exist.
+        gap_length: Length of the runs of missing IDs.
+        seed: Seed of the random faults and gaps.
+        local_images: Point the thumbnail and image URLs at the fake API, which
+            serves a sample image for them, instead of the BGG CDN.
+    """
+
+    max_id: int = 10000
+    latency: float = 0.0
+    latency_per_item: float = 0.0
+    jitter: float = 0.0
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after: int = 0
+    gap_rate: float = 0.0
+    gap_every: int = 0
+    gap_length: int = 0
+    seed: int = 1
+    local_images: bool = False
+
+
+class FakeBGGServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering /xmlapi2/thing?id=1,2,3 requests like BGG.
+    Counts the requests, returned items and injected faults.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, options: FakeOptions, sample_xml: str = SAMPLE_XML):
+        super().__init__(address, FakeBGGHandler)
+        self.options = options
+        with open(sample_xml, encoding="utf-8") as sample:
+            self.templates = re.findall(r"<item .*?</item>", sample.read(), flags=re.S)
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        with open(SAMPLE_IMAGE, "rb") as image:
+            self.image = image.read()
+        self.stats = {
+            "requests": 0,
+            "items": 0,
+            "throttled": 0,
+            "errors": 0,
+            "bytes": 0,
+            "images": 0,
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/xmlapi2/thing"
+
+    def exists(self, item_id: int) -> bool:
+        options = self.options
+        if item_id < 1 or item_id > options.max_id:
+            return False
+        if options.gap_every and options.gap_length:
+            if item_id >= options.gap_every and item_id % options.gap_every < options.gap_length:
+                return False
+        if options.gap_rate:
+            return random.Random(options.seed * 1000003 + item_id).random() >= options.gap_rate
+        return True
+
+    @property
+    def image_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/images"
+
+    def item_xml(self, item_id: int) -> str:
+        template = self.templates[item_id % len(self.templates)]
+        xml = re.sub(r'id="\d+"', f'id="{item_id}"', template, count=1)
+        if self.options.local_images:
+            xml = xml.replace(BGG_IMAGE_HOST, self.image_url)
+        return xml
+
+    def fault(self):
+        """
+        Draws the injected fault of a request: "throttled", "error" or None.
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            draw = self.random.random()
+        if draw < self.options.throttle_rate:
+            return "throttled"
+        if draw < self.options.throttle_rate + self.options.error_rate:
+            return "error"
+        return None
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += value
+
+
+class FakeBGGHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_body(
+        self,
+        status: int,
+        body: bytes,
+        headers: dict = None,
+        content_type: str = "text/xml; charset=utf-8",
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        server = self.server
+        options = server.options
+        url = urllib.parse.urlparse(self.path)
+        if url.path.startswith("/images/"):
+            server.count("images")
+            self.send_body(200, server.image, content_type="image/png")
+            return
+        if url.path.rstrip("/") != "/xmlapi2/thing":
+            self.send_body(404, b"<error>Not found</error>")
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            item_ids = [int(value) for value in query.get("id", [""])[0].split(",") if value]
+        except ValueError:
+            self.send_body(400, b"<error>Invalid id</error>")
+            return
+
+        fault = server.fault()
+        if fault == "throttled":
+            server.count("throttled")
+            headers = {} if options.retry_after is None else {"Retry-After": str(options.retry_after)}
+            self.send_body(429, b"<error>Rate limit exceeded</error>", headers)
+            return
+        if fault == "error":
+            server.count("errors")
+            self.send_body(503, b"<error>Service Unavailable</error>")
+            return
+
+        items = [server.item_xml(item_id) for item_id in item_ids if server.exists(item_id)]
+        delay = options.latency + options.latency_per_item * len(items)
+        if options.jitter:
+            delay += random.uniform(0, options.jitter)
+        if delay:
+            time.sleep(delay)
+        body = (RESPONSE_HEADER + "".join(items) + "</items>").encode("utf-8")
+        server.count("items", len(items))
+        server.count("bytes", len(body))
+        self.send_body(200, body)
+
+
+def start_fake_bgg(
+    options: FakeOptions = None, port: int = 0, sample_xml: str = SAMPLE_XML
+) -> FakeBGGServer:
+    """
+    Starts the fake API in a background thread.
+
+    Args:
+        options: The behaviour of the fake API. Defaults to no faults.
+        port: The port to listen on, 0 picks a free one.
+        sample_xml: The recorded response whose items are replayed.
+
+    Returns:
+        The running server, its endpoint is server.url. Stop it with server.shutdown().
+    """
+    server = FakeBGGServer(("127.0.0.1", port), options or FakeOptions(), sample_xml)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_option_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the FakeOptions as command line arguments, latencies in milliseconds.
+    """
+    parser.add_argument("--max-id", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds per request")
+    parser.add_argument("--latency-per-item", type=float, default=0, help="milliseconds")
+    parser.add_argument("--jitter", type=float, default=0, help="milliseconds")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="share of 429s")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of 503s")
+    parser.add_argument("--retry-after", type=int, default=0)
+    parser.add_argument("--gap-rate", type=float, default=0, help="share of missing IDs")
+    parser.add_argument("--gap-every", type=int, default=0)
+    parser.add_argument("--gap-length", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--local-images", action="store_true", help="serve the images too")
+
+
+def options_from_arguments(args: argparse.Namespace) -> FakeOptions:
+    return FakeOptions(
+        max_id=args.max_id,
+        latency=args.latency / 1000,
+        latency_per_item=args.latency_per_item / 1000,
+        jitter=args.jitter / 1000,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        gap_rate=args.gap_rate,
+        gap_every=args.gap_every,
+        gap_length=args.gap_length,
+        seed=args.seed,
+        local_images=args.local_images,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sample", default=SAMPLE_XML, help="recorded thing response")
+    add_option_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeBGGServer(("127.0.0.1", args.port), options_from_arguments(args), args.sample)
+    print(f"Serving a fake BGG API at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
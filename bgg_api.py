@@ -1,11 +1,46 @@
+import io
+import os
+import random
+import threading
 import requests
 import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+import metrics
+from archive import archive_response
+from pipeline import PIPELINE_PARSERS, IngestPipeline
 from database import insert_items_data, get_highest_id
-from typing import Union
+from typing import Callable, Iterator
 import time
 
-
-def parse_games_data(xml_data: object):
+# BGG API and harvester settings
+BGG_API_URL = os.getenv("BGG_API_URL", "https://www.boardgamegeek.com/xmlapi2/thing")
+HARVEST_WORKERS = int(os.getenv("HARVEST_WORKERS", "4"))
+HARVEST_RATE = float(os.getenv("HARVEST_RATE", "2"))  # requests per second
+HARVEST_BURST = int(os.getenv("HARVEST_BURST", "4"))
+BATCH_SIZE = int(os.getenv("HARVEST_BATCH_SIZE", "100"))
+MIN_BATCH_SIZE = int(os.getenv("HARVEST_MIN_BATCH_SIZE", "20"))
+MAX_BATCH_SIZE = int(os.getenv("HARVEST_MAX_BATCH_SIZE", "100"))
+TARGET_LATENCY = float(os.getenv("HARVEST_TARGET_LATENCY", "5"))  # seconds
+REQUEST_TIMEOUT = float(os.getenv("BGG_REQUEST_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("BGG_MAX_RETRIES", "8"))
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+LINK_FIELDS = {
+    "boardgamecategory": "categories",
+    "boardgamemechanic": "mechanics",
+    "boardgamefamily": "families",
+    "boardgameintegration": "integrations",
+    "boardgameimplementation": "implementations",
+    "boardgamedesigner": "designers",
+    "boardgameartist": "artists",
+    "boardgamepublisher": "publishers",
+}
+TEXT_TAGS = ("description", "thumbnail", "image")
+
+
+def parse_games_data(xml_data: object) -> dict:
     """
     Parses XML data containing board game information into a dictionary.
 
@@ -16,67 +51,129 @@ def parse_games_data(xml_data: object):
         A dictionary with item IDs as keys and dictionaries containing
         parsed item data as values.
     """
-    items_data = {}
-    root = ET.fromstring(xml_data)
-    for boardgame in root.findall("item"):
-        item_id = int(boardgame.get("id"))
-        items_data[item_id] = {
-            "item_id": item_id,
-            "type": boardgame.get("type"),
-            "name": get_value(boardgame, 'name[@type="primary"]'),
-            "alternate_names": get_all_values_list(boardgame, "name", "alternate"),
-            "owned": False,
-            "times_played": 0,
-            "dates_played": "",
-            "comments": "",
-            "description": "",
-            "yearpublished": get_value(boardgame, "yearpublished"),
-            "minplayers": get_value(boardgame, "minplayers"),
-            "maxplayers": get_value(boardgame, "maxplayers"),
-            "playingtime": get_value(boardgame, "playingtime"),
-            "minplaytime": get_value(boardgame, "minplaytime"),
-            "maxplaytime": get_value(boardgame, "maxplaytime"),
-            "age": get_value(boardgame, "minage"),
-            "categories": get_all_values_list(boardgame, "link", "boardgamecategory"),
-            "mechanics": get_all_values_list(boardgame, "link", "boardgamemechanic"),
-            "families": get_all_values_list(boardgame, "link", "boardgamefamily"),
-            "integrations": get_all_values_list(
-                boardgame, "link", "boardgameintegration"
-            ),
-            "implementations": get_all_values_list(
-                boardgame, "link", "boardgameimplementation"
-            ),
-            "designers": get_all_values_list(boardgame, "link", "boardgamedesigner"),
-            "artists": get_all_values_list(boardgame, "link", "boardgameartist"),
-            "publishers": get_all_values_list(boardgame, "link", "boardgamepublisher"),
-            "users_rated": value_to_int(
-                get_value(boardgame, "statistics/ratings/usersrated")
-            ),
-            "average_rating": value_to_float(
-                get_value(boardgame, "statistics/ratings/average")
-            ),
-            "bayes_average": value_to_float(
-                get_value(boardgame, "statistics/ratings/bayesaverage")
-            ),
-            "bgg_rank": value_to_int(
-                get_value(boardgame, 'statistics/ratings/ranks/rank[@type="subtype"]')
-            ),
-            "num_weights": value_to_int(
-                get_value(boardgame, "statistics/ratings/numweights")
-            ),
-            "average_weight": value_to_float(
-                get_value(boardgame, "statistics/ratings/averageweight")
-            ),
-            "thumbnail": "",
-            "image": "",
-        }
-        if boardgame.find("description") is not None:
-            items_data[item_id]["description"] = boardgame.find("description").text
-        if boardgame.find("thumbnail") is not None:
-            items_data[item_id]["thumbnail"] = boardgame.find("thumbnail").text
-        if boardgame.find("image") is not None:
-            items_data[item_id]["image"] = boardgame.find("image").text
-    return items_data
+    return {item["item_id"]: item for item in iter_games_data(xml_data)}
+
+
+def iter_games_data(xml_data: object) -> Iterator[dict]:
+    """
+    Streams parsed board game items out of XML data one <item> at a time.
+    Every item element is cleared once parsed, so memory use does not grow with the response size.
+
+    Args:
+        xml_data: The XML data to be parsed, as text, bytes or a binary file object.
+
+    Yields:
+        A dictionary containing the parsed data of one item.
+    """
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode("utf-8")
+    if isinstance(xml_data, bytes):
+        xml_data = io.BytesIO(xml_data)
+    depth = 0
+    root = None
+    for event, element in ET.iterparse(xml_data, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and element.tag == "item":
+            yield parse_item(element)
+            root.clear()
+
+
+def parse_item(boardgame: ET.Element) -> dict:
+    """
+    Parses a single <item> element in one pass over its children.
+    Link and name children are routed to their field by the type attribute.
+
+    Args:
+        boardgame: The <item> XML element.
+
+    Returns:
+        A dictionary containing the parsed item data.
+    """
+    values = {}
+    texts = {}
+    ratings = {}
+    primary_name = -1
+    alternate_names = []
+    links = {field: [] for field in LINK_FIELDS.values()}
+    for child in boardgame:
+        tag = child.tag
+        if tag == "link":
+            field = LINK_FIELDS.get(child.get("type"))
+            if field:
+                links[field].append(child.get("value"))
+        elif tag == "name":
+            name_type = child.get("type")
+            if name_type == "primary" and primary_name == -1:
+                primary_name = child.get("value")
+            elif name_type == "alternate":
+                alternate_names.append(child.get("value"))
+        elif tag in TEXT_TAGS:
+            if tag not in texts:
+                texts[tag] = child.text
+        elif tag == "statistics":
+            for rating_group in child.iterfind("ratings"):
+                parse_ratings(rating_group, ratings)
+        elif tag not in values:
+            values[tag] = child.get("value")
+
+    item_id = int(boardgame.get("id"))
+    return {
+        "item_id": item_id,
+        "type": boardgame.get("type"),
+        "name": primary_name,
+        "alternate_names": alternate_names,
+        "owned": False,
+        "times_played": 0,
+        "dates_played": "",
+        "comments": "",
+        "description": texts.get("description", ""),
+        "yearpublished": values.get("yearpublished", -1),
+        "minplayers": values.get("minplayers", -1),
+        "maxplayers": values.get("maxplayers", -1),
+        "playingtime": values.get("playingtime", -1),
+        "minplaytime": values.get("minplaytime", -1),
+        "maxplaytime": values.get("maxplaytime", -1),
+        "age": values.get("minage", -1),
+        "categories": links["categories"],
+        "mechanics": links["mechanics"],
+        "families": links["families"],
+        "integrations": links["integrations"],
+        "implementations": links["implementations"],
+        "designers": links["designers"],
+        "artists": links["artists"],
+        "publishers": links["publishers"],
+        "users_rated": value_to_int(ratings.get("usersrated", -1)),
+        "average_rating": value_to_float(ratings.get("average", -1)),
+        "bayes_average": value_to_float(ratings.get("bayesaverage", -1)),
+        "bgg_rank": value_to_int(ratings.get("ranks/rank", -1)),
+        "num_weights": value_to_int(ratings.get("numweights", -1)),
+        "average_weight": value_to_float(ratings.get("averageweight", -1)),
+        "thumbnail": texts.get("thumbnail", ""),
+        "image": texts.get("image", ""),
+    }
+
+
+def parse_ratings(ratings_element: ET.Element, ratings: dict) -> None:
+    """
+    Collects the first value of every rating statistic and the board game subtype rank.
+
+    Args:
+        ratings_element: A <ratings> XML element.
+        ratings: The dictionary to store the values in. Values already present are kept.
+    """
+    for child in ratings_element:
+        if child.tag == "ranks":
+            if "ranks/rank" not in ratings:
+                for rank in child.iterfind('rank[@type="subtype"]'):
+                    ratings["ranks/rank"] = rank.get("value")
+                    break
+        elif child.tag not in ratings:
+            ratings[child.tag] = child.get("value")
 
 
 def value_to_int(value: str) -> int:
@@ -115,67 +212,394 @@ def value_to_float(value: str) -> float:
     return -1.0
 
 
-def get_all_values_list(boardgame: ET.Element, tag_name: str, tag_type: str) -> list:
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how often requests are sent to the BGG API.
+
+    Tokens refill continuously at `rate` per second up to `capacity`, so short
+    bursts are allowed while the long-run request rate never exceeds `rate`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a token is available and consumes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(
+                    self.blocked_until - now, (1 - self.tokens) / self.rate, 0.01
+                )
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Drains the bucket and stops handing out tokens for the given time.
+        Used when the server asks us to slow down.
+
+        Args:
+            seconds: How long no new requests should be sent.
+        """
+        with self.lock:
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# Shared by every job talking to the BGG API, so together they stay within the allowance
+api_rate_limiter = TokenBucket(HARVEST_RATE, HARVEST_BURST)
+
+
+class BatchSizer:
+    """
+    Adapts the number of IDs sent per request to how the server is responding.
+
+    Grows the batch additively while requests succeed quickly and halves it
+    when the server throttles, fails or answers slower than `target_latency`.
     """
-    Retrieves a list of values from XML elements matching a specific tag name and type.
+
+    def __init__(self, size: int, min_size: int, max_size: int, target_latency: float):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.lock = threading.Lock()
+
+    def next_size(self) -> int:
+        with self.lock:
+            return self.size
+
+    def success(self, latency: float) -> None:
+        with self.lock:
+            if latency > self.target_latency:
+                self.size = max(self.min_size, self.size // 2)
+            else:
+                self.size = min(self.max_size, self.size + self.min_size)
+
+    def throttled(self) -> None:
+        with self.lock:
+            self.size = max(self.min_size, self.size // 2)
+
+
+def create_session(pool_size: int = HARVEST_WORKERS) -> requests.Session:
+    """
+    Creates an HTTP session that keeps connections to the BGG API alive.
 
     Args:
-        boardgame: The root XML element to search within.
-        tag_name: The name of the tags to search for.
-        tag_type: The type attribute value to match for the tags.
+        pool_size: The maximum number of pooled connections.
 
     Returns:
-        A list of the values found in the matching tags.
+        A requests session with a connection pool of the given size.
     """
-    all_values_list = []
-    for tag in boardgame.findall(tag_name + f'[@type="{tag_type}"]'):
-        all_values_list.append(tag.get("value"))
-    return all_values_list
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
-def get_value(element: ET.Element, tag_name: str) -> Union[str, int]:
+def retry_delay(attempt: int, response: requests.Response = None) -> float:
     """
-    Retrieves the value of a specific tag within an XML element.
+    Computes how long to wait before retrying a failed request.
+    Honors the Retry-After header, otherwise uses capped exponential backoff with jitter.
 
     Args:
-        element: The XML element to search within.
-        tag_name: The name of the tag to retrieve the value from.
+        attempt: The number of the failed attempt, starting at 0.
+        response: The failed response, if the server answered at all.
 
     Returns:
-        The value of the tag, or -1 if the tag is not found.
+        The delay in seconds.
     """
-    if element.find(tag_name) is not None:
-        return element.find(tag_name).get("value")
-    return -1
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
-def get_api_data(game_id: str) -> str:
+def is_throttled(response: requests.Response) -> bool:
+    """
+    Checks if the server asked us to come back later.
+    BGG answers 202 while it queues a request, 429 when rate limited and 5xx when overloaded.
+
+    Args:
+        response: The API response.
+
+    Returns:
+        True if the request should be retried after a delay.
+    """
+    return response.status_code in (202, 429) or response.status_code >= 500
+
+
+def get_api_data(
+    game_id: str,
+    session: requests.Session = None,
+    bucket: TokenBucket = None,
+    stats: dict = None,
+) -> str:
     """
     Fetches data from the BoardGameGeek XML API with retry logic.
+    Backs off exponentially on throttling (429, 202), server errors (5xx)
+    and connection errors, and gives up after MAX_RETRIES attempts.
+    Successful responses are kept in the XML archive, see archive.py.
 
     Args:
         game_id: The IDs of the games to fetch data for.
+        session: The HTTP session to send the request with. Defaults to a new connection.
+        bucket: The rate limiter to take a token from before every attempt.
+        stats: Optional dictionary in which retries are counted.
 
     Returns:
         The XML response text from the API.
+
+    Raises:
+        requests.exceptions.RequestException: If all retries failed.
     """
-    base_url = "https://www.boardgamegeek.com/xmlapi2/thing"
     params = {
         "id": game_id,
         "stats": 1,
     }
+    http = session or requests
 
-    while True:
+    for attempt in range(MAX_RETRIES):
+        if bucket:
+            bucket.acquire()
+        response = None
         try:
-            response = requests.get(base_url, params=params)
-            response.raise_for_status()
-            return response.text
-        except requests.exceptions.HTTPError as err:
-            print(f"HTTP Error: {err}. Retrying...")
-            keep_server_healthy(0.2)
+            response = http.get(BGG_API_URL, params=params, timeout=REQUEST_TIMEOUT)
         except requests.exceptions.RequestException as err:
             print(f"Request Error: {err}. Retrying...")
-            keep_server_healthy(0.2)
+            last_error = err
+        else:
+            if not is_throttled(response):
+                response.raise_for_status()
+                archive_response(game_id, response.content)
+                return response.text
+            last_error = requests.exceptions.HTTPError(
+                f"{response.status_code} for url: {response.url}", response=response
+            )
+            print(f"HTTP Error: {last_error}. Retrying...")
+        metrics.harvest_retries.inc()
+        if stats is not None:
+            stats["retries"] += 1
+        delay = retry_delay(attempt, response)
+        if bucket and response is not None:
+            bucket.pause(delay)
+        else:
+            keep_server_healthy(delay)
+    raise last_error
+
+
+def fetch_batch(
+    start_id: int,
+    size: int,
+    session: requests.Session,
+    bucket: TokenBucket,
+    sizer: BatchSizer,
+) -> tuple:
+    """
+    Downloads one batch of consecutive item IDs.
+
+    Args:
+        start_id: The first item ID of the batch.
+        size: The number of IDs in the batch.
+        session: The pooled HTTP session.
+        bucket: The shared rate limiter.
+        sizer: The shared batch sizer, informed about the response latency.
+
+    Returns:
+        A tuple of the XML response text and the number of retries the batch needed.
+    """
+    item_ids = ",".join([str(id) for id in range(start_id, start_id + size)])
+    batch_stats = {"retries": 0}
+    started = time.monotonic()
+    api_response = get_api_data(item_ids, session, bucket, batch_stats)
+    metrics.harvest_batch_seconds.observe(time.monotonic() - started)
+    if batch_stats["retries"]:
+        sizer.throttled()
+    else:
+        sizer.success(time.monotonic() - started)
+    return api_response, batch_stats["retries"]
+
+
+def harvest_new_data(
+    last_item_id: int,
+    workers: int = HARVEST_WORKERS,
+    rate: float = None,
+    burst: int = None,
+    progress: Callable[[dict], None] = None,
+    stop_event: threading.Event = None,
+) -> dict:
+    """
+    Retrieves new board game data from the BGG API from an ID on until the first batch
+    without any items, like `get_new_data`, with several batch requests in flight.
+    The crawler module uses harvest_range instead, which crawls across gaps.
+
+    Args:
+        last_item_id: The highest existing item ID in the database.
+        workers: The number of concurrent batch requests.
+        rate: The maximum number of requests per second.
+        burst: The maximum number of requests sent back to back.
+        progress: Optional callback receiving the statistics after every stored batch.
+        stop_event: Optional event that stops the harvest once the requests in flight returned.
+
+    Returns:
+        The harvest statistics, see harvest_range.
+    """
+    return harvest_range(
+        last_item_id,
+        None,
+        workers=workers,
+        rate=rate,
+        burst=burst,
+        progress=progress,
+        stop_event=stop_event,
+    )
+
+
+def harvest_range(
+    start_id: int,
+    end_id: int = None,
+    workers: int = HARVEST_WORKERS,
+    rate: float = None,
+    burst: int = None,
+    progress: Callable[[dict], None] = None,
+    stop_event: threading.Event = None,
+    on_batch: Callable[[int, int, dict], bool] = None,
+    parsers: int = None,
+) -> dict:
+    """
+    Retrieves the board game data of a range of IDs from the BGG API and stores it
+    in the database, running fetching, parsing and writing as the stages of an
+    IngestPipeline: several batch requests in flight, parsing in worker processes and
+    one writer merging batches into fewer transactions.
+
+    Requests share a pooled session and a token bucket rate limit, and the batch size
+    adapts to the server's latency and throttling. Batches are stored in ID order.
+    Batches without items are skipped; without end_id the harvest stops at the first one.
+
+    Args:
+        start_id: The first item ID to fetch.
+        end_id: The ID after the last one to fetch, or None to stop at the first empty batch.
+        workers: The number of concurrent batch requests.
+        rate: The maximum number of requests per second. Without rate and burst the
+            process-wide api_rate_limiter shared with other jobs is used.
+        burst: The maximum number of requests sent back to back.
+        progress: Optional callback receiving the statistics after every stored batch.
+        stop_event: Optional event that stops the harvest once the requests in flight returned.
+        on_batch: Optional callback receiving the start ID, size and items of every
+            batch in ID order, empty ones included, after they are stored.
+            Returning False stops the harvest.
+        parsers: The number of parser processes, defaults to PIPELINE_PARSERS.
+
+    Returns:
+        A dictionary with the harvest statistics: items, batches, empty_batches, retries,
+        start_id, current_id, cancelled, seconds, items_per_second and stages, the
+        statistics of the pipeline stages (see pipeline.StageStats.stats).
+    """
+    stats = {
+        "items": 0,
+        "batches": 0,
+        "empty_batches": 0,
+        "retries": 0,
+        "start_id": start_id,
+        "current_id": start_id,
+        "cancelled": False,
+        "items_per_second": 0.0,
+        "stages": {},
+    }
+    if rate is None and burst is None:
+        bucket = api_rate_limiter
+    else:
+        bucket = TokenBucket(rate or HARVEST_RATE, burst or HARVEST_BURST)
+    sizer = BatchSizer(BATCH_SIZE, MIN_BATCH_SIZE, MAX_BATCH_SIZE, TARGET_LATENCY)
+    session = create_session(workers)
+    started = time.monotonic()
+    next_id = start_id
+    retries_lock = threading.Lock()
+    print(f"Harvesting new items from item id {next_id} with {workers} workers.")
+
+    def schedule():
+        nonlocal next_id
+        if end_id is not None and next_id >= end_id:
+            return None
+        size = sizer.next_size()
+        if end_id is not None:
+            size = min(size, end_id - next_id)
+        next_id += size
+        return next_id - size, size
+
+    def fetch(batch_start: int, size: int) -> str:
+        api_response, retries = fetch_batch(batch_start, size, session, bucket, sizer)
+        with retries_lock:
+            stats["retries"] += retries
+        return api_response
+
+    def stored(batch_start: int, size: int, items_data: dict) -> bool:
+        if not items_data:
+            stats["empty_batches"] += 1
+        stats["items"] += len(items_data)
+        stats["batches"] += 1
+        stats["current_id"] = batch_start + size
+        stats["items_per_second"] = stats["items"] / (time.monotonic() - started)
+        stats["stages"] = harvest.stats()
+        metrics.harvest_items.inc(len(items_data))
+        metrics.harvest_items_per_second.set(stats["items_per_second"])
+        print(
+            f"----Downloaded {len(items_data)} items from item id {batch_start} "
+            f"to {batch_start + size} ({stats['items_per_second']:.1f} items/s)----"
+        )
+        if progress:
+            progress(stats)
+        return on_batch is None or on_batch(batch_start, size, items_data) is not False
+
+    harvest = IngestPipeline(
+        schedule,
+        fetch,
+        parse_games_data,
+        insert_items_data,
+        fetchers=workers,
+        parsers=PIPELINE_PARSERS if parsers is None else parsers,
+        stop_at_empty=end_id is None,
+        on_batch=stored,
+        stop_event=stop_event,
+    )
+    with session:
+        stats["cancelled"] = harvest.run()
+
+    stats["seconds"] = time.monotonic() - started
+    stats["items_per_second"] = stats["items"] / stats["seconds"]
+    stats["stages"] = harvest.stats()
+    metrics.harvest_items_per_second.set(stats["items_per_second"])
+    print(
+        f"{'Harvest cancelled' if stats['cancelled'] else 'Downloaded all new items'}: "
+        f"{stats['items']} items in {stats['seconds']:.1f}s "
+        f"({stats['items_per_second']:.1f} items/s, {stats['retries']} retries)."
+    )
+    print(
+        "Pipeline stages: "
+        + ", ".join(
+            f"{name} {stage['utilization']:.0%} busy, "
+            f"{stage['capacity_items_per_second']:.0f} items/s capacity"
+            for name, stage in stats["stages"].items()
+        )
+    )
+    return stats
 
 
 def get_new_data(last_item_id: int) -> dict:
@@ -201,6 +625,7 @@ def get_new_data(last_item_id: int) -> dict:
         )
         highest_id += 100
         insert_items_data(items_data)
+        metrics.harvest_items.inc(len(items_data))
         keep_server_healthy(0.2)
     print("Downloaded all new items.")
     return items_data
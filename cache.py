@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Union
+
+# Result cache settings, CACHE_MAX_ENTRIES=0 disables the cache
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+
+
+class ResultCache:
+    """
+    Thread-safe in-process cache for query results with a TTL and LRU eviction.
+
+    Every entry is stored with tags naming what it depends on, e.g. "item:13" for an
+    entry containing item 13 or "ranking" for a page of the top games ranking.
+    Writes invalidate the tags they affect, which drops exactly the entries holding them.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self.tags = {}  # tag -> keys of the entries holding it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], object],
+        tags: Union[Iterable[str], Callable[[object], Iterable[str]]],
+    ) -> object:
+        """
+        Returns the cached value of a key, loading and storing it on a miss.
+        A value loaded while an invalidation ran is returned but not stored,
+        since it may already be stale.
+
+        Args:
+            key: The cache key.
+            loader: Callable returning the value on a miss.
+            tags: The tags of the value, or a callable computing them from the value.
+
+        Returns:
+            The cached or loaded value.
+        """
+        if self.max_entries <= 0:
+            return loader()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+        value = loader()
+        value_tags = set(tags(value) if callable(tags) else tags)
+        with self.lock:
+            if generation == self.generation:
+                self.store(key, value, value_tags)
+        return value
+
+    def store(self, key: Hashable, value: object, tags: set) -> None:
+        """
+        Stores a value, evicting the least recently used entries over the size limit.
+        Must be called with the lock held.
+        """
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, value, tags)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Removes an entry and its tag references. Must be called with the lock held.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+    def invalidate(self, *tags: str) -> None:
+        """
+        Drops every entry holding any of the given tags.
+
+        Args:
+            tags: The tags affected by a write.
+        """
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self.remove(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Drops every entry.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self) -> dict:
+        """
+        Reports the size of the cache and its hit, miss, eviction and invalidation counts.
+
+        Returns:
+            A dictionary with the cache statistics.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def item_tags(items: Iterable) -> set:
+    """
+    Returns the "item:<id>" tags of the rows contained in a cached result.
+    """
+    return {f"item:{item.item_id}" for item in items if item is not None}
+
+
+result_cache = ResultCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
@@ -0,0 +1,420 @@
+import sys
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+import database
+from database import BOARDGAME_TYPES, Boardgame
+
+# Columns held as float32 arrays, NULL as NaN. Integers stay exact up to 2**24.
+NUMERIC_COLUMNS = (
+    "times_played",
+    "yearpublished",
+    "minplayers",
+    "maxplayers",
+    "playingtime",
+    "minplaytime",
+    "maxplaytime",
+    "age",
+    "users_rated",
+    "average_rating",
+    "bayes_average",
+    "bgg_rank",
+    "num_weights",
+    "average_weight",
+)
+SORT_COLUMNS = ("item_id", "name", "type", "owned", *NUMERIC_COLUMNS)
+MAX_SORT_KEYS = 4
+TYPE_CODES = {item_type: code for code, item_type in enumerate(BOARDGAME_TYPES)}
+
+
+class SortError(ValueError):
+    """
+    Raised for a sort specification that names unknown columns.
+    """
+
+
+def parse_sort(spec: str) -> list:
+    """
+    Parses a sort specification like "-bayes_average,yearpublished", where a leading
+    minus sorts descending.
+
+    Args:
+        spec: Comma-separated column names.
+
+    Returns:
+        A list of (column, descending) tuples.
+
+    Raises:
+        SortError: If a column cannot be sorted on or too many keys are given.
+    """
+    keys = []
+    for part in spec.split(","):
+        part = part.strip()
+        column = part.lstrip("-")
+        if column not in SORT_COLUMNS:
+            raise SortError(
+                f"Unknown sort column '{column}', choose from {', '.join(SORT_COLUMNS)}"
+            )
+        keys.append((column, part.startswith("-")))
+    if not keys or len(keys) > MAX_SORT_KEYS:
+        raise SortError(f"Sort by 1 to {MAX_SORT_KEYS} columns")
+    return keys
+
+
+def float_array(values) -> np.ndarray:
+    return np.array(values, dtype=np.float32)
+
+
+class CatalogSnapshot:
+    """
+    Column arrays of the numeric and short-string columns of every game, sorted by item ID,
+    so any column can be sorted on without an index or a database round trip.
+
+    Built from the database on first use and kept current by the insert and update
+    listeners. Writes of other processes (crawler processes, reparse.py, other app
+    workers) are caught up before every sort from the updated_at index, see sync.
+    Names are kept casefolded for sorting only; the rows of a sorted page are read
+    from the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built = False
+        self.size = 0
+        self.item_ids = np.empty(0, dtype=np.int32)
+        self.types = np.empty(0, dtype=np.int8)
+        self.owned = np.empty(0, dtype=bool)
+        self.names = np.empty(0, dtype=object)
+        self.numeric = {column: np.empty(0, dtype=np.float32) for column in NUMERIC_COLUMNS}
+        # rank of every name in alphabetical order, computed when first sorted on
+        self.name_ranks = None
+        self.build_seconds = 0.0
+        self.inserted = 0
+        self.updated = 0
+        # latest updated_at applied, games written since are read by sync
+        self.synced_at = None
+        self.synced = 0
+
+    def arrays(self) -> dict:
+        return {
+            "item_id": self.item_ids,
+            "type": self.types,
+            "owned": self.owned,
+            "name": self.names,
+            **self.numeric,
+        }
+
+    def set_arrays(self, arrays: dict) -> None:
+        self.item_ids = arrays["item_id"]
+        self.types = arrays["type"]
+        self.owned = arrays["owned"]
+        self.names = arrays["name"]
+        self.numeric = {column: arrays[column] for column in NUMERIC_COLUMNS}
+
+    def column_arrays(self, rows: list) -> dict:
+        """
+        Converts rows (mappings with all snapshot columns) into column arrays.
+        """
+        return {
+            "item_id": np.array([row["item_id"] for row in rows], dtype=np.int32),
+            "type": np.array(
+                [TYPE_CODES.get(row.get("type"), -1) for row in rows], dtype=np.int8
+            ),
+            "owned": np.array([bool(row.get("owned")) for row in rows], dtype=bool),
+            "name": np.array(
+                [(row.get("name") or "").casefold() for row in rows], dtype=object
+            ),
+            **{
+                column: float_array([row.get(column) for row in rows])
+                for column in NUMERIC_COLUMNS
+            },
+        }
+
+    def snapshot_query(self):
+        return select(
+            Boardgame.c.item_id,
+            Boardgame.c.type,
+            Boardgame.c.owned,
+            Boardgame.c.name,
+            *(Boardgame.c[column] for column in NUMERIC_COLUMNS),
+        ).order_by(Boardgame.c.item_id)
+
+    def build(self) -> None:
+        """
+        Loads the snapshot from every game in the database.
+        """
+        with self.lock:
+            if self.built:
+                return
+            started = time.perf_counter()
+            chunks = []
+            # read first, so games written during the build are caught up by sync
+            self.synced_at = database.get_catalog_updated_at()
+            query = self.snapshot_query()
+            with database.engine.connect() as conn:
+                result = conn.execution_options(yield_per=10000).execute(query)
+                for partition in result.mappings().partitions():
+                    chunks.append(self.column_arrays(partition))
+            if chunks:
+                self.set_arrays(
+                    {
+                        column: np.concatenate([chunk[column] for chunk in chunks])
+                        for column in chunks[0]
+                    }
+                )
+            self.size = len(self.item_ids) if chunks else 0
+            self.name_ranks = None
+            self.built = True
+            self.build_seconds = time.perf_counter() - started
+            print(
+                f"Catalog snapshot of {self.size} games built in {self.build_seconds:.2f}s "
+                f"({self.memory_usage()['total'] / 2**20:.1f} MB)."
+            )
+
+    def sync(self) -> None:
+        """
+        Applies the games written since the snapshot was built or last synced, by this
+        or any other process: new games are appended and changed games overwritten.
+        Costs one read of the end of the updated_at index while nothing changed.
+        """
+        latest = database.get_catalog_updated_at()
+        with self.lock:
+            if not self.built or latest is None:
+                return
+            if self.synced_at is not None and latest <= self.synced_at:
+                return
+            query = self.snapshot_query()
+            if self.synced_at is not None:
+                # >= rereads games written in the same instant as the last sync
+                query = query.where(Boardgame.c.updated_at >= self.synced_at)
+            else:
+                query = query.where(Boardgame.c.updated_at != None)
+            with database.engine.connect() as conn:
+                rows = conn.execute(query).mappings().all()
+            self.synced_at = latest
+            if not rows:
+                return
+            arrays = self.column_arrays(rows)
+            positions, found = self.positions(arrays["item_id"])
+            current = self.arrays()
+            for column, values in arrays.items():
+                current[column][positions[found]] = values[found]
+            if not found.all():
+                self.append({column: values[~found] for column, values in arrays.items()})
+            self.name_ranks = None
+            self.synced += len(rows)
+
+    def positions(self, item_ids: np.ndarray) -> tuple:
+        """
+        Finds the rows of item IDs in the snapshot.
+
+        Returns:
+            The row positions and a mask of the IDs that were found.
+        """
+        known = self.item_ids[: self.size]
+        positions = np.searchsorted(known, item_ids)
+        found = positions < self.size
+        found[found] = known[positions[found]] == item_ids[found]
+        return positions, found
+
+    def append(self, arrays: dict) -> None:
+        """
+        Appends new rows, growing the arrays by doubling so a harvest of many small
+        batches stays linear. Rows are re-sorted by ID if new IDs are not the highest.
+        """
+        count = len(arrays["item_id"])
+        current = self.arrays()
+        if self.size + count > len(self.item_ids):
+            capacity = max(2 * len(self.item_ids), self.size + count, 1024)
+            grown = {}
+            for column, values in current.items():
+                grown[column] = np.empty(capacity, dtype=values.dtype)
+                grown[column][: self.size] = values[: self.size]
+            self.set_arrays(grown)
+            current = grown
+        end = self.size + count
+        for column, values in arrays.items():
+            current[column][self.size : end] = values
+        in_order = self.size == 0 or arrays["item_id"].min() > current["item_id"][self.size - 1]
+        self.size = end
+        if not in_order or np.any(np.diff(arrays["item_id"]) < 0):
+            order = np.argsort(current["item_id"][:end], kind="stable")
+            for values in current.values():
+                values[:end] = values[:end][order]
+        self.name_ranks = None
+
+    def add_rows(self, rows: list) -> None:
+        """
+        Adds inserted games that are not in the snapshot yet. Existing games are
+        left alone, like the ON CONFLICT DO NOTHING insert. Used as insert listener.
+
+        Args:
+            rows: The inserted rows as dictionaries.
+        """
+        with self.lock:
+            if not self.built or not rows:
+                return
+            item_ids = np.array([row["item_id"] for row in rows], dtype=np.int32)
+            _, found = self.positions(item_ids)
+            new_rows = [row for row, exists in zip(rows, found) if not exists]
+            if new_rows:
+                self.append(self.column_arrays(new_rows))
+                self.inserted += len(new_rows)
+
+    def update_rows(self, rows: list) -> None:
+        """
+        Writes changed columns of existing games into the snapshot. Used as update listener.
+
+        Args:
+            rows: Dictionaries with the item ID and the new values of the changed columns.
+        """
+        with self.lock:
+            if not self.built or not rows:
+                return
+            item_ids = np.array([row["item_id"] for row in rows], dtype=np.int32)
+            positions, found = self.positions(item_ids)
+            for row, position, exists in zip(rows, positions, found):
+                if not exists:
+                    continue
+                for column, value in row.items():
+                    if column in self.numeric:
+                        self.numeric[column][position] = np.nan if value is None else value
+                    elif column == "owned":
+                        self.owned[position] = bool(value)
+                    elif column == "type":
+                        self.types[position] = TYPE_CODES.get(value, -1)
+                    elif column == "name":
+                        self.names[position] = (value or "").casefold()
+                        self.name_ranks = None
+                self.updated += 1
+
+    def sort_key(self, column: str, descending: bool, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the sort key of a column for the given rows, ascending order of the key
+        being the requested order. NULLs (NaN) sort last in both directions.
+        """
+        if column == "name":
+            if self.name_ranks is None:
+                names = self.names[: self.size]
+                self.name_ranks = np.empty(self.size, dtype=np.int32)
+                self.name_ranks[np.argsort(names, kind="stable")] = np.arange(
+                    self.size, dtype=np.int32
+                )
+            values = self.name_ranks[rows]
+        elif column == "item_id":
+            values = self.item_ids[rows]
+        elif column == "type":
+            values = self.types[rows]
+        elif column == "owned":
+            values = self.owned[rows].astype(np.int8)
+        else:
+            values = self.numeric[column][rows]
+        return -values if descending else values
+
+    def sorted_ids(
+        self,
+        sort: list,
+        limit: int,
+        skip: int = 0,
+        item_type: str = None,
+        owned: bool = None,
+    ) -> list:
+        """
+        Sorts the games by several columns and returns one page of IDs, ties broken by ID.
+        Only the games that can end up on the page are fully sorted: the first key is
+        partitioned with argpartition to the best skip + limit games and their ties.
+
+        Args:
+            sort: (column, descending) tuples, see parse_sort.
+            limit: The number of IDs to return.
+            skip: The number of games to skip.
+            item_type: Optional type the games must have, e.g. "boardgame".
+            owned: Optional ownership status the games must have.
+
+        Returns:
+            The item IDs of the page in order.
+        """
+        if not self.built:
+            self.build()
+        self.sync()
+        with self.lock:
+            mask = np.ones(self.size, dtype=bool)
+            if item_type is not None:
+                mask &= self.types[: self.size] == TYPE_CODES.get(item_type, -1)
+            if owned is not None:
+                mask &= self.owned[: self.size] == owned
+            rows = np.flatnonzero(mask)
+            needed = skip + limit
+            if not rows.size or limit <= 0:
+                return []
+            keys = [self.sort_key(column, descending, rows) for column, descending in sort]
+            if needed < rows.size:
+                threshold = np.partition(keys[0], needed - 1)[needed - 1]
+                if not np.isnan(threshold):
+                    candidates = keys[0] <= threshold
+                    rows = rows[candidates]
+                    keys = [key[candidates] for key in keys]
+            # lexsort sorts by the last key first
+            order = np.lexsort([self.item_ids[rows], *reversed(keys)])
+            return self.item_ids[rows[order[skip:needed]]].tolist()
+
+    def memory_usage(self) -> dict:
+        """
+        Reports the memory held by the snapshot in bytes, by column and in total.
+        Name strings are counted with their Python object size.
+        """
+        with self.lock:
+            usage = {column: values.nbytes for column, values in self.arrays().items()}
+            usage["name"] += sum(sys.getsizeof(name) for name in self.names[: self.size])
+            usage["name_ranks"] = self.name_ranks.nbytes if self.name_ranks is not None else 0
+            usage["total"] = sum(usage.values())
+            return usage
+
+    def stats(self) -> dict:
+        """
+        Reports the size, build time, applied changes, games caught up from the
+        database and memory footprint of the snapshot.
+
+        Returns:
+            A dictionary with the snapshot statistics.
+        """
+        with self.lock:
+            return {
+                "built": self.built,
+                "rows": self.size,
+                "capacity": len(self.item_ids),
+                "build_seconds": round(self.build_seconds, 3),
+                "inserted": self.inserted,
+                "updated": self.updated,
+                "synced": self.synced,
+                "synced_at": self.synced_at.isoformat() if self.synced_at else None,
+                "memory_bytes": self.memory_usage(),
+            }
+
+
+catalog_snapshot = CatalogSnapshot()
+database.insert_listeners.append(catalog_snapshot.add_rows)
+database.update_listeners.append(catalog_snapshot.update_rows)
+
+
+def get_sorted_items(
+    sort: list, limit: int, skip: int = 0, item_type: str = None, owned: bool = None
+) -> list:
+    """
+    Retrieves a page of games sorted by any columns of the catalog snapshot.
+
+    Args:
+        sort: (column, descending) tuples, see parse_sort.
+        limit: The number of games to retrieve.
+        skip: The number of games to skip.
+        item_type: Optional type the games must have.
+        owned: Optional ownership status the games must have.
+
+    Returns:
+        A list of list view rows (database.LIST_VIEW_COLUMNS) in sort order.
+    """
+    item_ids = catalog_snapshot.sorted_ids(sort, limit, skip, item_type, owned)
+    return database.get_list_items(item_ids)
@@ -0,0 +1,304 @@
+"""
+Resumable crawl of the BGG ID space across gaps, shared by several processes.
+
+The ID space is split into shards of CRAWL_SHARD_SIZE IDs stored in the crawl_shards
+table. A process claims one shard at a time, crawls it batch by batch, and saves its
+resume cursor after every batch, so a crash or a cancel loses at most the requests
+in flight. Batches without any game are recorded in crawl_gaps and never end a
+shard early. New shards are added past the highest shard once probes with
+exponentially growing lookahead find games there; the crawl ends when probing
+CRAWL_MAX_LOOKAHEAD IDs past the last game finds nothing.
+
+Usage:
+    python crawler.py --processes 4
+    python crawler.py --status
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import bgg_api
+import database
+import pipeline
+
+CRAWL_SHARD_SIZE = int(os.getenv("CRAWL_SHARD_SIZE", "10000"))  # IDs per shard
+# IDs probed past the highest game before the crawl declares the end of the catalog
+CRAWL_MAX_LOOKAHEAD = int(os.getenv("CRAWL_MAX_LOOKAHEAD", "50000"))
+# A claimed shard without progress for this long is taken over by another process
+CRAWL_CLAIM_TIMEOUT = float(os.getenv("CRAWL_CLAIM_TIMEOUT", "900"))  # seconds
+# IDs per probe request
+PROBE_SIZE = bgg_api.MAX_BATCH_SIZE
+
+
+def worker_name() -> str:
+    """
+    Names this process in the claims of the crawl_shards table.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def shard_ranges(start_id: int, end_id: int, shard_size: int = CRAWL_SHARD_SIZE) -> list:
+    """
+    Splits [start_id, end_id) into shards aligned to multiples of the shard size,
+    so processes extending the crawl at the same time create the same shards.
+
+    Returns:
+        A list of (start_id, end_id) tuples.
+    """
+    ranges = []
+    while start_id < end_id:
+        shard_end = (start_id // shard_size + 1) * shard_size
+        ranges.append((start_id, shard_end))
+        start_id = shard_end
+    return ranges
+
+
+def seed_shards() -> None:
+    """
+    Creates the first shards from the stored games, once per database. IDs up to the
+    highest stored game were crawled without gaps by the previous harvester, so their
+    shards start out done; the rest of the shard holding it is left to crawl.
+    """
+    if database.get_crawl_frontier() is not None:
+        return
+    highest_id = database.get_highest_id()
+    if not highest_id:
+        return
+    cursor = highest_id + 1
+    database.add_crawl_shards(
+        [
+            {
+                "start_id": start_id,
+                "end_id": end_id,
+                "next_id": min(cursor, end_id),
+                "status": database.CRAWL_DONE if end_id <= cursor else database.CRAWL_PENDING,
+            }
+            for start_id, end_id in shard_ranges(0, cursor)
+        ]
+    )
+
+
+def fetch_probe(start_id: int, session, bucket) -> dict:
+    """
+    Fetches one probe batch and stores the games it found.
+
+    Returns:
+        The parsed games of the batch.
+    """
+    item_ids = ",".join(str(item_id) for item_id in range(start_id, start_id + PROBE_SIZE))
+    items_data = bgg_api.parse_games_data(bgg_api.get_api_data(item_ids, session, bucket))
+    if items_data:
+        database.insert_items_data(items_data)
+    return items_data
+
+
+def find_catalog_end(start_id: int, probe: Callable[[int], dict]) -> int:
+    """
+    Probes the IDs from start_id on with exponentially growing lookahead: batches at
+    offsets 0, 1, 2, 4, 8... probe sizes past the highest game found so far. A hit moves
+    the base to the game it found and keeps doubling, so a long run of games is
+    crossed in a few requests; the gaps between probes are crawled by the shards.
+
+    Args:
+        start_id: The first ID past the crawled ID space.
+        probe: Callable fetching the batch starting at an ID, returning its games.
+
+    Returns:
+        The ID after the highest game found, or start_id if the probes found none
+        within CRAWL_MAX_LOOKAHEAD IDs.
+    """
+    end_id = start_id
+    offset = 0
+    while offset <= CRAWL_MAX_LOOKAHEAD:
+        items_data = probe(end_id + offset)
+        if items_data:
+            end_id = max(items_data) + 1
+        offset = offset * 2 or PROBE_SIZE
+    return end_id
+
+
+def extend_frontier(session, bucket) -> bool:
+    """
+    Probes past the highest shard and adds shards up to the highest game found.
+
+    Returns:
+        True if new shards were added, False if the crawl reached the end of the catalog.
+    """
+    frontier = database.get_crawl_frontier() or 0
+    end_id = find_catalog_end(
+        frontier, lambda start_id: fetch_probe(start_id, session, bucket)
+    )
+    if end_id <= frontier:
+        return False
+    database.add_crawl_shards(
+        [
+            {"start_id": start_id, "end_id": shard_end, "next_id": start_id}
+            for start_id, shard_end in shard_ranges(frontier, end_id)
+        ]
+    )
+    return True
+
+
+def crawl_shard(
+    shard,
+    worker: str,
+    workers: int,
+    stop_event: threading.Event,
+    progress: Callable[[dict], None],
+) -> dict:
+    """
+    Crawls a claimed shard from its cursor to its end, saving the cursor after every
+    batch. Stops early if the claim was taken over. The shard is handed back if the
+    crawl is cancelled or a batch fails.
+
+    Returns:
+        The harvest statistics of the shard.
+    """
+
+    def save(start_id: int, size: int, items_data: dict) -> bool:
+        gap = None if items_data else (start_id, start_id + size)
+        return database.save_crawl_progress(
+            shard.start_id, worker, start_id + size, len(items_data), gap
+        )
+
+    try:
+        stats = bgg_api.harvest_range(
+            shard.next_id,
+            shard.end_id,
+            workers=workers,
+            progress=progress,
+            stop_event=stop_event,
+            on_batch=save,
+        )
+    except Exception:
+        database.release_crawl_shard(shard.start_id, worker)
+        raise
+    if stats["cancelled"]:
+        database.release_crawl_shard(shard.start_id, worker)
+    return stats
+
+
+def crawl(
+    workers: int = bgg_api.HARVEST_WORKERS,
+    progress: Callable[[dict], None] = None,
+    stop_event: threading.Event = None,
+) -> dict:
+    """
+    Crawls shards until none is left and probing finds no new games, or until stopped.
+    Several processes can crawl at the same time; each claims its own shards.
+
+    Args:
+        workers: The number of concurrent batch requests of this process. All requests
+            share the process-wide api_rate_limiter.
+        progress: Optional callback receiving the statistics after every batch.
+        stop_event: Optional event that stops the crawl after the requests in flight.
+
+    Returns:
+        A dictionary with the crawl statistics: items, batches, empty_batches, retries,
+        shards, start_id, current_id, cancelled, seconds, items_per_second and the
+        pipeline stages of the current or last shard.
+    """
+    worker = worker_name()
+    stop_event = stop_event or threading.Event()
+    stats = {
+        "items": 0,
+        "batches": 0,
+        "empty_batches": 0,
+        "retries": 0,
+        "shards": 0,
+        "start_id": None,
+        "current_id": None,
+        "cancelled": False,
+        "items_per_second": 0.0,
+        "stages": {},
+    }
+    started = time.monotonic()
+    seed_shards()
+    reopened = database.reopen_crawl_tail(database.get_highest_id() + 1)
+    if reopened:
+        print(f"Reopened {reopened} shards above the highest stored game.")
+
+    def shard_progress(shard_stats: dict) -> None:
+        stats["current_id"] = shard_stats["current_id"]
+        stats["stages"] = shard_stats["stages"]
+        stats["items_per_second"] = (
+            stats["items"] + shard_stats["items"]
+        ) / (time.monotonic() - started)
+        if progress:
+            progress({**stats, "items": stats["items"] + shard_stats["items"]})
+
+    with bgg_api.create_session(1) as session:
+        while not stop_event.is_set():
+            stale_before = datetime.now() - timedelta(seconds=CRAWL_CLAIM_TIMEOUT)
+            shard = database.claim_crawl_shard(worker, stale_before)
+            if shard is None:
+                if extend_frontier(session, bgg_api.api_rate_limiter):
+                    continue
+                break
+            print(f"Crawling shard {shard.start_id}-{shard.end_id} from {shard.next_id}.")
+            if stats["start_id"] is None:
+                stats["start_id"] = shard.next_id
+            shard_stats = crawl_shard(shard, worker, workers, stop_event, shard_progress)
+            for key in ("items", "batches", "empty_batches", "retries"):
+                stats[key] += shard_stats[key]
+            stats["stages"] = shard_stats["stages"]
+            stats["shards"] += 1
+    stats["cancelled"] = stop_event.is_set()
+    stats["seconds"] = time.monotonic() - started
+    stats["items_per_second"] = stats["items"] / stats["seconds"]
+    outcome = "Crawl cancelled" if stats["cancelled"] else "Crawl reached the end of the catalog"
+    print(
+        f"{outcome}: {stats['items']} items from {stats['shards']} shards "
+        f"in {stats['seconds']:.1f}s."
+    )
+    return stats
+
+
+def crawl_process(rate: float) -> None:
+    """
+    Entry point of a crawler process started by main, limited to its share of the rate.
+    """
+    bgg_api.api_rate_limiter = bgg_api.TokenBucket(rate, bgg_api.HARVEST_BURST)
+    try:
+        crawl()
+    finally:
+        pipeline.shutdown_parse_pools()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=bgg_api.HARVEST_RATE,
+        help="requests per second of all processes together",
+    )
+    parser.add_argument("--status", action="store_true", help="print the crawl state")
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(database.get_crawl_summary(), indent=2, default=str))
+        return
+    database.create_database_tables()
+    # fresh interpreters, so no process inherits the parent's database connections
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=crawl_process, args=(args.rate / args.processes,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    print(json.dumps(database.get_crawl_summary(), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
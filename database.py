@@ -1,13 +1,27 @@
+import operator
 import os
+import threading
+import time
 from sqlalchemy import create_engine, MetaData, update
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import insert, select
-from datetime import datetime
+from sqlalchemy import insert, delete, select, bindparam, case, func, literal_column, not_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from datetime import date, datetime, timedelta
+
+from cache import item_tags, result_cache
+import metrics
 
 from sqlalchemy import (
     Table,
     Column,
+    Index,
+    UniqueConstraint,
     Boolean,
+    Date,
+    DateTime,
     Integer,
     String,
     Text,
@@ -16,8 +30,110 @@ from sqlalchemy import (
 
 # Database connection setup
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# "queue" keeps a pool of connections, "null" opens one per checkout for short-lived jobs
+DB_POOL = os.getenv("DB_POOL", "queue")
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))  # seconds, -1 never
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+_engine = None
+_engine_lock = threading.Lock()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    Connection pool recording how long every checkout waited for a connection,
+    and how many checkouts timed out because the pool was exhausted.
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            metrics.pool_checkout_timeouts.inc()
+            raise
+        finally:
+            metrics.pool_checkout_seconds.observe(time.perf_counter() - started)
+
+
+def create_database_engine(database_url: str = None):
+    """
+    Creates an engine with the pool settings of the environment and
+    instruments it for the metrics endpoint. No connection is opened yet.
+
+    Args:
+        database_url: The database URL. Defaults to DATABASE_URL.
+
+    Returns:
+        The SQLAlchemy engine.
+    """
+    options = {"pool_pre_ping": POOL_PRE_PING, "query_cache_size": STATEMENT_CACHE_SIZE}
+    if DB_POOL == "null":
+        options["poolclass"] = NullPool
+    else:
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+        )
+    new_engine = create_engine(database_url or DATABASE_URL, **options)
+    metrics.instrument_engine(new_engine)
+    return new_engine
+
+
+def get_engine():
+    """
+    Returns the engine of the process, created on first use so that importing
+    this module opens no connections. Also available as `database.engine`.
+
+    Returns:
+        The SQLAlchemy engine.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_database_engine()
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def __getattr__(name: str):
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+BOARDGAME_TYPES = ("boardgame", "boardgameexpansion", "boardgameaccessory")
+FACET_KINDS = (
+    "categories",
+    "mechanics",
+    "families",
+    "designers",
+    "artists",
+    "publishers",
+)
+STAT_COLUMNS = (
+    "users_rated",
+    "average_rating",
+    "bayes_average",
+    "bgg_rank",
+    "num_weights",
+    "average_weight",
+)
+# Columns kept by the collection instead of parsed from the BGG API, left untouched
+# when insert_items_data replaces the data of existing games
+COLLECTION_COLUMNS = ("owned", "times_played", "dates_played", "comments")
+# Callbacks run with the inserted rows after every insert_items_data call
+insert_listeners = []
+# Callbacks run with the item ID and the changed columns of updated games
+update_listeners = []
 
 # Database table definition
 metadata = MetaData()
@@ -56,6 +172,174 @@ Boardgame = Table(
     Column("average_weight", Float),
     Column("thumbnail", String),
     Column("image", String),
+    Column("last_refreshed", DateTime, index=True),
+    # stamped when the similar games list was computed, even if it came out empty;
+    # NULL marks the games the recommender still has to compute
+    Column("recommended_at", DateTime, index=True),
+    # stamped by every write to the row, the validator of cached HTTP responses
+    Column("updated_at", DateTime, default=datetime.now, onupdate=datetime.now, index=True),
+    # supports the top games ranking and its keyset pagination; the range filters of
+    # get_filtered_items are checked on the trailing columns while walking the ranking,
+    # so filtered pages need neither a sort nor a table read per skipped game
+    Index(
+        "ix_boardgames_ranking_filters",
+        "type",
+        "bayes_average",
+        "item_id",
+        "average_weight",
+        "maxplaytime",
+        "minplaytime",
+        "minplayers",
+        "maxplayers",
+        "age",
+        "yearpublished",
+    ),
+    # selective year and weight ranges (min_year=2030, min_weight=4.8) match few games
+    # spread over the whole ranking; these read just the matches and sort them
+    Index("ix_boardgames_year_ranking", "type", "yearpublished", "bayes_average", "item_id"),
+    Index("ix_boardgames_weight_ranking", "type", "average_weight", "bayes_average", "item_id"),
+)
+# Ranked games are refreshed before unranked ones. The 0 is inlined, since SQLite only
+# uses a partial index if the query repeats its condition, not with a bound parameter.
+RANKED = Boardgame.c.bgg_rank > literal_column("0")
+UNRANKED = Boardgame.c.bgg_rank <= literal_column("0")
+# support get_refresh_candidates: one range per (owned, ranked) tier, never
+# refreshed games first by ID, then the stale ones oldest first
+Index(
+    "ix_boardgames_refresh_ranked",
+    Boardgame.c.owned,
+    Boardgame.c.last_refreshed,
+    Boardgame.c.item_id,
+    sqlite_where=RANKED,
+    postgresql_where=RANKED,
+)
+Index(
+    "ix_boardgames_refresh_unranked",
+    Boardgame.c.owned,
+    Boardgame.c.last_refreshed,
+    Boardgame.c.item_id,
+    sqlite_where=UNRANKED,
+    postgresql_where=UNRANKED,
+)
+# Indexes replaced by wider ones or found not to pay off, dropped by
+# startup.check_schema_up_to_date. The BRIN index on yearpublished assumed the
+# physical order follows the year, which refreshes and gap crawls do not keep.
+OBSOLETE_INDEXES = (
+    "ix_boardgames_type_bayes_average_item_id",
+    "ix_boardgames_yearpublished_brin",
+)
+
+# Range filters of get_filtered_items: filter name -> (column, comparison),
+# e.g. max_playtime=60 keeps games with maxplaytime <= 60
+RANGE_FILTERS = {
+    "min_playtime": ("minplaytime", operator.ge),
+    "max_playtime": ("maxplaytime", operator.le),
+    "min_weight": ("average_weight", operator.ge),
+    "max_weight": ("average_weight", operator.le),
+    "min_age": ("age", operator.ge),
+    "max_age": ("age", operator.le),
+    "min_year": ("yearpublished", operator.ge),
+    "max_year": ("yearpublished", operator.le),
+}
+# BGG reports 0 for an unknown play time or weight, excluded by upper bounds
+ZERO_IS_UNKNOWN = ("maxplaytime", "average_weight")
+# Range filters with an index led by their column, column -> index name
+RANGE_INDEXES = {
+    "yearpublished": "ix_boardgames_year_ranking",
+    "average_weight": "ix_boardgames_weight_ranking",
+}
+# A year or weight range matching fewer games is read from its index and sorted;
+# a wider one finds a page sooner by walking the ranking
+SELECTIVE_MATCHES = 1000
+
+# Columns rendered in item lists (item.html). The description and the link lists
+# are only loaded for detail requests.
+LIST_VIEW_COLUMNS = (
+    "item_id",
+    "type",
+    "name",
+    "owned",
+    "times_played",
+    "comments",
+    "minplayers",
+    "maxplayers",
+    "bayes_average",
+    "average_weight",
+    "thumbnail",
+)
+list_view = [Boardgame.c[column] for column in LIST_VIEW_COLUMNS]
+
+# Normalized link lists: one entity per (kind, name), e.g. ("mechanics", "Deck Building")
+Entity = Table(
+    "entities",
+    metadata,
+    Column("entity_id", Integer, primary_key=True),
+    Column("kind", String, nullable=False),
+    Column("name", String, nullable=False),
+    UniqueConstraint("kind", "name", name="uq_entities_kind_name"),
+)
+BoardgameEntity = Table(
+    "boardgame_entities",
+    metadata,
+    Column("item_id", Integer, primary_key=True),
+    Column("entity_id", Integer, primary_key=True),
+    Index("ix_boardgame_entities_entity_id_item_id", "entity_id", "item_id"),
+)
+
+# Precomputed top-k most similar games of every game
+SimilarItem = Table(
+    "similar_items",
+    metadata,
+    Column("item_id", Integer, primary_key=True),
+    Column("similar_id", Integer, primary_key=True),
+    Column("score", Float, nullable=False),
+)
+
+# Play log, one row per play. boardgames.times_played is kept as the aggregate.
+Play = Table(
+    "plays",
+    metadata,
+    Column("play_id", Integer, primary_key=True, autoincrement=True),
+    Column("item_id", Integer, nullable=False),
+    Column("played_on", Date, nullable=False),
+    Column("players", Integer),
+    Column("notes", Text),
+    # play history of one game and the latest dates of a page of games
+    Index("ix_plays_item_id_played_on_play_id", "item_id", "played_on", "play_id"),
+    # play history of the whole collection by date range
+    Index("ix_plays_played_on_play_id", "played_on", "play_id"),
+)
+# Number of latest play dates rendered per game
+PLAY_DATES_SHOWN = 10
+
+# Number of BGG API requests spent on refreshing stats per day
+RefreshUsage = Table(
+    "refresh_usage",
+    metadata,
+    Column("day", Date, primary_key=True),
+    Column("requests", Integer, nullable=False, default=0),
+)
+
+# Crawl state: the BGG ID space split into shards [start_id, end_id) that crawler
+# processes claim one at a time. next_id is the resume cursor within the shard.
+CRAWL_PENDING, CRAWL_CLAIMED, CRAWL_DONE = "pending", "claimed", "done"
+CrawlShard = Table(
+    "crawl_shards",
+    metadata,
+    Column("start_id", Integer, primary_key=True),
+    Column("end_id", Integer, nullable=False),
+    Column("next_id", Integer, nullable=False),
+    Column("status", String, nullable=False, default=CRAWL_PENDING),
+    Column("claimed_by", String),
+    Column("heartbeat_at", DateTime),
+    Column("found_items", Integer, nullable=False, default=0),
+)
+# Crawled ID ranges [start_id, end_id) without any game, adjacent ranges merged
+CrawlGap = Table(
+    "crawl_gaps",
+    metadata,
+    Column("start_id", Integer, primary_key=True),
+    Column("end_id", Integer, nullable=False),
 )
 
 
@@ -63,101 +347,1432 @@ def create_database_tables() -> None:
     """
     Creates the database tables defined in the metadata object.
     """
-    metadata.create_all(engine)
+    metadata.create_all(get_engine())
+
+
+def list_to_text(values: list) -> str:
+    """
+    Converts a list of values into the text stored in the list columns.
+    Uses the Postgres array literal format, so rows look the same on every database.
+
+    Args:
+        values: The list of values to convert.
+
+    Returns:
+        The list as a Postgres array literal, e.g. {"Card Game",Economic}.
+    """
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+            continue
+        value = str(value)
+        if (
+            not value
+            or value.upper() == "NULL"
+            or any(char in value for char in '{}",\\')
+            or any(char.isspace() for char in value)
+        ):
+            value = '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        elements.append(value)
+    return "{" + ",".join(elements) + "}"
+
+
+def text_to_list(value: str) -> list:
+    """
+    Converts the text stored in a list column back into a list of values.
+
+    Args:
+        value: A Postgres array literal as written by list_to_text.
+
+    Returns:
+        The list of values.
+    """
+    values = []
+    if not value or len(value) < 3:
+        return values
+    position, end = 1, len(value) - 1
+    while position < end:
+        if value[position] == '"':
+            position += 1
+            element = []
+            while value[position] != '"':
+                if value[position] == "\\":
+                    position += 1
+                element.append(value[position])
+                position += 1
+            values.append("".join(element))
+            position += 1
+        else:
+            comma = value.find(",", position)
+            comma = end if comma == -1 else comma
+            element = value[position:comma]
+            values.append(None if element.upper() == "NULL" else element)
+            position = comma
+        position += 1
+    return values
+
+
+def prepare_row(data: dict) -> dict:
+    """
+    Prepares parsed item data for insertion by converting lists into text.
+
+    Args:
+        data: The parsed data of a single item.
+
+    Returns:
+        A dictionary with column values.
+    """
+    return {
+        key: list_to_text(value) if isinstance(value, list) else value
+        for key, value in data.items()
+    }
+
+
+def dialect_insert(dialect_name: str):
+    """
+    Returns the insert construct with ON CONFLICT support for the dialect.
+
+    Args:
+        dialect_name: The name of the database dialect ("postgresql" or "sqlite").
+    """
+    return postgresql.insert if dialect_name == "postgresql" else sqlite.insert
 
 
-def insert_items_data(game_data: dict) -> None:
+@compiles(Table, "sqlite")
+def compile_sqlite_table(table, compiler, **kw) -> str:
     """
-    Inserts board games data into the database, checking for duplicates first.
+    Renders the FROM hints of SQLite, e.g. with_hint(Boardgame, "INDEXED BY ...",
+    "sqlite"), which its compiler otherwise drops.
+    """
+    text = compiler.visit_table(table, **kw)
+    hints = kw.get("fromhints")
+    if kw.get("asfrom") and hints and table in hints:
+        text += " " + hints[table]
+    return text
+
+
+def parsed_columns() -> tuple:
+    """
+    Returns the columns of the boardgames table filled from the BGG API data.
+    """
+    return tuple(
+        column.name
+        for column in Boardgame.columns
+        if column.name not in ("item_id", *COLLECTION_COLUMNS, "last_refreshed", "updated_at")
+    )
+
+
+def upsert_statement(dialect_name: str, update_columns: tuple, refreshed: bool = True):
+    """
+    Builds an INSERT ... ON CONFLICT statement for the boardgames table.
+    Executed with a list of rows, SQLAlchemy sends it as multi-row VALUES batches
+    on Postgres and as a single prepared executemany on SQLite.
+
+    Args:
+        dialect_name: The name of the database dialect ("postgresql" or "sqlite").
+        update_columns: The columns to update on existing rows, empty to skip them.
+        refreshed: Whether updated rows also get the new last_refreshed time.
+
+    Returns:
+        The insert statement.
+    """
+    statement = dialect_insert(dialect_name)(Boardgame)
+    if update_columns:
+        stamps = ("last_refreshed", "updated_at") if refreshed else ("updated_at",)
+        return statement.on_conflict_do_update(
+            index_elements=[Boardgame.c.item_id],
+            set_={column: statement.excluded[column] for column in (*update_columns, *stamps)},
+        )
+    return statement.on_conflict_do_nothing(index_elements=[Boardgame.c.item_id])
+
+
+def notify_updated(rows: list) -> None:
+    """
+    Passes the changed columns of updated games to every callback in update_listeners.
+
+    Args:
+        rows: Dictionaries with the item ID and the new values of the changed columns.
+    """
+    for listener in update_listeners:
+        listener(rows)
+
+
+def insert_items_data(game_data: dict, update_stats: bool = False, replace: bool = False) -> None:
+    """
+    Inserts board games data into the database with one set-based write per batch.
+    Existing items are skipped, or get their stat columns updated if update_stats is set,
+    or every column parsed from the API if replace is set.
+    The categories, mechanics, families, designers, artists and publishers are also
+    stored in the normalized entity tables.
+    Afterwards cached results containing the items and the cached ranking pages are
+    invalidated and the written rows are passed to every callback in insert_listeners,
+    the updated stats also to update_listeners.
 
     Args:
         game_data: A dictionary containing board games data.
+        update_stats: Whether to update the stat columns of items that already exist.
+        replace: Whether to replace all API data of items that already exist, keeping
+            the collection columns, e.g. after reparsing archived responses. The data
+            may be old, so last_refreshed is left as it is, and new items get none,
+            which puts them first in line for the stats refresh. Their entity links
+            are replaced too.
     """
-    with engine.begin() as conn:
-        for new_item_id, data in game_data.items():
-            is_boardgame = (
-                data["type"] == "boardgame"
-                or data["type"] == "boardgameexpansion"
-                or data["type"] == "boardgameaccessory"
+    update_columns = parsed_columns() if replace else STAT_COLUMNS if update_stats else ()
+    refreshed_at = None if replace else datetime.now()
+    rows = [
+        {**prepare_row(data), "last_refreshed": refreshed_at}
+        for data in game_data.values()
+        if data["type"] in BOARDGAME_TYPES
+    ]
+    if not rows:
+        return
+    with get_engine().begin() as conn:
+        dialect_name = conn.dialect.name
+        if dialect_name in ("postgresql", "sqlite"):
+            conn.execute(
+                upsert_statement(dialect_name, update_columns, refreshed=not replace), rows
             )
-            if is_boardgame:
-                existing_game = conn.execute(
-                    select(Boardgame).where(Boardgame.c.item_id == new_item_id)
-                ).fetchone()
-                if not existing_game:
-                    conn.execute(insert(Boardgame).values(data))
+        else:
+            insert_items_generic(conn, rows, update_columns, refreshed=not replace)
+        if replace:
+            delete_item_links(conn, [row["item_id"] for row in rows])
+        insert_item_links(
+            conn,
+            {
+                data["item_id"]: {kind: data.get(kind, []) for kind in FACET_KINDS}
+                for data in game_data.values()
+                if data["type"] in BOARDGAME_TYPES
+            },
+        )
+    result_cache.invalidate("ranking", *(f"item:{row['item_id']}" for row in rows))
+    for listener in insert_listeners:
+        listener(rows)
+    if update_columns:
+        notify_updated(
+            [{key: row[key] for key in ("item_id", *update_columns)} for row in rows]
+        )
 
 
-def update_item_ownership(item_id: int) -> None:
+def insert_items_generic(
+    conn, rows: list, update_columns: tuple, refreshed: bool = True
+) -> None:
     """
-    Toggles the ownership status (owned/not owned) of a game in the database.
+    Inserts rows on databases without INSERT ... ON CONFLICT support.
+    Looks up the existing IDs in one query and writes the new rows in one executemany INSERT.
 
     Args:
-        item_id: The ID of the game to update.
+        conn: The open database connection.
+        rows: The rows to insert.
+        update_columns: The columns to update on existing rows, empty to skip them.
+        refreshed: Whether updated rows also get the new last_refreshed time.
     """
-    with engine.begin() as conn:
-        current_status = conn.execute(
-            select(Boardgame.c.owned).where(Boardgame.c.item_id == item_id)
-        ).scalar()
-        new_status = not current_status
+    if refreshed:
+        update_columns = (*update_columns, "last_refreshed")
+    existing_ids = set(
+        conn.execute(
+            select(Boardgame.c.item_id).where(
+                Boardgame.c.item_id.in_([row["item_id"] for row in rows])
+            )
+        ).scalars()
+    )
+    new_rows = [row for row in rows if row["item_id"] not in existing_ids]
+    if new_rows:
+        conn.execute(insert(Boardgame), new_rows)
+    if update_columns and existing_ids:
         conn.execute(
             update(Boardgame)
-            .where(Boardgame.c.item_id == item_id)
-            .values(owned=new_status)
+            .where(Boardgame.c.item_id == bindparam("b_item_id"))
+            .values(
+                {
+                    column: bindparam(f"b_{column}")
+                    for column in update_columns
+                }
+            ),
+            [
+                {f"b_{key}": row[key] for key in ("item_id", *update_columns)}
+                for row in rows
+                if row["item_id"] in existing_ids
+            ],
         )
 
 
-def update_times_played(item_id: int, minus: bool) -> None:
+def delete_item_links(conn, item_ids: list) -> None:
     """
-    Updates the number of times a game has been played, incrementing or decrementing as needed.
+    Deletes the entity links of items, before their links are stored anew.
+    The entities are kept, other items may link to them. The similar games
+    lists of the items are marked as outdated, see get_unrecommended_ids.
 
     Args:
-        item_id: The ID of the game to update.
-        minus: A boolean indicating whether to decrement the times played (True) or increment (False).
+        conn: The open database connection.
+        item_ids: The IDs of the items.
     """
-    with engine.begin() as conn:
-        current_status = conn.execute(
-            select(Boardgame.c.times_played).where(Boardgame.c.item_id == item_id)
-        ).scalar()
-        current_dates_played = conn.execute(
-            select(Boardgame.c.dates_played).where(Boardgame.c.item_id == item_id)
+    # keep the number of bound parameters below the SQLite limit
+    for start in range(0, len(item_ids), 5000):
+        conn.execute(
+            delete(BoardgameEntity).where(
+                BoardgameEntity.c.item_id.in_(item_ids[start : start + 5000])
+            )
+        )
+        conn.execute(
+            update(Boardgame)
+            .where(Boardgame.c.item_id.in_(item_ids[start : start + 5000]))
+            .values(recommended_at=None, updated_at=Boardgame.c.updated_at)
+        )
+
+
+def insert_item_links(conn, item_links: dict) -> None:
+    """
+    Stores the link lists of items in the normalized entity and junction tables.
+    Existing entities and links are kept.
+
+    Args:
+        conn: The open database connection.
+        item_links: A dictionary mapping item IDs to {kind: list of names}.
+    """
+    pairs = {
+        (kind, name)
+        for links in item_links.values()
+        for kind, names in links.items()
+        for name in names
+        if name is not None
+    }
+    if not pairs:
+        return
+    insert_entity = dialect_insert(conn.dialect.name)
+    conn.execute(
+        insert_entity(Entity).on_conflict_do_nothing(
+            index_elements=[Entity.c.kind, Entity.c.name]
+        ),
+        [{"kind": kind, "name": name} for kind, name in pairs],
+    )
+    entity_ids = {}
+    pairs = list(pairs)
+    # keep the number of bound parameters below the SQLite limit
+    for start in range(0, len(pairs), 5000):
+        entity_ids.update(
+            ((kind, name), entity_id)
+            for entity_id, kind, name in conn.execute(
+                select(Entity.c.entity_id, Entity.c.kind, Entity.c.name).where(
+                    tuple_(Entity.c.kind, Entity.c.name).in_(pairs[start : start + 5000])
+                )
+            )
+        )
+    links = {
+        (item_id, entity_ids[(kind, name)])
+        for item_id, item in item_links.items()
+        for kind, names in item.items()
+        for name in names
+        if name is not None
+    }
+    conn.execute(
+        insert_entity(BoardgameEntity).on_conflict_do_nothing(
+            index_elements=[BoardgameEntity.c.item_id, BoardgameEntity.c.entity_id]
+        ),
+        [{"item_id": item_id, "entity_id": entity_id} for item_id, entity_id in links],
+    )
+
+
+def backfill_item_links(batch_size: int = 5000) -> None:
+    """
+    Fills the entity tables from the list columns of items stored before they existed.
+    Does nothing once any link is stored.
+
+    Args:
+        batch_size: The number of items processed per transaction.
+    """
+    with get_engine().begin() as conn:
+        if conn.execute(select(BoardgameEntity.c.item_id).limit(1)).first():
+            return
+    columns = [Boardgame.c.item_id] + [Boardgame.c[kind] for kind in FACET_KINDS]
+    last_id = -1
+    backfilled = 0
+    while True:
+        with get_engine().begin() as conn:
+            rows = conn.execute(
+                select(*columns)
+                .where(Boardgame.c.item_id > last_id)
+                .order_by(Boardgame.c.item_id)
+                .limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            insert_item_links(
+                conn,
+                {
+                    row.item_id: {
+                        kind: text_to_list(getattr(row, kind)) for kind in FACET_KINDS
+                    }
+                    for row in rows
+                },
+            )
+        last_id = rows[-1].item_id
+        backfilled += len(rows)
+    if backfilled:
+        print(f"Backfilled entity links of {backfilled} items.")
+
+
+def backfill_plays(batch_size: int = 1000) -> None:
+    """
+    Moves the play dates stored in the legacy comma-joined dates_played column
+    into the plays table. Migrated rows get an empty dates_played and a new
+    updated_at, so the backfill only ever touches rows written by older versions
+    and cached lists showing their play dates are revalidated.
+
+    Args:
+        batch_size: The number of items processed per transaction.
+    """
+    backfilled = 0
+    while True:
+        with get_engine().begin() as conn:
+            rows = conn.execute(
+                select(Boardgame.c.item_id, Boardgame.c.dates_played)
+                .where(Boardgame.c.dates_played != "")
+                .order_by(Boardgame.c.item_id)
+                .limit(batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            plays = [
+                {"item_id": row.item_id, "played_on": date.fromisoformat(played_on)}
+                for row in rows
+                for played_on in row.dates_played.split(",")
+                if played_on
+            ]
+            if plays:
+                conn.execute(insert(Play), plays)
+            # the lists render play dates, so their validators must change too
+            conn.execute(
+                update(Boardgame)
+                .where(Boardgame.c.item_id.in_([row.item_id for row in rows]))
+                .values(dates_played="", updated_at=datetime.now())
+            )
+        backfilled += len(rows)
+        result_cache.invalidate(*(f"item:{row.item_id}" for row in rows))
+    if backfilled:
+        print(f"Moved the play dates of {backfilled} items to the plays table.")
+
+
+def get_faceted_items(
+    selected: dict, match_all: bool, limit: int, facet_limit: int
+) -> tuple:
+    """
+    Retrieves the items matching the selected facet values and the facet value
+    counts among all matching items.
+
+    Args:
+        selected: A dictionary mapping facet kinds to lists of selected names.
+        match_all: Whether items need every selected value (AND) or any of them (OR).
+        limit: The maximum number of items to return, ordered by Bayes average.
+        facet_limit: The maximum number of values returned per facet kind.
+
+    Returns:
+        A tuple of the matching item rows and a dictionary mapping facet kinds
+        to lists of (name, count) tuples, most frequent first.
+    """
+    pairs = [(kind, name) for kind, names in selected.items() for name in names]
+    matches = select(Boardgame.c.item_id)
+    if pairs:
+        matches = (
+            select(BoardgameEntity.c.item_id)
+            .join(Entity, Entity.c.entity_id == BoardgameEntity.c.entity_id)
+            .where(tuple_(Entity.c.kind, Entity.c.name).in_(pairs))
+            .group_by(BoardgameEntity.c.item_id)
+        )
+        if match_all:
+            matches = matches.having(func.count() == len(set(pairs)))
+    matches = matches.cte("matches")
+
+    # every facet kind is counted in one grouped query
+    counts = (
+        select(
+            Entity.c.kind,
+            Entity.c.name,
+            func.count().label("count"),
+            func.row_number()
+            .over(
+                partition_by=Entity.c.kind,
+                order_by=(func.count().desc(), Entity.c.name),
+            )
+            .label("position"),
+        )
+        .select_from(BoardgameEntity)
+        .join(matches, matches.c.item_id == BoardgameEntity.c.item_id)
+        .join(Entity, Entity.c.entity_id == BoardgameEntity.c.entity_id)
+        .group_by(Entity.c.kind, Entity.c.name)
+        .subquery()
+    )
+    with get_engine().begin() as conn:
+        items = conn.execute(
+            select(*list_view)
+            .join(matches, matches.c.item_id == Boardgame.c.item_id)
+            .order_by(Boardgame.c.bayes_average.desc(), Boardgame.c.item_id)
+            .limit(limit)
+        ).fetchall()
+        facets = {kind: [] for kind in FACET_KINDS}
+        for kind, name, count, _ in conn.execute(
+            select(counts)
+            .where(counts.c.position <= facet_limit)
+            .order_by(counts.c.kind, counts.c.position)
+        ):
+            facets[kind].append((name, count))
+    return items, facets
+
+
+def range_conditions(filters: dict) -> list:
+    """
+    Builds the WHERE conditions of range filters.
+
+    Args:
+        filters: A dictionary mapping RANGE_FILTERS names, or "players", to values.
+            None values are ignored. players=3 keeps games playable with 3 players.
+
+    Returns:
+        A list of SQLAlchemy conditions.
+    """
+    conditions = []
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name == "players":
+            conditions.append(Boardgame.c.minplayers <= value)
+            conditions.append(Boardgame.c.maxplayers >= value)
+            continue
+        column, compare = RANGE_FILTERS[name]
+        conditions.append(compare(Boardgame.c[column], value))
+        if compare is operator.le and column in ZERO_IS_UNKNOWN:
+            conditions.append(Boardgame.c[column] > 0)
+    return conditions
+
+
+def choose_filter_index(conn, filters: dict, item_type: str = "boardgame") -> str:
+    """
+    Picks the index a filtered query should read on SQLite, whose planner has no
+    histograms and cannot tell a range matching a handful of games from one matching
+    half of them. Counts the matches of the year and weight ranges, up to
+    SELECTIVE_MATCHES, from their own indexes.
+
+    Args:
+        conn: The open database connection.
+        filters: A dictionary mapping RANGE_FILTERS names, or "players", to values.
+        item_type: The type of the games.
+
+    Returns:
+        The range index of the most selective year or weight range matching fewer
+        than SELECTIVE_MATCHES games, otherwise the ranking index.
+    """
+    best, best_matches = "ix_boardgames_ranking_filters", SELECTIVE_MATCHES
+    for column, index_name in RANGE_INDEXES.items():
+        column_filters = {
+            name: value
+            for name, value in filters.items()
+            if name in RANGE_FILTERS and RANGE_FILTERS[name][0] == column
+        }
+        conditions = range_conditions(column_filters)
+        if not conditions:
+            continue
+        matching = (
+            select(Boardgame.c.item_id)
+            .with_hint(Boardgame, f"INDEXED BY {index_name}", "sqlite")
+            .where(Boardgame.c.type == item_type, *conditions)
+            .limit(SELECTIVE_MATCHES)
+            .subquery()
+        )
+        matches = conn.execute(select(func.count()).select_from(matching)).scalar()
+        if matches < best_matches:
+            best, best_matches = index_name, matches
+    return best
+
+
+def filtered_items_query(
+    filters: dict,
+    limit: int,
+    item_type: str = "boardgame",
+    after: tuple = None,
+    index: str = None,
+):
+    """
+    Builds the query of get_filtered_items, also used to check its plans with EXPLAIN.
+    index forces the index read on SQLite, see choose_filter_index; Postgres plans
+    from its own statistics.
+    """
+    query = (
+        select(*list_view)
+        .where(Boardgame.c.type == item_type, *range_conditions(filters))
+        .order_by(Boardgame.c.bayes_average.desc(), Boardgame.c.item_id.desc())
+        .limit(limit)
+    )
+    if after:
+        query = query.where(
+            tuple_(Boardgame.c.bayes_average, Boardgame.c.item_id) < tuple_(*after)
+        )
+    if index:
+        query = query.with_hint(Boardgame, f"INDEXED BY {index}", "sqlite")
+    return query
+
+
+def get_filtered_items(
+    filters: dict, limit: int, item_type: str = "boardgame", after: tuple = None
+) -> list:
+    """
+    Retrieves a page of games matching player count, play time, weight, age and
+    year ranges, ordered by Bayes average and ID descending.
+
+    Args:
+        filters: A dictionary mapping RANGE_FILTERS names, or "players", to values.
+        limit: The number of games to retrieve.
+        item_type: The type of the games. Defaults to "boardgame".
+        after: The (Bayes average, item ID) of the last game of the previous page.
+
+    Returns:
+        A list of list view rows (LIST_VIEW_COLUMNS).
+    """
+    with get_engine().begin() as conn:
+        index = None
+        if conn.dialect.name == "sqlite":
+            index = choose_filter_index(conn, filters, item_type)
+        return conn.execute(
+            filtered_items_query(filters, limit, item_type, after, index)
+        ).fetchall()
+
+
+def get_feature_data() -> tuple:
+    """
+    Retrieves the data the recommender builds its feature matrix from.
+
+    Returns:
+        A tuple of the (item_id, average_weight) rows of all board games, ordered by ID,
+        and the (item_id, entity_id, kind) rows of their links.
+    """
+    with get_engine().begin() as conn:
+        items = conn.execute(
+            select(Boardgame.c.item_id, Boardgame.c.average_weight)
+            .where(Boardgame.c.type == "boardgame")
+            .order_by(Boardgame.c.item_id)
+        ).fetchall()
+        links = conn.execute(
+            select(BoardgameEntity.c.item_id, BoardgameEntity.c.entity_id, Entity.c.kind)
+            .join(Entity, Entity.c.entity_id == BoardgameEntity.c.entity_id)
+            .join(Boardgame, Boardgame.c.item_id == BoardgameEntity.c.item_id)
+            .where(Boardgame.c.type == "boardgame")
+        ).fetchall()
+    return items, links
+
+
+def get_similar_lists(item_ids: list = None) -> dict:
+    """
+    Retrieves the stored similar games lists.
+
+    Args:
+        item_ids: The games to retrieve the lists of. Defaults to all games.
+
+    Returns:
+        A dictionary mapping item IDs to lists of (similar_id, score) tuples.
+    """
+    lists = {}
+    query = select(SimilarItem.c.item_id, SimilarItem.c.similar_id, SimilarItem.c.score)
+    with get_engine().begin() as conn:
+        if item_ids is None:
+            results = [conn.execute(query)]
+        else:
+            item_ids = list(item_ids)
+            results = [
+                conn.execute(
+                    query.where(SimilarItem.c.item_id.in_(item_ids[start : start + 5000]))
+                )
+                for start in range(0, len(item_ids), 5000)
+            ]
+        for result in results:
+            for item_id, similar_id, score in result:
+                lists.setdefault(item_id, []).append((similar_id, score))
+    return lists
+
+
+def get_similar_floors() -> dict:
+    """
+    Retrieves the length and lowest score of every stored similar games list.
+
+    Returns:
+        A dictionary mapping item IDs to (length, lowest score) tuples.
+    """
+    with get_engine().begin() as conn:
+        rows = conn.execute(
+            select(
+                SimilarItem.c.item_id,
+                func.count(),
+                func.min(SimilarItem.c.score),
+            ).group_by(SimilarItem.c.item_id)
+        )
+        return {item_id: (length, floor) for item_id, length, floor in rows}
+
+
+def replace_similar_lists(lists: dict, replace_all: bool = False) -> None:
+    """
+    Stores similar games lists, replacing the stored lists of the same games, and
+    marks the games as recommended, including those whose list is empty.
+
+    Args:
+        lists: A dictionary mapping item IDs to lists of (similar_id, score) tuples.
+        replace_all: Whether to delete the lists of every other game too.
+    """
+    rows = [
+        {"item_id": item_id, "similar_id": similar_id, "score": score}
+        for item_id, similar in lists.items()
+        for similar_id, score in similar
+    ]
+    item_ids = list(lists)
+    recommended_at = datetime.now()
+    with get_engine().begin() as conn:
+        if replace_all:
+            conn.execute(SimilarItem.delete())
+        else:
+            for start in range(0, len(item_ids), 5000):
+                conn.execute(
+                    SimilarItem.delete().where(
+                        SimilarItem.c.item_id.in_(item_ids[start : start + 5000])
+                    )
+                )
+        if rows:
+            conn.execute(insert(SimilarItem), rows)
+        for start in range(0, len(item_ids), 5000):
+            conn.execute(
+                update(Boardgame)
+                .where(Boardgame.c.item_id.in_(item_ids[start : start + 5000]))
+                # the list is not part of any cached response, so validators stay valid
+                .values(recommended_at=recommended_at, updated_at=Boardgame.c.updated_at)
+            )
+
+
+def get_unrecommended_ids(kinds) -> list:
+    """
+    Retrieves the board games that have links the recommender uses but whose similar
+    games list was never computed, e.g. games inserted by a process that was stopped
+    before it updated the recommendations, or whose links were replaced since.
+    Games whose computed list came out empty are not returned again.
+
+    Args:
+        kinds: The link kinds the recommender builds its features from.
+
+    Returns:
+        The IDs of the games.
+    """
+    has_features = (
+        select(BoardgameEntity.c.item_id)
+        .join(Entity, Entity.c.entity_id == BoardgameEntity.c.entity_id)
+        .where(BoardgameEntity.c.item_id == Boardgame.c.item_id, Entity.c.kind.in_(list(kinds)))
+        .exists()
+    )
+    with get_engine().begin() as conn:
+        return conn.execute(
+            select(Boardgame.c.item_id).where(
+                Boardgame.c.recommended_at == None,
+                Boardgame.c.type == "boardgame",
+                has_features,
+            )
+        ).scalars().all()
+
+
+def has_recommendations() -> bool:
+    """
+    Checks whether the similar games list of any game was computed, so a catalog
+    whose lists all came out empty is not rebuilt again.
+
+    Returns:
+        True if at least one game is marked as recommended, otherwise False.
+    """
+    with get_engine().begin() as conn:
+        return (
+            conn.execute(
+                select(Boardgame.c.item_id).where(Boardgame.c.recommended_at != None).limit(1)
+            ).first()
+            is not None
+        )
+
+
+def get_similar_items(item_id: int, limit: int) -> list:
+    """
+    Retrieves the stored most similar games of a game.
+
+    Args:
+        item_id: The ID of the game.
+        limit: The maximum number of games to return.
+
+    Returns:
+        A list of list view rows (LIST_VIEW_COLUMNS) with an extra similarity column, most similar first.
+    """
+    with get_engine().begin() as conn:
+        return conn.execute(
+            select(*list_view, SimilarItem.c.score.label("similarity"))
+            .join(SimilarItem, SimilarItem.c.similar_id == Boardgame.c.item_id)
+            .where(SimilarItem.c.item_id == item_id)
+            .order_by(SimilarItem.c.score.desc(), SimilarItem.c.similar_id)
+            .limit(limit)
+        ).fetchall()
+
+
+def get_refresh_candidates(limit: int, min_age: timedelta) -> list:
+    """
+    Retrieves the stored stats of the items that should be refreshed next.
+    Owned games come first, then ranked games, and within each group the rows
+    that were refreshed longest ago (or never). Every tier and the never refreshed
+    and stale rows within it are separate range scans of the partial indexes
+    ix_boardgames_refresh_ranked and ix_boardgames_refresh_unranked, so no query
+    sorts the table; the scans stop once the limit is reached.
+
+    Args:
+        limit: The maximum number of items to return.
+        min_age: Items refreshed more recently than this are skipped.
+
+    Returns:
+        A list of rows with the item ID and the stat columns.
+    """
+    columns = [Boardgame.c[column] for column in ("item_id", *STAT_COLUMNS)]
+    last_refreshed = Boardgame.c.last_refreshed
+    # the never refreshed games first, as separate ranges since NULLs sort last in a
+    # Postgres index and first in a SQLite one
+    ranges = (last_refreshed == None, last_refreshed < datetime.now() - min_age)
+    rows = []
+    with get_engine().begin() as conn:
+        for owned in (True, False):
+            for ranked in (RANKED, UNRANKED):
+                for refresh_range in ranges:
+                    rows.extend(
+                        conn.execute(
+                            select(*columns)
+                            .where(Boardgame.c.owned == owned, ranked, refresh_range)
+                            .order_by(last_refreshed, Boardgame.c.item_id)
+                            .limit(limit - len(rows))
+                        )
+                    )
+                    if len(rows) >= limit:
+                        return rows
+    return rows
+
+
+def update_refreshed_items(changed_rows: list, refreshed_ids: list) -> None:
+    """
+    Writes the stats of the changed items and marks all checked items as refreshed.
+    Cached results containing changed items are invalidated and the changes are
+    passed to the update_listeners.
+
+    Args:
+        changed_rows: Dictionaries with the item ID and the new stat columns of changed items.
+        refreshed_ids: The IDs of every item that was checked, changed or not.
+    """
+    refreshed_at = datetime.now()
+    with get_engine().begin() as conn:
+        if changed_rows:
+            conn.execute(
+                update(Boardgame)
+                .where(Boardgame.c.item_id == bindparam("b_item_id"))
+                .values({column: bindparam(f"b_{column}") for column in STAT_COLUMNS}),
+                [{f"b_{key}": value for key, value in row.items()} for row in changed_rows],
+            )
+        if refreshed_ids:
+            conn.execute(
+                update(Boardgame)
+                .where(Boardgame.c.item_id.in_(refreshed_ids))
+                # unchanged games keep their updated_at, so their validators stay valid
+                .values(last_refreshed=refreshed_at, updated_at=Boardgame.c.updated_at)
+            )
+    if changed_rows:
+        result_cache.invalidate(
+            "ranking", *(f"item:{row['item_id']}" for row in changed_rows)
+        )
+        notify_updated(changed_rows)
+
+
+def get_refresh_requests(day: date) -> int:
+    """
+    Retrieves the number of BGG API requests spent on refreshing stats on a day.
+
+    Args:
+        day: The day to look up.
+
+    Returns:
+        The number of requests.
+    """
+    with get_engine().begin() as conn:
+        requests = conn.execute(
+            select(RefreshUsage.c.requests).where(RefreshUsage.c.day == day)
         ).scalar()
+    return requests or 0
+
+
+def add_refresh_requests(day: date, requests: int) -> None:
+    """
+    Adds to the number of BGG API requests spent on refreshing stats on a day.
+
+    Args:
+        day: The day to count the requests on.
+        requests: The number of requests to add.
+    """
+    with get_engine().begin() as conn:
+        statement = dialect_insert(conn.dialect.name)(RefreshUsage).values(
+            day=day, requests=requests
+        )
+        conn.execute(
+            statement.on_conflict_do_update(
+                index_elements=[RefreshUsage.c.day],
+                set_={"requests": RefreshUsage.c.requests + requests},
+            )
+        )
+
+
+def add_crawl_shards(shards: list) -> None:
+    """
+    Adds crawl shards, skipping the ones another process added first.
+
+    Args:
+        shards: Dictionaries with the start_id, end_id, next_id and status of each shard.
+    """
+    if not shards:
+        return
+    with get_engine().begin() as conn:
+        statement = dialect_insert(conn.dialect.name)(CrawlShard)
+        conn.execute(
+            statement.on_conflict_do_nothing(index_elements=[CrawlShard.c.start_id]), shards
+        )
+
+
+def get_crawl_frontier() -> int:
+    """
+    Retrieves the end of the sharded ID space, where new shards start.
+
+    Returns:
+        The highest shard end, or None if no shard exists yet.
+    """
+    with get_engine().begin() as conn:
+        return conn.execute(select(func.max(CrawlShard.c.end_id))).scalar()
+
+
+def claim_crawl_shard(worker: str, stale_before: datetime):
+    """
+    Claims the lowest pending shard, or a claimed one whose worker stopped reporting
+    progress. Each claim is a compare-and-set UPDATE that only succeeds if the shard
+    is still claimable, so concurrent processes never claim the same shard.
+
+    Args:
+        worker: The name of the claiming process.
+        stale_before: Claims without progress since then are taken over.
+
+    Returns:
+        The claimed shard row, or None if no shard is left.
+    """
+    claimable = (CrawlShard.c.status == CRAWL_PENDING) | (
+        (CrawlShard.c.status == CRAWL_CLAIMED) & (CrawlShard.c.heartbeat_at < stale_before)
+    )
+    while True:
+        with get_engine().begin() as conn:
+            start_id = conn.execute(
+                select(CrawlShard.c.start_id)
+                .where(claimable)
+                .order_by(CrawlShard.c.start_id)
+                .limit(1)
+            ).scalar()
+            if start_id is None:
+                return None
+            claimed = conn.execute(
+                update(CrawlShard)
+                .where(CrawlShard.c.start_id == start_id, claimable)
+                .values(status=CRAWL_CLAIMED, claimed_by=worker, heartbeat_at=datetime.now())
+            ).rowcount
+            if claimed:
+                return conn.execute(
+                    select(CrawlShard).where(CrawlShard.c.start_id == start_id)
+                ).first()
+
+
+def save_crawl_progress(
+    shard_id: int, worker: str, next_id: int, items: int, gap: tuple = None
+) -> bool:
+    """
+    Moves the resume cursor of a claimed shard after a stored batch and records the
+    batch as gap if it had no games, merged with a gap ending where it starts.
+    The shard is done once the cursor reaches its end.
+
+    Args:
+        shard_id: The start ID of the shard.
+        worker: The name of the process holding the claim.
+        next_id: The first ID not crawled yet.
+        items: The number of games stored from the batch.
+        gap: The (start_id, end_id) of the batch if it had no games.
+
+    Returns:
+        False if the claim was taken over by another process, which resumes the shard.
+    """
+    with get_engine().begin() as conn:
+        saved = conn.execute(
+            update(CrawlShard)
+            .where(
+                CrawlShard.c.start_id == shard_id,
+                CrawlShard.c.claimed_by == worker,
+                CrawlShard.c.status == CRAWL_CLAIMED,
+            )
+            .values(
+                next_id=next_id,
+                found_items=CrawlShard.c.found_items + items,
+                heartbeat_at=datetime.now(),
+                status=case(
+                    (CrawlShard.c.end_id <= next_id, CRAWL_DONE), else_=CRAWL_CLAIMED
+                ),
+            )
+        ).rowcount
+        if saved and gap:
+            merged = conn.execute(
+                update(CrawlGap).where(CrawlGap.c.end_id == gap[0]).values(end_id=gap[1])
+            ).rowcount
+            if not merged:
+                statement = dialect_insert(conn.dialect.name)(CrawlGap)
+                conn.execute(
+                    statement.values(start_id=gap[0], end_id=gap[1]).on_conflict_do_nothing(
+                        index_elements=[CrawlGap.c.start_id]
+                    )
+                )
+    return bool(saved)
+
 
-        dates_played_list = (
-            current_dates_played.split(",") if current_dates_played else []
+def release_crawl_shard(shard_id: int, worker: str) -> None:
+    """
+    Hands a claimed shard back, e.g. when a crawl is cancelled, so any process can
+    resume it from its cursor right away.
+
+    Args:
+        shard_id: The start ID of the shard.
+        worker: The name of the process holding the claim.
+    """
+    with get_engine().begin() as conn:
+        conn.execute(
+            update(CrawlShard)
+            .where(
+                CrawlShard.c.start_id == shard_id,
+                CrawlShard.c.claimed_by == worker,
+                CrawlShard.c.status == CRAWL_CLAIMED,
+            )
+            .values(status=CRAWL_PENDING, claimed_by=None)
         )
 
-        if minus and current_status > 0:
-            new_status = current_status - 1
-            if dates_played_list:
-                dates_played_list.pop()
-        elif not minus:
-            new_status = current_status + 1
-            dates_played_list.append(datetime.now().strftime("%Y-%m-%d"))
 
-        new_dates_played = ",".join(dates_played_list)
+def reopen_crawl_tail(cursor: int) -> int:
+    """
+    Marks the finished shards above the highest stored game as pending again from
+    the cursor on, and forgets the gaps there, since BGG adds new games at the top
+    of its ID space. Shards claimed by a running crawl are left alone.
+
+    Args:
+        cursor: The ID after the highest stored game.
+
+    Returns:
+        The number of reopened shards.
+    """
+    with get_engine().begin() as conn:
+        reopened = conn.execute(
+            update(CrawlShard)
+            .where(CrawlShard.c.end_id > cursor, CrawlShard.c.status == CRAWL_DONE)
+            .values(
+                status=CRAWL_PENDING,
+                claimed_by=None,
+                next_id=case(
+                    (CrawlShard.c.start_id > cursor, CrawlShard.c.start_id), else_=cursor
+                ),
+            )
+        ).rowcount
+        conn.execute(delete(CrawlGap).where(CrawlGap.c.start_id >= cursor))
         conn.execute(
+            update(CrawlGap).where(CrawlGap.c.end_id > cursor).values(end_id=cursor)
+        )
+    return reopened
+
+
+def get_crawl_summary() -> dict:
+    """
+    Summarizes the crawl state: shards and stored games by status, crawled IDs,
+    known gaps and the claims of running crawls.
+
+    Returns:
+        A dictionary with the crawl summary.
+    """
+    with get_engine().begin() as conn:
+        shards = conn.execute(
+            select(
+                CrawlShard.c.status,
+                func.count(),
+                func.sum(CrawlShard.c.next_id - CrawlShard.c.start_id),
+                func.sum(CrawlShard.c.found_items),
+            ).group_by(CrawlShard.c.status)
+        ).all()
+        gaps, gap_ids = conn.execute(
+            select(func.count(), func.sum(CrawlGap.c.end_id - CrawlGap.c.start_id))
+        ).one()
+        claims = conn.execute(
+            select(CrawlShard)
+            .where(CrawlShard.c.status == CRAWL_CLAIMED)
+            .order_by(CrawlShard.c.start_id)
+        ).all()
+    return {
+        "shards": {status: count for status, count, _, _ in shards},
+        "crawled_ids": sum(crawled or 0 for _, _, crawled, _ in shards),
+        "items": sum(items or 0 for _, _, _, items in shards),
+        "frontier": get_crawl_frontier(),
+        "gaps": gaps,
+        "gap_ids": gap_ids or 0,
+        "claims": [
+            {
+                "start_id": claim.start_id,
+                "end_id": claim.end_id,
+                "next_id": claim.next_id,
+                "claimed_by": claim.claimed_by,
+                "heartbeat_at": claim.heartbeat_at,
+            }
+            for claim in claims
+        ],
+    }
+
+
+def get_item(item_id: int):
+    """
+    Retrieves a single game by ID. Results are cached until the game changes.
+
+    Args:
+        item_id: The ID of the game.
+
+    Returns:
+        The boardgame row, or None if the game is not found.
+    """
+
+    def load():
+        with get_engine().begin() as conn:
+            return conn.execute(
+                select(Boardgame).where(Boardgame.c.item_id == item_id)
+            ).first()
+
+    return result_cache.get_or_load(("item", item_id), load, [f"item:{item_id}"])
+
+
+def get_ranked_items(limit: int, skip: int = 0, after: tuple = None) -> list:
+    """
+    Retrieves a page of the board games ranking, ordered by Bayes average and ID descending.
+    Pages are cached until a game on them changes or games are added or refreshed.
+
+    Args:
+        limit: The number of games to retrieve.
+        skip: The number of games to skip, used when no cursor is given.
+        after: The (Bayes average, item ID) of the last game of the previous page.
+
+    Returns:
+        A list of list view rows (LIST_VIEW_COLUMNS).
+    """
+
+    def load():
+        query = (
+            select(*list_view)
+            .where(Boardgame.c.type == "boardgame")
+            .order_by(Boardgame.c.bayes_average.desc(), Boardgame.c.item_id.desc())
+        )
+        if after:
+            query = query.where(
+                tuple_(Boardgame.c.bayes_average, Boardgame.c.item_id) < tuple_(*after)
+            )
+        else:
+            query = query.offset(skip)
+        with get_engine().begin() as conn:
+            return conn.execute(query.limit(limit)).fetchall()
+
+    key = ("ranking", limit, skip if not after else 0, tuple(after) if after else None)
+    return result_cache.get_or_load(
+        key, load, lambda items: item_tags(items) | {"ranking"}
+    )
+
+
+def get_items_by_id(limit: int, skip: int = 0, after: int = None) -> list:
+    """
+    Retrieves a page of games of every type ordered by ID.
+
+    Args:
+        limit: The number of games to retrieve.
+        skip: The number of games to skip, used when no cursor is given.
+        after: The ID of the last game of the previous page.
+
+    Returns:
+        A list of boardgame rows.
+    """
+    query = select(Boardgame).order_by(Boardgame.c.item_id)
+    if after is not None:
+        query = query.where(Boardgame.c.item_id > after)
+    else:
+        query = query.offset(skip)
+    with get_engine().begin() as conn:
+        return conn.execute(query.limit(limit)).fetchall()
+
+
+def get_list_items(item_ids: list) -> list:
+    """
+    Retrieves the list view rows of games in the given order, e.g. a page sorted elsewhere.
+
+    Args:
+        item_ids: The IDs of the games.
+
+    Returns:
+        A list of list view rows (LIST_VIEW_COLUMNS), games that no longer exist are left out.
+    """
+    if not item_ids:
+        return []
+    with get_engine().begin() as conn:
+        rows = conn.execute(
+            select(*list_view).where(Boardgame.c.item_id.in_(item_ids))
+        ).fetchall()
+    position = {item_id: index for index, item_id in enumerate(item_ids)}
+    rows.sort(key=lambda row: position[row.item_id])
+    return rows
+
+
+def get_image_url(item_id: int, kind: str) -> str:
+    """
+    Retrieves the BGG URL of the thumbnail or the image of a game.
+
+    Args:
+        item_id: The ID of the game.
+        kind: "thumbnail" or "image".
+
+    Returns:
+        The URL, or None if the game is not found or has no image.
+    """
+    with get_engine().begin() as conn:
+        return conn.execute(
+            select(Boardgame.c[kind]).where(Boardgame.c.item_id == item_id)
+        ).scalar()
+
+
+def get_item_updated_at(item_id: int) -> datetime:
+    """
+    Retrieves the time of the latest write to a game.
+
+    Args:
+        item_id: The ID of the game.
+
+    Returns:
+        The time, or None if the game is not found or was stored before the column existed.
+    """
+    with get_engine().begin() as conn:
+        return conn.execute(
+            select(Boardgame.c.updated_at).where(Boardgame.c.item_id == item_id)
+        ).scalar()
+
+
+def get_catalog_updated_at() -> datetime:
+    """
+    Retrieves the time of the latest write to any game, read from the end of the
+    updated_at index. Every list of games is unchanged as long as it is: writes to
+    the plays table touch updated_at of their game in the same transaction.
+
+    Returns:
+        The time, or None if no game was written since the column was added.
+    """
+    with get_engine().begin() as conn:
+        return conn.execute(select(func.max(Boardgame.c.updated_at))).scalar()
+
+
+def get_owned_items() -> list:
+    """
+    Retrieves the owned games ordered by name.
+    The list is cached until a game on it changes or the ownership of a game changes.
+
+    Returns:
+        A list of list view rows (LIST_VIEW_COLUMNS).
+    """
+
+    def load():
+        with get_engine().begin() as conn:
+            return conn.execute(
+                select(*list_view)
+                .where(Boardgame.c.owned == True)
+                .order_by(Boardgame.c.name.asc())
+            ).fetchall()
+
+    return result_cache.get_or_load(
+        ("owned",), load, lambda items: item_tags(items) | {"owned"}
+    )
+
+
+def update_item_ownership(item_id: int):
+    """
+    Toggles the ownership status (owned/not owned) of a game in the database
+    with a single UPDATE ... RETURNING, so concurrent toggles are never lost.
+
+    Args:
+        item_id: The ID of the game to update.
+
+    Returns:
+        The updated list view row (LIST_VIEW_COLUMNS), or None if the game is not found.
+    """
+    with get_engine().begin() as conn:
+        item = conn.execute(
             update(Boardgame)
             .where(Boardgame.c.item_id == item_id)
-            .values(times_played=new_status, dates_played=new_dates_played)
+            .values(owned=not_(Boardgame.c.owned))
+            .returning(*list_view)
+        ).first()
+    result_cache.invalidate("owned", f"item:{item_id}")
+    if item:
+        notify_updated([{"item_id": item_id, "owned": item.owned}])
+    return item
+
+
+def update_times_played(
+    item_id: int, minus: bool, players: int = None, notes: str = None
+):
+    """
+    Updates the number of times a game has been played, incrementing or decrementing as needed.
+    Incrementing logs a play for the current date, decrementing deletes the latest play.
+    The count is changed in SQL with UPDATE ... RETURNING in the same transaction, so
+    concurrent clicks are never lost. Decrementing a count of zero changes nothing,
+    neither the plays nor updated_at, and returns the unchanged row.
+
+    Args:
+        item_id: The ID of the game to update.
+        minus: A boolean indicating whether to decrement the times played (True) or increment (False).
+        players: Optional number of players of the logged play.
+        notes: Optional notes on the logged play.
+
+    Returns:
+        The updated list view row (LIST_VIEW_COLUMNS), or None if the game is not found.
+    """
+    times_played = Boardgame.c.times_played
+    query = update(Boardgame).where(Boardgame.c.item_id == item_id)
+    if minus:
+        query = query.where(times_played > 0).values(times_played=times_played - 1)
+    else:
+        query = query.values(times_played=times_played + 1)
+    with get_engine().begin() as conn:
+        item = conn.execute(query.returning(*list_view)).first()
+        if item and minus:
+            latest_play = (
+                select(Play.c.play_id)
+                .where(Play.c.item_id == item_id)
+                .order_by(Play.c.played_on.desc(), Play.c.play_id.desc())
+                .limit(1)
+                .scalar_subquery()
+            )
+            conn.execute(delete(Play).where(Play.c.play_id == latest_play))
+        elif item:
+            conn.execute(
+                insert(Play).values(
+                    item_id=item_id, played_on=date.today(), players=players, notes=notes
+                )
+            )
+        else:
+            # not played yet (or not found), re-render the unchanged row
+            return conn.execute(
+                select(*list_view).where(Boardgame.c.item_id == item_id)
+            ).first()
+    result_cache.invalidate(f"item:{item_id}")
+    notify_updated([{"item_id": item_id, "times_played": item.times_played}])
+    return item
+
+
+def get_play_dates(item_ids: list) -> dict:
+    """
+    Retrieves the latest play dates of a page of games in one query.
+    Results are cached until a play of the games changes.
+
+    Args:
+        item_ids: The IDs of the games.
+
+    Returns:
+        A dictionary mapping item IDs to their latest PLAY_DATES_SHOWN play dates,
+        newest first. Games without plays are left out.
+    """
+    item_ids = tuple(sorted(set(item_ids)))
+
+    def load():
+        position = (
+            func.row_number()
+            .over(
+                partition_by=Play.c.item_id,
+                order_by=(Play.c.played_on.desc(), Play.c.play_id.desc()),
+            )
+            .label("position")
         )
+        ranked = (
+            select(Play.c.item_id, Play.c.played_on, position)
+            .where(Play.c.item_id.in_(item_ids))
+            .subquery()
+        )
+        dates = {}
+        with get_engine().begin() as conn:
+            rows = conn.execute(
+                select(ranked.c.item_id, ranked.c.played_on)
+                .where(ranked.c.position <= PLAY_DATES_SHOWN)
+                .order_by(ranked.c.item_id, ranked.c.position)
+            )
+            for item_id, played_on in rows:
+                dates.setdefault(item_id, []).append(played_on)
+        return dates
+
+    if not item_ids:
+        return {}
+    return result_cache.get_or_load(
+        ("plays", item_ids), load, {f"item:{item_id}" for item_id in item_ids}
+    )
 
 
-def update_comments(item_id: int, comment: str) -> None:
+def get_plays(
+    limit: int,
+    item_id: int = None,
+    start: date = None,
+    end: date = None,
+    before: tuple = None,
+) -> list:
+    """
+    Retrieves a page of the play history, newest first, of one game or the whole collection.
+
+    Args:
+        limit: The number of plays to retrieve.
+        item_id: The game to retrieve the plays of. Defaults to every game.
+        start: The earliest play date to include.
+        end: The latest play date to include.
+        before: The (played_on, play_id) of the last play of the previous page.
+
+    Returns:
+        A list of play rows with the name of the game.
+    """
+    query = (
+        select(Play, Boardgame.c.name)
+        .join(Boardgame, Boardgame.c.item_id == Play.c.item_id)
+        .order_by(Play.c.played_on.desc(), Play.c.play_id.desc())
+    )
+    if item_id is not None:
+        query = query.where(Play.c.item_id == item_id)
+    if start:
+        query = query.where(Play.c.played_on >= start)
+    if end:
+        query = query.where(Play.c.played_on <= end)
+    if before:
+        query = query.where(tuple_(Play.c.played_on, Play.c.play_id) < tuple_(*before))
+    with get_engine().begin() as conn:
+        return conn.execute(query.limit(limit)).fetchall()
+
+
+def update_comments(item_id: int, comment: str):
     """
     Updates the comments of a game in the database.
 
     Args:
         item_id: The ID of the game to update.
         comment: The new comment to set for the item.
+
+    Returns:
+        The updated list view row (LIST_VIEW_COLUMNS), or None if the game is not found.
     """
-    with engine.begin() as conn:
-        new_comments = comment
-        conn.execute(
+    with get_engine().begin() as conn:
+        item = conn.execute(
             update(Boardgame)
             .where(Boardgame.c.item_id == item_id)
-            .values(comments=new_comments)
-        )
+            .values(comments=comment)
+            .returning(*list_view)
+        ).first()
+    result_cache.invalidate(f"item:{item_id}")
+    return item
 
 
 def get_highest_id() -> int:
@@ -167,10 +1782,6 @@ def get_highest_id() -> int:
     Returns:
         The highest item ID, or 0 if the table is empty.
     """
-    with engine.begin() as conn:
-        highest_id = conn.execute(
-            select(Boardgame).order_by(Boardgame.c.item_id.desc())
-        ).first()
-    if highest_id:
-        return highest_id.item_id
-    return 0
+    with get_engine().begin() as conn:
+        highest_id = conn.execute(select(func.max(Boardgame.c.item_id))).scalar()
+    return highest_id or 0
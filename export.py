@@ -0,0 +1,278 @@
+"""
+Streams the catalog out of the database as NDJSON, CSV, Parquet or Arrow.
+
+Usage:
+    python export.py --format parquet --output games.parquet --type boardgame --min-users-rated 100
+
+Rows are read through a server-side cursor in chunks and written chunk by chunk,
+so memory use does not grow with the number of exported rows.
+Parquet and Arrow need the optional pyarrow package.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from typing import Iterable, Iterator
+
+from sqlalchemy import select
+
+import database
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FORMATS = ("ndjson", "csv", "parquet", "arrow")
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+EXPORT_COLUMNS = tuple(
+    column.name
+    for column in database.Boardgame.columns
+    if column.name not in ("last_refreshed", "updated_at")
+)
+# Columns stored as array literals, exported as real lists
+LIST_COLUMNS = database.FACET_KINDS + (
+    "alternate_names",
+    "integrations",
+    "implementations",
+)
+CHUNK_SIZE = 2000
+
+
+class ExportError(ValueError):
+    """
+    Raised for export requests that cannot be served, e.g. unknown columns.
+    """
+
+
+def check_export(export_format: str, columns: list) -> list:
+    """
+    Validates an export request.
+
+    Args:
+        export_format: One of EXPORT_FORMATS.
+        columns: The requested columns. Empty means every column.
+
+    Returns:
+        The columns to export.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown format {export_format!r}")
+    if export_format in ("parquet", "arrow") and pyarrow is None:
+        raise ExportError(f"The {export_format} format needs the pyarrow package")
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown:
+        raise ExportError(f"Unknown columns: {', '.join(unknown)}")
+    return list(columns) or list(EXPORT_COLUMNS)
+
+
+def iter_rows(
+    columns: list,
+    types: list = None,
+    owned: bool = None,
+    min_users_rated: int = None,
+    min_id: int = None,
+    max_id: int = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[list]:
+    """
+    Reads the selected columns of the matching games ordered by ID through a
+    server-side cursor.
+
+    Args:
+        columns: The columns to read.
+        types: Only export games of these types, e.g. ["boardgame"].
+        owned: Only export owned (True) or not owned (False) games.
+        min_users_rated: Only export games rated by at least this many users.
+        min_id: The lowest item ID to export.
+        max_id: The highest item ID to export.
+        chunk_size: The number of rows fetched per round trip.
+
+    Yields:
+        Lists of up to chunk_size row dictionaries, list columns as lists.
+    """
+    query = select(*(database.Boardgame.c[column] for column in columns)).order_by(
+        database.Boardgame.c.item_id
+    )
+    if types:
+        query = query.where(database.Boardgame.c.type.in_(types))
+    if owned is not None:
+        query = query.where(database.Boardgame.c.owned == owned)
+    if min_users_rated is not None:
+        query = query.where(database.Boardgame.c.users_rated >= min_users_rated)
+    if min_id is not None:
+        query = query.where(database.Boardgame.c.item_id >= min_id)
+    if max_id is not None:
+        query = query.where(database.Boardgame.c.item_id <= max_id)
+    list_columns = [column for column in columns if column in LIST_COLUMNS]
+    with database.engine.connect() as conn:
+        result = conn.execution_options(yield_per=chunk_size).execute(query)
+        for partition in result.mappings().partitions():
+            rows = [dict(row) for row in partition]
+            for row in rows:
+                for column in list_columns:
+                    row[column] = database.text_to_list(row[column])
+            yield rows
+
+
+def write_ndjson(chunks: Iterable[list], columns: list) -> Iterator[bytes]:
+    """
+    Encodes row chunks as newline-delimited JSON.
+    """
+    for rows in chunks:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows).encode()
+
+
+def write_csv(chunks: Iterable[list], columns: list) -> Iterator[bytes]:
+    """
+    Encodes row chunks as CSV with a header row. List columns are written as JSON arrays.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow(
+                json.dumps(row[column]) if isinstance(row[column], list) else row[column]
+                for column in columns
+            )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file object collecting what pyarrow writes until it is drained.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_schema(columns: list):
+    """
+    Builds the Arrow schema of the exported columns from the table definition.
+    """
+    types = {
+        "Integer": pyarrow.int64(),
+        "Float": pyarrow.float64(),
+        "Boolean": pyarrow.bool_(),
+    }
+    fields = []
+    for column in columns:
+        if column in LIST_COLUMNS:
+            field_type = pyarrow.list_(pyarrow.string())
+        else:
+            column_type = type(database.Boardgame.c[column].type).__name__
+            field_type = types.get(column_type, pyarrow.string())
+        fields.append(pyarrow.field(column, field_type))
+    return pyarrow.schema(fields)
+
+
+def write_arrow(chunks: Iterable[list], columns: list, parquet: bool) -> Iterator[bytes]:
+    """
+    Encodes row chunks as a Parquet file (one row group per chunk) or an Arrow IPC stream.
+    """
+    schema = arrow_schema(columns)
+    sink = ChunkSink()
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for rows in chunks:
+        writer.write_table(pyarrow.Table.from_pylist(rows, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_catalog(export_format: str, columns: list, **filters) -> Iterator[bytes]:
+    """
+    Streams the matching games in the given format.
+    Raises ExportError for unknown formats or columns before anything is read.
+
+    Args:
+        export_format: One of EXPORT_FORMATS.
+        columns: The columns to export. Empty means every column.
+        filters: The filters of iter_rows.
+
+    Returns:
+        An iterator of encoded chunks.
+    """
+    columns = check_export(export_format, columns)
+    chunks = iter_rows(columns, **filters)
+    if export_format == "ndjson":
+        return write_ndjson(chunks, columns)
+    if export_format == "csv":
+        return write_csv(chunks, columns)
+    return write_arrow(chunks, columns, parquet=export_format == "parquet")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--output", help="File to write to, defaults to stdout")
+    parser.add_argument("--columns", nargs="+", default=[], metavar="COLUMN")
+    parser.add_argument("--type", nargs="+", dest="types", metavar="TYPE")
+    owned = parser.add_mutually_exclusive_group()
+    owned.add_argument("--owned", action="store_true", default=None)
+    owned.add_argument("--not-owned", dest="owned", action="store_false")
+    parser.add_argument("--min-users-rated", type=int)
+    parser.add_argument("--min-id", type=int)
+    parser.add_argument("--max-id", type=int)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    try:
+        chunks = export_catalog(
+            args.format,
+            args.columns,
+            types=args.types,
+            owned=args.owned,
+            min_users_rated=args.min_users_rated,
+            min_id=args.min_id,
+            max_id=args.max_id,
+            chunk_size=args.chunk_size,
+        )
+    except ExportError as error:
+        parser.error(str(error))
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
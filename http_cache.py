@@ -0,0 +1,283 @@
+"""
+Conditional requests and compression for the HTML fragments and JSON responses.
+
+ConditionalMiddleware derives a weak ETag and Last-Modified from the updated_at
+column before the route runs, so a request whose If-None-Match still matches is
+answered with 304 without querying or rendering the page. CompressionMiddleware
+compresses text responses above a size threshold with brotli, if the optional
+package is installed, or gzip.
+"""
+import functools
+import hashlib
+import os
+import zlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Callable, Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match
+
+from async_database import db_limiter
+
+try:
+    import brotli
+except ImportError:  # brotli compression is optional
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Qualities above 5 cost far more time than they save bytes on dynamic pages
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+)
+# Clients may store the responses but must revalidate them before every use
+CACHE_CONTROL = "no-cache"
+
+
+def templates_version(directory: str = "templates") -> str:
+    """
+    Hashes the templates, so validators change when a deploy changes the pages.
+    """
+    digest = hashlib.sha1()
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), "rb") as template:
+                digest.update(name.encode() + template.read())
+    return digest.hexdigest()
+
+
+TEMPLATES_VERSION = templates_version()
+
+# Route endpoint -> callable receiving the path parameters and returning the time of
+# the latest write to the data of the response, see validated_by
+validators = {}
+
+
+def validated_by(last_modified: Callable[[dict], Optional[datetime]]) -> Callable:
+    """
+    Decorator registering how to find out when the data of a GET route last changed.
+    Place it below the route decorator.
+
+    Args:
+        last_modified: Blocking callable receiving the path parameters and returning
+            the time of the latest write, or None to skip validation. Runs in a
+            database worker thread.
+
+    Returns:
+        The decorator, which returns the endpoint unchanged.
+    """
+
+    def register(endpoint: Callable) -> Callable:
+        validators[endpoint] = last_modified
+        return endpoint
+
+    return register
+
+
+def make_etag(updated_at: datetime) -> str:
+    """
+    Returns the weak ETag of a response whose data was last written at updated_at.
+    Weak, since the gzip and brotli encodings of a page are different bytes.
+    """
+    digest = hashlib.sha1(f"{updated_at.isoformat()}|{TEMPLATES_VERSION}".encode())
+    return f'W/"{digest.hexdigest()[:20]}"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """
+    Compares an ETag with an If-None-Match header using the weak comparison.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque_tag for tag in if_none_match.split(",")
+    )
+
+
+class ConditionalMiddleware:
+    """
+    ASGI middleware adding ETag, Last-Modified and Cache-Control to the successful
+    GET responses of routes registered with validated_by, and answering requests
+    whose If-None-Match matches with 304 before the route runs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def match_route(self, scope: dict) -> tuple:
+        """
+        Finds the route of a request like the router does.
+
+        Returns:
+            The validator of the route and the route's child scope, or (None, None).
+        """
+        for route in scope["app"].router.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return validators.get(child_scope.get("endpoint")), child_scope
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        validator, child_scope = self.match_route(scope)
+        updated_at = None
+        if validator is not None:
+            updated_at = await anyio.to_thread.run_sync(
+                functools.partial(validator, child_scope["path_params"]),
+                limiter=db_limiter,
+            )
+        if updated_at is None:
+            await self.app(scope, receive, send)
+            return
+        etag = make_etag(updated_at)
+        validator_headers = {
+            "etag": etag,
+            "last-modified": format_datetime(
+                updated_at.astimezone(timezone.utc), usegmt=True
+            ),
+            "cache-control": CACHE_CONTROL,
+        }
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match and etag_matches(etag, if_none_match):
+            # lets the metrics middleware label the response with its route
+            scope.update(child_scope)
+            headers = [
+                (name.encode(), value.encode())
+                for name, value in {**validator_headers, "vary": "Accept-Encoding"}.items()
+            ]
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_validators(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                for name, value in validator_headers.items():
+                    headers.setdefault(name, value)
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Picks the preferred supported content coding the client accepts.
+
+    Args:
+        accept_encoding: The Accept-Encoding header, e.g. "gzip, deflate, br;q=0.9".
+
+    Returns:
+        "br" or "gzip", or None if the client accepts neither.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.partition(";")
+        quality = 1.0
+        name, _, value = parameters.partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ENCODINGS:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+class Compressor:
+    """
+    Incremental gzip or brotli compressor. Every chunk is flushed, so streamed
+    responses reach the client as they are produced.
+    """
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        self.encoding = encoding
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            output = self.compressor.process(data)
+            return output + (self.compressor.finish() if final else self.compressor.flush())
+        output = self.compressor.compress(data)
+        return output + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing text responses with brotli or gzip, whichever the
+    client prefers. Complete bodies below minimum_bytes are sent as they are;
+    streamed bodies are always compressed, chunk by chunk.
+
+    Args:
+        app: The ASGI application.
+        minimum_bytes: The smallest body worth compressing.
+    """
+
+    def __init__(self, app, minimum_bytes: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_bytes = minimum_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # held back until the first body chunk decides the headers
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                if self.compressible(start["status"], headers):
+                    headers.add_vary_header("Accept-Encoding")
+                    large = more_body or len(body) >= self.minimum_bytes
+                    if encoding is not None and large:
+                        compressor = Compressor(encoding)
+                        headers["content-encoding"] = encoding
+                        if "content-length" in headers:
+                            del headers["content-length"]
+            if compressor is not None:
+                body = compressor.compress(body, final=not more_body)
+            if start is not None:
+                if compressor is not None and not more_body:
+                    headers["content-length"] = str(len(body))
+                await send(start)
+                start = None
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def compressible(status: int, headers: MutableHeaders) -> bool:
+        return (
+            status not in (204, 304)
+            and "content-encoding" not in headers
+            and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+        )
@@ -0,0 +1,410 @@
+"""
+Image proxy for the BGG thumbnails and images: every image is downloaded once,
+thumbnails are resized, and the files are kept in a size-bounded on-disk LRU cache.
+
+Templates link to /images/{item_id}/thumbnail instead of the BGG CDN, so a page
+of games is served from local files with strong ETags and long cache lifetimes.
+Resizing needs the optional Pillow package; without it images are stored as downloaded.
+"""
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import anyio
+import requests
+
+import database
+
+try:
+    from PIL import Image
+except ImportError:  # resizing is optional
+    Image = None
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 2**20
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "150"))  # pixels, longest side
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_WARMING = os.getenv("IMAGE_WARMING", "false").lower() == "true"
+# Largest accepted download, larger files are not images we want to serve
+MAX_DOWNLOAD_BYTES = 20 * 2**20
+IMAGE_KINDS = ("thumbnail", "image")
+IMAGE_FETCH_THREADS = int(os.getenv("IMAGE_FETCH_THREADS", "8"))
+IMAGE_FAILURE_TTL = float(os.getenv("IMAGE_FAILURE_TTL", "300"))  # seconds
+# Failed downloads remembered before the expired ones are swept out
+MAX_REMEMBERED_FAILURES = 10000
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+EXTENSIONS = {media_type: extension for extension, media_type in MEDIA_TYPES.items()}
+
+
+@dataclass
+class CachedImage:
+    """
+    A cached image file.
+
+    Attributes:
+        path: The file path.
+        etag: The strong ETag, a hash of the file content.
+        media_type: The content type, e.g. "image/jpeg".
+        size: The file size in bytes.
+    """
+
+    path: str
+    etag: str
+    media_type: str
+    size: int
+
+
+session = requests.Session()
+
+
+def fetch_image(url: str) -> tuple:
+    """
+    Downloads an image. The default fetcher of the ImageCache.
+
+    Args:
+        url: The image URL.
+
+    Returns:
+        A tuple of the image bytes and the content type.
+
+    Raises:
+        requests.exceptions.RequestException: If the download failed.
+        ValueError: If the response is not an image or too large.
+    """
+    with session.get(url, timeout=IMAGE_FETCH_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if media_type not in EXTENSIONS:
+            raise ValueError(f"Unsupported image type '{media_type}' from {url}")
+        data = response.raw.read(MAX_DOWNLOAD_BYTES + 1, decode_content=True)
+    if len(data) > MAX_DOWNLOAD_BYTES:
+        raise ValueError(f"Image larger than {MAX_DOWNLOAD_BYTES} bytes: {url}")
+    return data, media_type
+
+
+def resize_image(data: bytes, media_type: str, size: int) -> tuple:
+    """
+    Shrinks an image to fit a size x size box, keeping its aspect ratio.
+    Images without transparency are stored as JPEG, others as PNG.
+    Returns the image unchanged if Pillow is missing or it cannot be decoded.
+
+    Args:
+        data: The image bytes.
+        media_type: The content type of the image.
+        size: The length of the longest side in pixels.
+
+    Returns:
+        A tuple of the image bytes and the content type.
+    """
+    if Image is None:
+        return data, media_type
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            output = io.BytesIO()
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(output, format="PNG", optimize=True)
+                return output.getvalue(), "image/png"
+            image.convert("RGB").save(output, format="JPEG", quality=85, optimize=True)
+            return output.getvalue(), "image/jpeg"
+    except (OSError, ValueError):
+        return data, media_type
+
+
+class ImageCache:
+    """
+    On-disk LRU cache of the images of games, bounded by the total file size.
+
+    Files are named "<item_id>-<kind>-<etag><extension>", so the index of cached
+    images is rebuilt from the directory listing after a restart, with the oldest
+    downloads first in line for eviction. Concurrent requests for the same missing
+    image share one download, and a failed download is not retried for failure_ttl
+    seconds, so a broken or unreachable URL costs one request instead of one per page view.
+
+    Args:
+        directory: The cache directory, created on first use.
+        max_bytes: The total size of the cached files, least recently used are removed first.
+        fetcher: Callable downloading an image URL, returning (bytes, content type).
+            Replace it to serve images from a fake server.
+        thumbnail_size: The longest side of stored thumbnails in pixels.
+        failure_ttl: The seconds a failed download is remembered.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        fetcher: Callable[[str], tuple] = fetch_image,
+        thumbnail_size: int = THUMBNAIL_SIZE,
+        failure_ttl: float = IMAGE_FAILURE_TTL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher
+        self.thumbnail_size = thumbnail_size
+        self.failure_ttl = failure_ttl
+        self.entries = OrderedDict()
+        # key -> monotonic time until which the download is not retried
+        self.failed = {}
+        self.total_bytes = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.download_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.failures = 0
+        self.negative_hits = 0
+
+    def load(self) -> None:
+        """
+        Indexes the files already in the cache directory, oldest first.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            name, extension = os.path.splitext(entry.name)
+            parts = name.split("-")
+            if len(parts) != 3 or extension not in MEDIA_TYPES or not entry.is_file():
+                continue
+            stat = entry.stat()
+            cached = CachedImage(entry.path, parts[2], MEDIA_TYPES[extension], stat.st_size)
+            files.append((stat.st_mtime, f"{parts[0]}-{parts[1]}", cached))
+        for _, key, cached in sorted(files, key=lambda file: file[0]):
+            self.entries[key] = cached
+            self.total_bytes += cached.size
+        self.loaded = True
+        self.evict()
+
+    def lookup(self, key: str) -> Optional[CachedImage]:
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return cached
+
+    def get(self, item_id: int, kind: str, url: str = None) -> Optional[CachedImage]:
+        """
+        Returns the cached image of a game, downloading it on a miss.
+
+        Args:
+            item_id: The ID of the game.
+            kind: "thumbnail" or "image".
+            url: The image URL. Looked up in the database on a miss if not given.
+
+        Returns:
+            The cached image, or None if the game has no image or the download failed.
+        """
+        key = f"{item_id}-{kind}"
+        cached = self.lookup(key)
+        if cached is not None or self.recently_failed(key):
+            return cached
+        with self.lock:
+            download_lock = self.download_locks.setdefault(key, threading.Lock())
+        with download_lock:
+            cached = self.lookup(key)
+            if cached is None and not self.recently_failed(key):
+                url = url or database.get_image_url(item_id, kind)
+                cached = self.download(key, kind, url)
+        with self.lock:
+            self.download_locks.pop(key, None)
+        return cached
+
+    def download(self, key: str, kind: str, url: str) -> Optional[CachedImage]:
+        with self.lock:
+            self.misses += 1
+        if not url or not url.startswith(("http://", "https://")):
+            return None
+        try:
+            data, media_type = self.fetcher(url)
+        except (requests.exceptions.RequestException, ValueError) as err:
+            print(f"Image download failed: {err}")
+            self.remember_failure(key)
+            return None
+        if kind == "thumbnail":
+            data, media_type = resize_image(data, media_type, self.thumbnail_size)
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        path = os.path.join(self.directory, f"{key}-{etag}{EXTENSIONS[media_type]}")
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as image_file:
+            image_file.write(data)
+        os.replace(temporary_path, path)
+        cached = CachedImage(path, etag, media_type, len(data))
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None and previous.path != path:
+                self.remove_file(previous)
+            elif previous is not None:
+                self.total_bytes -= previous.size
+            self.entries[key] = cached
+            self.total_bytes += cached.size
+            self.evict()
+        return cached
+
+    def recently_failed(self, key: str) -> bool:
+        """
+        Checks whether the download of an image failed less than failure_ttl seconds ago.
+        """
+        with self.lock:
+            expires = self.failed.get(key)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self.failed[key]
+                return False
+            self.negative_hits += 1
+            return True
+
+    def remember_failure(self, key: str) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.failures += 1
+            if len(self.failed) >= MAX_REMEMBERED_FAILURES:
+                self.failed = {
+                    failed_key: expires
+                    for failed_key, expires in self.failed.items()
+                    if expires > now
+                }
+            self.failed[key] = now + self.failure_ttl
+
+    def remove_file(self, cached: CachedImage) -> None:
+        self.total_bytes -= cached.size
+        try:
+            os.remove(cached.path)
+        except FileNotFoundError:
+            pass
+
+    def discard(self, key: str, cached: CachedImage) -> None:
+        """
+        Forgets an image whose file disappeared, unless it was replaced meanwhile.
+        """
+        with self.lock:
+            if self.entries.get(key) is cached:
+                del self.entries[key]
+                self.total_bytes -= cached.size
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used files until the cache fits max_bytes.
+        The most recent image is kept even if it alone is larger. Called with the lock held.
+        """
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            _, cached = self.entries.popitem(last=False)
+            self.remove_file(cached)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Reports the number and size of the cached images and the hit, miss,
+        eviction and failed download counts, and the lookups answered by a
+        remembered failure.
+
+        Returns:
+            A dictionary with the image cache statistics.
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "failures": self.failures,
+                "negative_hits": self.negative_hits,
+            }
+
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+# Worker threads serving image requests, separate from the database threads
+# so slow downloads never hold up queries
+image_limiter = anyio.CapacityLimiter(IMAGE_FETCH_THREADS)
+
+
+def read_image(item_id: int, kind: str, etags: set = frozenset()) -> tuple:
+    """
+    Reads the cached image of a game, downloading it on a miss. A file evicted
+    between the lookup and the read is downloaded again.
+
+    Args:
+        item_id: The ID of the game.
+        kind: "thumbnail" or "image".
+        etags: The ETags the client already has, "*" for any.
+
+    Returns:
+        A tuple of the CachedImage and its content. The content is None if the
+        client's ETag matches; both are None if the game has no image.
+    """
+    for _ in range(2):
+        cached = image_cache.get(item_id, kind)
+        if cached is None or "*" in etags or cached.etag in etags:
+            return cached, None
+        try:
+            with open(cached.path, "rb") as image_file:
+                return cached, image_file.read()
+        except FileNotFoundError:
+            image_cache.discard(f"{item_id}-{kind}", cached)
+    return None, None
+
+
+async def get_image(item_id: int, kind: str, etags: set = frozenset()) -> tuple:
+    """
+    Runs read_image in a worker thread.
+    """
+    return await anyio.to_thread.run_sync(
+        read_image, item_id, kind, etags, limiter=image_limiter
+    )
+
+
+# Thumbnails of newly inserted games waiting to be downloaded by the warming thread
+warm_queue = queue.Queue(maxsize=10000)
+
+
+def queue_thumbnails(rows: list) -> None:
+    """
+    Queues the thumbnails of inserted games for download. Used as insert listener
+    when IMAGE_WARMING is enabled; thumbnails are skipped while the queue is full.
+
+    Args:
+        rows: The inserted rows as dictionaries.
+    """
+    for row in rows:
+        if row.get("thumbnail"):
+            try:
+                warm_queue.put_nowait((row["item_id"], row["thumbnail"]))
+            except queue.Full:
+                return
+
+
+def warm_thumbnails() -> None:
+    """
+    Downloads the queued thumbnails one at a time, runs in a daemon thread.
+    """
+    while True:
+        item_id, url = warm_queue.get()
+        try:
+            image_cache.get(item_id, "thumbnail", url)
+        except OSError as err:
+            print(f"Image warming failed: {err}")
+
+
+def start_image_warming() -> None:
+    """
+    Downloads the thumbnails of new games in the background during ingestion.
+    """
+    database.insert_listeners.append(queue_thumbnails)
+    threading.Thread(target=warm_thumbnails, daemon=True).start()
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Union
+
+from startup import new_data_job
+
+# Rough upper end of the BGG ID space, only used to estimate the remaining time
+ESTIMATED_MAX_ID = int(os.getenv("BGG_ESTIMATED_MAX_ID", "450000"))
+
+
+class BackgroundJob:
+    """
+    Runs a long BGG job in a background thread so the web server stays responsive.
+
+    Only one run of a job can be active at a time. The job can be cancelled and
+    reports the statistics its target passes to the progress callback.
+    The target is called as target(progress=..., stop_event=...) and returns its statistics.
+    """
+
+    def __init__(self, name: str, target: Callable[..., dict], estimate_eta=None):
+        self.name = name
+        self.target = target
+        self.estimate_eta = estimate_eta
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.state = "idle"
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.stats = {}
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self) -> bool:
+        """
+        Starts a new run unless one is already running.
+
+        Returns:
+            True if a new job was started, False if a job is already running.
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.stop_event = threading.Event()
+            self.state = "running"
+            self.started_at = time.time()
+            self.finished_at = None
+            self.error = None
+            self.stats = {}
+            self.thread = threading.Thread(
+                target=self.run, name=f"{self.name}-job", daemon=True
+            )
+            self.thread.start()
+            return True
+
+    def cancel(self) -> bool:
+        """
+        Asks the running job to stop after its requests in flight returned.
+
+        Returns:
+            True if a running job was asked to stop, False if no job is running.
+        """
+        with self.lock:
+            if not self.running:
+                return False
+            self.state = "cancelling"
+            self.stop_event.set()
+            return True
+
+    def join(self, timeout: float = None) -> None:
+        """
+        Waits for the running job to finish.
+
+        Args:
+            timeout: The maximum number of seconds to wait.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self) -> None:
+        try:
+            stats = self.target(progress=self.update, stop_event=self.stop_event)
+            self.update(stats)
+            self.state = "cancelled" if stats["cancelled"] else "finished"
+        except Exception as err:
+            traceback.print_exc()
+            self.error = repr(err)
+            self.state = "failed"
+        finally:
+            self.finished_at = time.time()
+
+    def update(self, stats: dict) -> None:
+        self.stats = dict(stats)
+
+    def status(self) -> dict:
+        """
+        Reports the state and progress of the current or last run.
+
+        Returns:
+            A dictionary with the state, the statistics of the run and
+            the estimated seconds left (None if unknown).
+        """
+        eta_seconds = None
+        if self.state == "running" and self.estimate_eta and self.stats:
+            eta_seconds = self.estimate_eta(self.stats, time.time() - self.started_at)
+        return {
+            "job": self.name,
+            "state": self.state,
+            "running": self.running,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.stats,
+            "eta_seconds": eta_seconds,
+            "error": self.error,
+        }
+
+
+def estimate_ingestion_eta(stats: dict, elapsed: float) -> Union[int, None]:
+    """
+    Estimates the seconds left until the download reaches the end of the BGG ID space.
+
+    Args:
+        stats: The harvest statistics.
+        elapsed: The seconds since the download started.
+
+    Returns:
+        The estimated seconds left, or None if unknown.
+    """
+    if stats.get("start_id") is None or stats.get("current_id") is None:
+        return None
+    ids_per_second = (stats["current_id"] - stats["start_id"]) / elapsed
+    if ids_per_second > 0 and stats["current_id"] < ESTIMATED_MAX_ID:
+        return round((ESTIMATED_MAX_ID - stats["current_id"]) / ids_per_second)
+    return None
+
+
+ingestion_job = BackgroundJob("ingestion", new_data_job, estimate_ingestion_eta)
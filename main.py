@@ -1,25 +1,82 @@
+import os
+import threading
 import uuid
-from typing import Annotated, Generator
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Annotated, Literal, Optional
 
-from fastapi import FastAPI, HTTPException, Depends, Request, Response, Form
+from fastapi import FastAPI, HTTPException, Request, Response, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
 
+import async_database
 import database
-from models import BoardgamePydantic
-from startup import check_db_connection, check_table_exists, new_data_job
+import metrics
+from archive import xml_archive
+from cache import result_cache
+from catalog import SortError, catalog_snapshot, parse_sort
+from export import MEDIA_TYPES, ExportError, export_catalog
+from http_cache import CompressionMiddleware, ConditionalMiddleware, validated_by
+from images import IMAGE_WARMING, get_image, image_cache, start_image_warming
+from models import (
+    BoardgamePydantic,
+    BoardgameSummary,
+    FacetedItems,
+    PlayPydantic,
+    SimilarBoardgame,
+)
+from pagination import decode_cursor, encode_cursor
+from pipeline import shutdown_parse_pools
+from ingestion import ingestion_job
+from refresh import refresh_job, start_refresh_scheduler
+from search import SearchError, check_search_term, prepare_search
+from startup import check_db_connection, check_schema_up_to_date, check_table_exists
+
+INGEST_ON_STARTUP = os.getenv("INGEST_ON_STARTUP", "true").lower() == "true"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Checks the database on startup, starts downloading new data from the BGG API
+    and schedules the stats refresh in the background. Cancels both on shutdown
+    and stops the parser processes of the ingestion pipeline.
+    """
+    check_db_connection(database.engine)
+    check_table_exists("boardgames", database.engine)
+    check_schema_up_to_date(database.engine)
+    threading.Thread(target=database.backfill_item_links, daemon=True).start()
+    threading.Thread(target=database.backfill_plays, daemon=True).start()
+    prepare_search(database.engine)
+    if IMAGE_WARMING:
+        start_image_warming()
+    if INGEST_ON_STARTUP:
+        ingestion_job.start()
+    refresh_scheduler = start_refresh_scheduler()
+    yield
+    refresh_scheduler.set()
+    refresh_job.cancel()
+    ingestion_job.cancel()
+    shutdown_parse_pools()
+
 
 # create FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 origins = ["*"]
 
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ConditionalMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -27,26 +84,70 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
-# Check database connection and table existence
-check_db_connection(database.engine)
-check_table_exists("boardgames", database.engine)
 
+def collect_gauges() -> None:
+    """
+    Copies the result cache statistics, the connection pool state, the archive size and the
+    database worker thread usage into their gauges before a scrape.
+    """
+    stats = result_cache.stats()
+    metrics.cache_entries.set(stats["entries"])
+    metrics.cache_lookups.set(stats["hits"], "hit")
+    metrics.cache_lookups.set(stats["misses"], "miss")
+    metrics.cache_evictions.set(stats["evictions"])
+    metrics.cache_invalidations.set(stats["invalidations"])
+    pool = database.engine.pool
+    if hasattr(pool, "checkedout"):
+        metrics.pool_connections.set(pool.checkedout(), "checked_out")
+        metrics.pool_connections.set(pool.checkedin(), "checked_in")
+        metrics.pool_connections.set(max(pool.overflow(), 0), "overflow")
+    images = image_cache.stats()
+    metrics.image_cache_entries.set(images["entries"])
+    metrics.image_cache_bytes.set(images["bytes"])
+    metrics.image_cache_lookups.set(images["hits"], "hit")
+    metrics.image_cache_lookups.set(images["misses"], "miss")
+    metrics.image_cache_lookups.set(images["negative_hits"], "failed_recently")
+    metrics.xml_archive_bytes.set(xml_archive.disk_bytes())
+    metrics.catalog_snapshot_bytes.set(catalog_snapshot.memory_usage()["total"])
+    limiter = async_database.db_limiter.statistics()
+    metrics.db_threads.set(limiter.borrowed_tokens, "busy")
+    metrics.db_threads.set(limiter.tasks_waiting, "waiting")
+
+
+metrics.add_collector(collect_gauges)
+
+
+def catalog_updated_at(path_params: dict):
+    """
+    Validator of the game lists: any write can change their content or order.
+    """
+    return database.get_catalog_updated_at()
 
-# Get new data from BGG API on startup
-new_data_job()
 
+def item_updated_at(path_params: dict):
+    """
+    Validator of a single game.
+    """
+    searched_id = path_params["searched_id"]
+    return database.get_item_updated_at(int(searched_id)) if searched_id.isdigit() else None
 
-# Dependency to get the database session
-def get_db() -> Generator:
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
+async def items_context(request: Request, items: list) -> dict:
+    """
+    Builds the template context of an item list with the latest play dates of every item,
+    fetched in one query for the whole list.
+
+    Args:
+        request: The incoming HTTP request object.
+        items: The boardgame rows to render.
 
-db_dependency = Annotated[Session, Depends(get_db)]
+    Returns:
+        The template context.
+    """
+    plays = await async_database.get_play_dates([item.item_id for item in items])
+    return {"request": request, "items": items, "plays": plays}
 
 
 # Routes
@@ -71,19 +172,182 @@ async def home(request: Request) -> Response:
 
 
 @app.get("/get_new_data")
-async def start_new_data_job() -> None:
+async def start_new_data_job() -> dict:
     """
     Triggers the background job to fetch new data from BGG API.
+    Does nothing if the job is already running.
+
+    Returns:
+        The status of the background job.
+    """
+    ingestion_job.start()
+    return ingestion_job.status()
+
+
+@app.post("/ingest/start", status_code=202)
+async def start_ingestion() -> dict:
+    """
+    Starts the background job fetching new data from BGG API.
+    Raises a 409 HTTP exception if the job is already running.
+
+    Returns:
+        The status of the background job.
+    """
+    if not ingestion_job.start():
+        raise HTTPException(status_code=409, detail="Ingestion is already running")
+    return ingestion_job.status()
+
+
+@app.post("/ingest/cancel")
+async def cancel_ingestion() -> dict:
+    """
+    Cancels the running background job once its requests in flight have returned.
+    Raises a 409 HTTP exception if no job is running.
+
+    Returns:
+        The status of the background job.
+    """
+    if not ingestion_job.cancel():
+        raise HTTPException(status_code=409, detail="Ingestion is not running")
+    return ingestion_job.status()
+
+
+@app.get("/ingest/status")
+async def ingestion_status() -> dict:
+    """
+    Reports the progress of the current or last background job:
+    state, current ID, items per second and estimated seconds left.
+
+    Returns:
+        The status of the background job.
+    """
+    return ingestion_job.status()
+
+
+@app.get("/crawl/status")
+async def crawl_status() -> dict:
+    """
+    Reports the stored crawl state shared by all crawler processes:
+    shards by status, crawled IDs, the frontier, known gaps and active claims.
+
+    Returns:
+        The crawl summary.
+    """
+    return await async_database.get_crawl_summary()
+
+
+@app.post("/refresh/start", status_code=202)
+async def start_refresh() -> dict:
+    """
+    Starts the background job refreshing the stats of stored items.
+    Raises a 409 HTTP exception if the job is already running.
 
     Returns:
-        None
+        The status of the refresh job.
     """
-    new_data_job()
+    if not refresh_job.start():
+        raise HTTPException(status_code=409, detail="Refresh is already running")
+    return refresh_job.status()
+
+
+@app.post("/refresh/cancel")
+async def cancel_refresh() -> dict:
+    """
+    Cancels the running refresh job after its current batch.
+    Raises a 409 HTTP exception if no job is running.
+
+    Returns:
+        The status of the refresh job.
+    """
+    if not refresh_job.cancel():
+        raise HTTPException(status_code=409, detail="Refresh is not running")
+    return refresh_job.status()
+
+
+@app.get("/refresh/status")
+async def refresh_status() -> dict:
+    """
+    Reports the progress of the current or last refresh job:
+    checked and changed items, requests and the remaining daily budget.
+
+    Returns:
+        The status of the refresh job.
+    """
+    return refresh_job.status()
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    """
+    Reports the size of the result cache and its hit, miss, eviction and
+    invalidation counts, used to size the cache.
+
+    Returns:
+        The cache statistics.
+    """
+    return result_cache.stats()
+
+
+@app.get("/catalog/stats")
+async def catalog_stats() -> dict:
+    """
+    Reports the number of games in the catalog snapshot used for sorting,
+    its build time, the changes applied since and its memory footprint.
+
+    Returns:
+        The snapshot statistics.
+    """
+    return catalog_snapshot.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics() -> Response:
+    """
+    Exposes the request latencies, SQL statement counts, harvester progress and the
+    cache and pool gauges in the Prometheus text format.
+
+    Returns:
+        The metrics text.
+    """
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/images/{item_id}/{kind}")
+async def read_image(
+    request: Request, item_id: int, kind: Literal["thumbnail", "image"]
+) -> Response:
+    """
+    Serves the thumbnail or the image of a board game from the local image cache,
+    downloading it from BGG on the first request. Thumbnails are resized.
+    Responses carry a strong ETag, and a matching If-None-Match is answered with 304.
+    Redirects to the placeholder image if the game has no image or the download failed.
+
+    Args:
+        request: The incoming HTTP request object.
+        item_id: The ID of the board game.
+        kind: "thumbnail" or "image".
+
+    Returns:
+        The image file, a 304 response or a redirect to the placeholder.
+    """
+    etags = {
+        tag.strip().removeprefix("W/").strip('"')
+        for tag in request.headers.get("if-none-match", "").split(",")
+    }
+    cached, content = await get_image(item_id, kind, etags)
+    if cached is None:
+        return RedirectResponse("/static/no_image.png", status_code=302)
+    headers = {"ETag": f'"{cached.etag}"', "Cache-Control": "public, max-age=86400"}
+    if content is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content, media_type=cached.media_type, headers=headers)
 
 
 @app.post("/item", response_class=HTMLResponse)
 async def get_item(
-    request: Request, searched_id: Annotated[int, Form()], db: db_dependency
+    request: Request, searched_id: Annotated[int, Form()]
 ) -> Response:
     """
     Queries the database for a board game item based on the provided ID.
@@ -93,90 +357,107 @@ async def get_item(
     Args:
         request: The incoming HTTP request object.
         searched_id: The ID of the board game item to retrieve.
-        db: The database session dependency.
 
     Returns:
         An HTTP response with the rendered item details template.
     """
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == searched_id)
-        .first()
-    )
-    context = {"request": request, "items": [item]}
+    item = await async_database.get_item(searched_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
+    context = await items_context(request, [item])
     return templates.TemplateResponse("item.html", context)
 
 
-@app.post("/items", response_class=HTMLResponse)
-async def read_items(
-    request: Request,
-    skip: Annotated[int, Form()],
-    limit: Annotated[int, Form()],
-    db: db_dependency,
+@app.get("/items", response_class=HTMLResponse)
+@validated_by(catalog_updated_at)
+async def read_ranked_items(
+    request: Request, limit: int, skip: int = 0, cursor: str = ""
 ) -> Response:
     """
     Queries the database for a list of board game items.
     Filters items by type to get only boardgames and orders them by Bayes average descending.
+    Pages with a cursor on (Bayes average, item ID), so every page costs the same;
+    skip is only applied to the first page, when no cursor is given.
+    The cursor for the next page is returned in the X-Next-Cursor header.
     Renders the item list template with the fetched items data.
     Raises a 404 HTTP exception if no items are found.
 
     Args:
         request: The incoming HTTP request object.
-        skip: The number of items to skip.
         limit: The number of items to retrieve.
-        db: The database session dependency.
+        skip: The number of items to skip on the first page. Defaults to 0.
+        cursor: The cursor returned with the previous page. Defaults to the first page.
 
     Returns:
         An HTTP response with the rendered item list template.
     """
-    items = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.type == "boardgame")
-        .order_by(database.Boardgame.c.bayes_average.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
+    return await ranked_items_page(request, limit, skip, cursor)
+
+
+@app.post("/items", response_class=HTMLResponse)
+async def read_items(
+    request: Request,
+    limit: Annotated[int, Form()],
+    skip: Annotated[int, Form()] = 0,
+    cursor: Annotated[str, Form()] = "",
+) -> Response:
+    """
+    The form variant of GET /items, kept for clients posting the page parameters.
+    """
+    return await ranked_items_page(request, limit, skip, cursor)
+
+
+async def ranked_items_page(
+    request: Request, limit: int, skip: int, cursor: str
+) -> Response:
+    """
+    Renders a page of the top games ranking for GET and POST /items.
+    """
+    after = decode_cursor(cursor, 2) if cursor else None
+    items = await async_database.get_ranked_items(limit, skip, after)
     if not items:
         raise HTTPException(status_code=404, detail="Items not found")
-    context = {"request": request, "items": items}
-    return templates.TemplateResponse("item_table.html", context)
+    context = await items_context(request, items)
+    response = templates.TemplateResponse("item_table.html", context)
+    if len(items) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            items[-1].bayes_average, items[-1].item_id
+        )
+    return response
 
 
 @app.get("/search", response_class=HTMLResponse)
-async def search_items(request: Request, search: str, db: db_dependency) -> Response:
+@validated_by(catalog_updated_at)
+async def search_items(request: Request, search: str) -> Response:
     """
-    Searches the database for board game items based on a search term.
-    The items are filtered and ordered first by ownership then by name.
+    Searches the primary and alternate names of board game items based on a search term.
+    Uses the trigram indexes, so typos still find matches.
+    The items are ordered by match quality and popularity.
     Renders the item list template with the fetched items data.
-    Raises a 404 HTTP exception if no items are found.
+    Raises a 400 HTTP exception for a term without letters or digits and a 404
+    HTTP exception if no items are found.
 
     Args:
         request: The incoming HTTP request object.
         search: The search term to use for filtering items.
-        db: The database session dependency.
 
     Returns:
         An HTTP response with the rendered item list template.
     """
-    items = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.name != "-1")
-        .order_by(database.Boardgame.c.owned.desc(), database.Boardgame.c.name)
-        .filter(database.Boardgame.c.name.icontains(search))
-        .limit(200)
-        .all()
-    )
+    try:
+        check_search_term(search)
+    except SearchError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    items = await async_database.search_items(search)
     if not items:
         raise HTTPException(status_code=404, detail="Items not found")
-    context = {"request": request, "items": items}
+    context = await items_context(request, items)
     return templates.TemplateResponse("item_table.html", context)
 
 
 @app.get("/owned", response_class=HTMLResponse)
-async def owned_items(request: Request, db: db_dependency) -> Response:
+@validated_by(catalog_updated_at)
+async def owned_items(request: Request) -> Response:
     """
     Queries the database for a list of owned board game items.
     Items are ordered alphabetically.
@@ -185,110 +466,83 @@ async def owned_items(request: Request, db: db_dependency) -> Response:
 
     Args:
         request: The incoming HTTP request object.
-        db: The database session dependency.
 
     Returns:
         An HTTP response with the rendered item list template.
     """
-    items = (
-        db.query(database.Boardgame)
-        .order_by(database.Boardgame.c.name.asc())
-        .filter(database.Boardgame.c.owned == True)
-        .all()
-    )
+    items = await async_database.get_owned_items()
     if not items:
         raise HTTPException(status_code=404, detail="No owned items found")
-    context = {"request": request, "items": items}
+    context = await items_context(request, items)
     return templates.TemplateResponse("item_table.html", context)
 
 
 @app.patch("/item/update_owned/{updated_id}", response_model_exclude_unset=True)
-async def update_item(updated_id: int, db: db_dependency) -> None:
+async def update_item(updated_id: int) -> None:
     """
     Updates the "owned" status of the boardgame with the provided ID.
-    The function first checks the current status and then switches it to the opposite.
+    The status is switched to the opposite in the database in a single statement.
     Raises a 404 HTTP exception if the item is not found.
 
     Args:
      updated_id: The ID of the board game to update.
-     db: The database session dependency.
 
     Returns:
      None
     """
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
+    item = await async_database.update_item_ownership(updated_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    database.update_item_ownership(updated_id)
 
 
 @app.post("/item/update_played/add/{updated_id}", response_model_exclude_unset=True)
-async def update_item(request: Request, updated_id: int, db: db_dependency) -> Response:
+async def update_item(
+    request: Request,
+    updated_id: int,
+    players: Annotated[Optional[int], Form()] = None,
+    notes: Annotated[Optional[str], Form()] = None,
+) -> Response:
     """
     Increments the "times played" count of the board game with the provided ID.
-    The current date is added to the "dates played" list.
-    After updating the count, re-fetches and re-renders the item from the database.
+    A play is logged for the current date, optionally with players and notes.
+    The updated item returned by the update is re-rendered.
     Raises a 404 HTTP exception if the item is not found.
 
     Args:
         request: The incoming HTTP request object.
         updated_id: The ID of the board game to update.
-        db: The database session dependency.
+        players: Optional number of players of the play (received from the form).
+        notes: Optional notes on the play (received from the form).
 
     Returns:
         An HTTP response with the rendered item details template.
     """
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
+    item = await async_database.update_times_played(updated_id, False, players, notes)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    database.update_times_played(updated_id, False)
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
-    context = {"request": request, "items": [item]}
+    context = await items_context(request, [item])
     return templates.TemplateResponse("item.html", context)
 
 
 @app.post("/item/update_played/subs/{updated_id}", response_model_exclude_unset=True)
-async def update_item(request: Request, updated_id: int, db: db_dependency) -> Response:
+async def update_item(request: Request, updated_id: int) -> Response:
     """
     Decrements the "times played" count of the board game with the provided ID.
-    The last date is deleted from the "dates played" list.
-    After updating the count, re-fetches and re-renders the item from the database.
+    The latest logged play is deleted. A game not played yet is left unchanged.
+    The updated item returned by the update is re-rendered.
     Raises a 404 HTTP exception if the item is not found.
 
     Args:
         request: The incoming HTTP request object.
         updated_id: The ID of the board game to update.
-        db: The database session dependency.
 
     Returns:
         An HTTP response with the rendered item details template.
     """
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
+    item = await async_database.update_times_played(updated_id, True)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    database.update_times_played(updated_id, True)
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
-    context = {"request": request, "items": [item]}
+    context = await items_context(request, [item])
     return templates.TemplateResponse("item.html", context)
 
 
@@ -297,60 +551,307 @@ async def update_item(
     request: Request,
     comments: Annotated[str, Form()],
     updated_id: int,
-    db: db_dependency,
 ) -> Response:
     """
     Rewrites the comments column for the board game with the provided ID.
-    After updating the comments, re-fetches and re-renders the item from the database.
+    The updated item returned by the update is re-rendered.
     Raises a 404 HTTP exception if the item is not found.
 
     Args:
         request: The incoming HTTP request object.
         comments: The new comments (received from the form).
         updated_id: The ID of the board game to update.
-        db: The database session dependency.
 
     Returns:
         An HTTP response with the rendered item details template.
     """
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
+    item = await async_database.update_comments(updated_id, comments)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    database.update_comments(updated_id, comments)
-    item = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == updated_id)
-        .first()
-    )
-    context = {"request": request, "items": [item]}
+    context = await items_context(request, [item])
     return templates.TemplateResponse("item.html", context)
 
 
 # Raw data routes
+@app.get("/plays", response_model=list[PlayPydantic])
+async def read_plays(
+    response: Response,
+    item_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = 50,
+    cursor: str = "",
+):
+    """
+    Retrieves the play history in JSON, newest first, of one game or the whole collection,
+    optionally limited to a date range, e.g. /plays?start=2024-01-01&end=2024-12-31.
+    Pages with a cursor on (date, play ID); the cursor for the next page is returned
+    in the X-Next-Cursor header.
+
+    Args:
+        response: The outgoing HTTP response, used to set the cursor header.
+        item_id: The ID of the board game. Defaults to every game.
+        start: The earliest play date to include.
+        end: The latest play date to include.
+        limit: The number of plays to retrieve. Defaults to 50.
+        cursor: The cursor returned with the previous page. Defaults to the first page.
+
+    Returns:
+        A list of PlayPydantic objects.
+    """
+    before = None
+    if cursor:
+        played_on, play_id = decode_cursor(cursor, 2)
+        try:
+            before = (date.fromisoformat(played_on), int(play_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    plays = await async_database.get_plays(limit, item_id, start, end, before)
+    if len(plays) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            plays[-1].played_on.isoformat(), plays[-1].play_id
+        )
+    return plays
+
+
+@app.get("/export")
+async def export_items(
+    format: Literal["ndjson", "csv", "parquet", "arrow"] = "ndjson",
+    columns: Annotated[list[str], Query()] = [],
+    type: Annotated[list[str], Query()] = [],
+    owned: Optional[bool] = None,
+    min_users_rated: Optional[int] = None,
+    min_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+) -> StreamingResponse:
+    """
+    Streams the catalog as NDJSON, CSV, Parquet or Arrow, ordered by item ID,
+    e.g. /export?format=csv&columns=item_id&columns=name&type=boardgame.
+    Rows are read through a server-side cursor and sent in chunks, so the whole
+    catalog can be downloaded in one request with flat memory use.
+    Raises a 400 HTTP exception for unknown columns or when pyarrow is missing.
+
+    Args:
+        format: The file format. Defaults to "ndjson".
+        columns: The columns to export. Defaults to every column.
+        type: Only export items of these types.
+        owned: Only export owned or not owned items.
+        min_users_rated: Only export items rated by at least this many users.
+        min_id, max_id: Only export items within this ID range.
+
+    Returns:
+        A streaming response with the exported file.
+    """
+    try:
+        chunks = export_catalog(
+            format,
+            columns,
+            types=type,
+            owned=owned,
+            min_users_rated=min_users_rated,
+            min_id=min_id,
+            max_id=max_id,
+        )
+    except ExportError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="boardgames.{format}"'},
+    )
+
+
+@app.get("/items/facets", response_model=FacetedItems)
+async def read_faceted_items(
+    categories: Annotated[list[str], Query()] = [],
+    mechanics: Annotated[list[str], Query()] = [],
+    families: Annotated[list[str], Query()] = [],
+    designers: Annotated[list[str], Query()] = [],
+    artists: Annotated[list[str], Query()] = [],
+    publishers: Annotated[list[str], Query()] = [],
+    mode: Literal["and", "or"] = "and",
+    limit: int = 20,
+    facet_limit: int = 20,
+):
+    """
+    Filters board games by categories, mechanics, families, designers, artists and publishers
+    in JSON, e.g. /items/facets?mechanics=Deck Building&categories=Fantasy.
+    With mode "and" items need every selected value, with mode "or" any of them.
+    Along with the items ordered by Bayes average, returns the value counts of every
+    facet among all matching items.
+
+    Args:
+        categories, mechanics, families, designers, artists, publishers: The selected facet values.
+        mode: How the selected values are combined, "and" or "or". Defaults to "and".
+        limit: The number of items to retrieve. Defaults to 20.
+        facet_limit: The number of values returned per facet. Defaults to 20.
+
+    Returns:
+        A FacetedItems object with the matching items and the facet counts.
+    """
+    selected = {
+        "categories": categories,
+        "mechanics": mechanics,
+        "families": families,
+        "designers": designers,
+        "artists": artists,
+        "publishers": publishers,
+    }
+    items, facets = await async_database.get_faceted_items(
+        selected, mode == "and", limit, facet_limit
+    )
+    return {
+        "items": items,
+        "facets": {
+            kind: [{"name": name, "count": count} for name, count in values]
+            for kind, values in facets.items()
+        },
+    }
+
+
 @app.get(
     "/items/all",
     response_model=list[BoardgamePydantic],
     response_model_exclude_unset=True,
 )
-async def read_items(db: db_dependency, skip: int = 0, limit: int = 10):
+@validated_by(catalog_updated_at)
+async def read_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    cursor: str = "",
+):
     """
-    Retrieves a list of board games from the database in JSON.
-    Uses offset and limit parameters.
+    Retrieves a list of board games from the database in JSON, ordered by item ID.
+    Pages with a cursor on the item ID; skip is only applied when no cursor is given.
+    The cursor for the next page is returned in the X-Next-Cursor header.
     Raises a 404 HTTP exception if no items are found.
 
     Args:
-        db: The database session dependency.
-        skip: The number of items to skip. Defaults to 0.
+        response: The outgoing HTTP response, used to set the cursor header.
+        skip: The number of items to skip when no cursor is given. Defaults to 0.
         limit: The number of items to retrieve. Defaults to 10.
+        cursor: The cursor returned with the previous page. Defaults to the first page.
 
     Returns:
         A list of BoardgamePydantic objects representing the retrieved items.
     """
-    items = db.query(database.Boardgame).offset(skip).limit(limit).all()
+    after = decode_cursor(cursor, 1)[0] if cursor else None
+    items = await async_database.get_items_by_id(limit, skip, after)
+    if not items:
+        raise HTTPException(status_code=404, detail="Items not found")
+    if len(items) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(items[-1].item_id)
+    return items
+
+
+@app.get("/items/filter", response_model=list[BoardgameSummary])
+@validated_by(catalog_updated_at)
+async def read_filtered_items(
+    request: Request,
+    response: Response,
+    players: Optional[int] = None,
+    min_playtime: Optional[int] = None,
+    max_playtime: Optional[int] = None,
+    min_weight: Optional[float] = None,
+    max_weight: Optional[float] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    type: Literal["boardgame", "boardgameexpansion", "boardgameaccessory"] = "boardgame",
+    limit: int = 20,
+    cursor: str = "",
+    format: Literal["json", "html"] = "json",
+):
+    """
+    Retrieves board games matching any combination of player count, play time,
+    weight, age and year ranges, e.g. players=3&max_playtime=60&min_weight=2&max_weight=3.
+    Games are ordered by Bayes average descending and paged with a cursor on
+    (Bayes average, item ID) returned in the X-Next-Cursor header.
+    Raises a 404 HTTP exception if no items are found.
+
+    Args:
+        request: The incoming HTTP request object.
+        response: The outgoing HTTP response, used to set the cursor header.
+        players: Keep games playable with this many players.
+        min_playtime: Keep games whose minimum play time is at least this many minutes.
+        max_playtime: Keep games whose maximum play time is at most this many minutes.
+        min_weight: Keep games with at least this average weight (1-5).
+        max_weight: Keep games with at most this average weight.
+        min_age: Keep games with at least this minimum age.
+        max_age: Keep games playable at this age, i.e. a minimum age of at most this.
+        min_year: Keep games published in or after this year.
+        max_year: Keep games published in or before this year.
+        type: The item type. Defaults to "boardgame".
+        limit: The number of items to retrieve. Defaults to 20.
+        cursor: The cursor returned with the previous page. Defaults to the first page.
+        format: "json" for list view items or "html" for the rendered item list.
+
+    Returns:
+        A list of BoardgameSummary objects, or the rendered item list template.
+    """
+    filters = {
+        "players": players,
+        "min_playtime": min_playtime,
+        "max_playtime": max_playtime,
+        "min_weight": min_weight,
+        "max_weight": max_weight,
+        "min_age": min_age,
+        "max_age": max_age,
+        "min_year": min_year,
+        "max_year": max_year,
+    }
+    after = decode_cursor(cursor, 2) if cursor else None
+    items = await async_database.get_filtered_items(filters, limit, type, after)
+    if not items:
+        raise HTTPException(status_code=404, detail="Items not found")
+    next_cursor = None
+    if len(items) == limit:
+        next_cursor = encode_cursor(items[-1].bayes_average, items[-1].item_id)
+    if format == "html":
+        context = await items_context(request, items)
+        page = templates.TemplateResponse("item_table.html", context)
+        if next_cursor:
+            page.headers["X-Next-Cursor"] = next_cursor
+        return page
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+
+@app.get("/items/sorted", response_model=list[BoardgameSummary])
+@validated_by(catalog_updated_at)
+async def read_sorted_items(
+    sort: str = "-bayes_average",
+    skip: int = 0,
+    limit: int = 20,
+    type: Optional[Literal["boardgame", "boardgameexpansion", "boardgameaccessory"]] = None,
+    owned: Optional[bool] = None,
+):
+    """
+    Retrieves a page of board games sorted by up to four columns, e.g.
+    sort=-average_weight,yearpublished for the heaviest games, oldest first among ties.
+    Any numeric column, the name, type and ownership can be sorted on; games without
+    a value are listed last. Sorting runs on the in-memory catalog snapshot.
+    Raises a 400 HTTP exception for unknown sort columns and a 404 if no items are found.
+
+    Args:
+        sort: Comma-separated column names, a leading minus sorts descending.
+            Defaults to the Bayes average descending.
+        skip: The number of items to skip. Defaults to 0.
+        limit: The number of items to retrieve. Defaults to 20.
+        type: Optional item type to filter on.
+        owned: Optional ownership status to filter on.
+
+    Returns:
+        A list of BoardgameSummary objects in sort order.
+    """
+    try:
+        sort_keys = parse_sort(sort)
+    except SortError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    items = await async_database.get_sorted_items(sort_keys, limit, skip, type, owned)
     if not items:
         raise HTTPException(status_code=404, detail="Items not found")
     return items
@@ -361,23 +862,39 @@ async def read_items(db: db_dependency, skip: int = 0, limit: int = 10):
     response_model=BoardgamePydantic,
     response_model_exclude_unset=True,
 )
-async def read_items_id(searched_id: int, db: db_dependency):
+@validated_by(item_updated_at)
+async def read_items_id(searched_id: int):
     """
     Retrieves a single board game from the database by ID.
     Raises a 404 HTTP exception if the item with the provided ID is not found.
 
     Args:
         searched_id: The ID of the board game to retrieve.
-        db: The database session dependency.
 
     Returns:
         A BoardgamePydantic object representing the retrieved item.
     """
-    items = (
-        db.query(database.Boardgame)
-        .filter(database.Boardgame.c.item_id == searched_id)
-        .first()
-    )
+    items = await async_database.get_item(searched_id)
     if not items:
         raise HTTPException(status_code=404, detail="Item not found")
     return items
+
+
+@app.get("/items/{searched_id}/similar", response_model=list[SimilarBoardgame])
+async def read_similar_items(searched_id: int, limit: int = 10):
+    """
+    Retrieves the board games most similar to a board game by mechanics, categories,
+    designers, families and weight, most similar first.
+    Raises a 404 HTTP exception if no recommendations are stored for the item.
+
+    Args:
+        searched_id: The ID of the board game to retrieve recommendations for.
+        limit: The number of items to retrieve. Defaults to 10.
+
+    Returns:
+        A list of SimilarBoardgame objects.
+    """
+    items = await async_database.get_similar_items(searched_id, limit)
+    if not items:
+        raise HTTPException(status_code=404, detail="No recommendations for this item")
+    return items
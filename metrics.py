@@ -0,0 +1,291 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+# (statements, seconds) of the SQL run for the current request
+request_queries = ContextVar("request_queries", default=None)
+
+
+class Metric:
+    """
+    Base of the metric types: a named family of values keyed by label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def label_text(self, label_values: tuple, extra: str = "") -> str:
+        pairs = [
+            f'{label}="{escape_label(value)}"'
+            for label, value in zip(self.labels, label_values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def set(self, value: float, *label_values) -> None:
+        with self.lock:
+            self.values[label_values] = value
+
+    def samples(self) -> list:
+        with self.lock:
+            return [
+                f"{self.name}{self.label_text(key)} {format_value(value)}"
+                for key, value in self.values.items()
+            ]
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(sample + "\n" for sample in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, *label_values) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # bucket counts, then the sum of the observed values
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> list:
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        lines = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{format_value(bound) if bound != "+Inf" else bound}"'
+                lines.append(f"{self.name}_bucket{self.label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(key)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{self.label_text(key)} {cumulative}")
+        return lines
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+registry = []
+# Callables run before every scrape, used to set gauges from their sources
+collectors = []
+
+http_requests = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by route.",
+    ("method", "route", "status"),
+)
+http_request_statements = Histogram(
+    "http_request_db_statements",
+    "SQL statements executed per HTTP request by route.",
+    ("route",),
+    STATEMENT_BUCKETS,
+)
+http_request_db_seconds = Histogram(
+    "http_request_db_seconds",
+    "Time spent executing SQL per HTTP request by route.",
+    ("route",),
+)
+db_statements = Counter(
+    "db_statements_total",
+    "SQL statements executed, by requests or background jobs.",
+    ("source",),
+)
+db_statement_seconds = Counter(
+    "db_statement_seconds_total",
+    "Time spent executing SQL, by requests or background jobs.",
+    ("source",),
+)
+harvest_items = Counter("harvest_items_total", "Items downloaded from the BGG API.")
+harvest_retries = Counter("harvest_retries_total", "Retried BGG API requests.")
+harvest_items_per_second = Gauge(
+    "harvest_items_per_second", "Download rate of the current or last harvest."
+)
+harvest_batch_seconds = Histogram(
+    "harvest_batch_seconds", "Latency of BGG API batch requests, retries included."
+)
+pipeline_stage_seconds = Counter(
+    "ingest_pipeline_stage_seconds_total",
+    "Time the workers of an ingestion pipeline stage spent busy.",
+    ("stage",),
+)
+pipeline_stage_items = Counter(
+    "ingest_pipeline_stage_items_total",
+    "Items passed through an ingestion pipeline stage.",
+    ("stage",),
+)
+pipeline_queue_depth = Gauge(
+    "ingest_pipeline_queue_depth",
+    "Batches waiting in the input queue of an ingestion pipeline stage.",
+    ("stage",),
+)
+pool_checkout_seconds = Histogram(
+    "db_pool_checkout_seconds",
+    "Time waited for a pooled connection, including opening new connections.",
+    buckets=WAIT_BUCKETS,
+)
+pool_checkout_timeouts = Counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that timed out on an exhausted pool."
+)
+# Set by the collectors at scrape time
+cache_entries = Gauge("result_cache_entries", "Entries in the result cache.")
+cache_lookups = Counter(
+    "result_cache_lookups_total", "Result cache lookups by result.", ("result",)
+)
+cache_evictions = Counter("result_cache_evictions_total", "Entries evicted from the result cache.")
+cache_invalidations = Counter(
+    "result_cache_invalidations_total", "Entries invalidated by writes."
+)
+pool_connections = Gauge(
+    "db_pool_connections", "Connections of the database pool by state.", ("state",)
+)
+image_cache_entries = Gauge("image_cache_entries", "Images in the on-disk image cache.")
+image_cache_bytes = Gauge("image_cache_bytes", "Size of the files in the image cache.")
+image_cache_lookups = Counter(
+    "image_cache_lookups_total", "Image cache lookups by result.", ("result",)
+)
+xml_archive_bytes = Gauge("xml_archive_bytes", "Size of the files in the XML archive.")
+catalog_snapshot_bytes = Gauge("catalog_snapshot_bytes", "Memory held by the catalog snapshot.")
+db_threads = Gauge("db_threads", "Worker threads running database calls by state.", ("state",))
+
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+
+    Returns:
+        The metrics text.
+    """
+    for collect in collectors:
+        collect()
+    return "".join(metric.render() for metric in registry)
+
+
+def instrument_engine(engine) -> None:
+    """
+    Counts and times every SQL statement of an engine. Statements run while a request
+    is served are also added to the request, see request_queries.
+
+    Args:
+        engine: The SQLAlchemy engine.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        queries = request_queries.get()
+        if queries is None:
+            db_statements.inc(1, "background")
+            db_statement_seconds.inc(elapsed, "background")
+        else:
+            queries[0] += 1
+            queries[1] += elapsed
+            db_statements.inc(1, "request")
+            db_statement_seconds.inc(elapsed, "request")
+
+    @event.listens_for(engine, "handle_error")
+    def drop_timer(exception_context):
+        started = exception_context.connection and exception_context.connection.info.get(
+            "query_started"
+        )
+        if started:
+            started.pop()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency and the SQL statements of every request
+    by route template, e.g. "/items/{searched_id}", so label values stay bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+
+    def route_path(self, scope: dict) -> str:
+        if self.route_paths is None:
+            router = scope["app"].router
+            self.route_paths = {
+                getattr(route, "endpoint", None) or route.app: route.path
+                for route in router.routes
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_queries.reset(token)
+            route = self.route_path(scope)
+            http_requests.observe(elapsed, scope["method"], route, status[0])
+            http_request_statements.observe(queries[0], route)
+            http_request_db_seconds.observe(queries[1], route)
+
+
+def add_collector(collect: Callable[[], None]) -> None:
+    """
+    Registers a callable run before every scrape, e.g. to copy pool sizes into gauges.
+    """
+    collectors.append(collect)
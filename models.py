@@ -1,3 +1,6 @@
+from datetime import date
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -43,3 +46,64 @@ class BoardgamePydantic(BaseModel):
     average_weight: float
     thumbnail: str
     image: str
+
+
+class BoardgameSummary(BaseModel):
+    """
+    Pydantic model representing a board game in list views.
+
+    Holds only the columns the item lists render (database.LIST_VIEW_COLUMNS),
+    the description and link lists are left to the detail endpoints.
+    """
+
+    item_id: int
+    type: str
+    name: str
+    owned: bool
+    times_played: int
+    comments: str
+    minplayers: int
+    maxplayers: int
+    bayes_average: float
+    average_weight: float
+    thumbnail: str
+
+
+class SimilarBoardgame(BoardgameSummary):
+    """
+    Pydantic model representing a recommended board game and its similarity score.
+    """
+
+    similarity: float
+
+
+class PlayPydantic(BaseModel):
+    """
+    Pydantic model representing a logged play of a board game.
+    """
+
+    play_id: int
+    item_id: int
+    name: str
+    played_on: date
+    players: Optional[int] = None
+    notes: Optional[str] = None
+
+
+class FacetCount(BaseModel):
+    """
+    Pydantic model representing how many matching items have a facet value.
+    """
+
+    name: str
+    count: int
+
+
+class FacetedItems(BaseModel):
+    """
+    Pydantic model representing the result of a faceted filter: the matching items
+    and, per facet kind, the most frequent values among all matching items.
+    """
+
+    items: list[BoardgameSummary]
+    facets: dict[str, list[FacetCount]]
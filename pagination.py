@@ -0,0 +1,40 @@
+import base64
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values) -> str:
+    """
+    Encodes the sort key of the last item of a page into an opaque cursor token.
+
+    Args:
+        values: The sort key values, e.g. Bayes average and item ID.
+
+    Returns:
+        A URL-safe cursor token.
+    """
+    payload = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> list:
+    """
+    Decodes a cursor token created by encode_cursor.
+    Raises a 400 HTTP exception if the token is not valid.
+
+    Args:
+        token: The cursor token.
+        size: The number of sort key values the cursor must contain.
+
+    Returns:
+        The list of sort key values.
+    """
+    try:
+        padding = "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(token + padding))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
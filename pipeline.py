@@ -0,0 +1,429 @@
+"""
+Staged ingestion pipeline: fetch -> parse -> write.
+
+Fetch threads download batches of IDs and put the raw responses on a bounded queue.
+Parse workers hand them to a pool of processes, so parsing the XML neither holds the
+GIL of the fetchers nor waits for the network, and put the parsed items on a second
+bounded queue. A single writer stores them in ID order, merging batches into one
+transaction until PIPELINE_WRITE_ROWS rows are buffered or PIPELINE_WRITE_INTERVAL
+seconds passed. A full queue blocks the stage before it, and the number of batches
+between being scheduled and being written is capped, so a slow stage throttles the
+others instead of piling up responses in memory.
+
+Every stage reports its busy time, throughput and input queue depth; the stage with
+the highest utilization is the bottleneck and the one worth scaling.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import metrics
+
+# Parser processes; 0 parses in threads of the pipeline process, which is faster on
+# a single core than shipping every response to another process
+PIPELINE_PARSERS = int(
+    os.getenv("PIPELINE_PARSERS", str(min(4, (os.cpu_count() or 1) - 1)))
+)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))  # batches per queue
+PIPELINE_WRITE_ROWS = int(os.getenv("PIPELINE_WRITE_ROWS", "500"))
+PIPELINE_WRITE_INTERVAL = float(os.getenv("PIPELINE_WRITE_INTERVAL", "2"))  # seconds
+# How often blocked stages check whether the pipeline is stopping
+POLL_INTERVAL = 0.1
+
+FETCH, PARSE, WRITE = "fetch", "parse", "write"
+# Marks the end of the input of a stage
+DONE = None
+
+# Parser pools by size, started once per process and reused by every pipeline, since
+# starting the interpreters takes longer than parsing a shard
+parse_pools = {}
+parse_pools_lock = threading.Lock()
+
+
+def get_parse_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    Returns the shared pool of parser processes of the given size, starting it on first use.
+    """
+    with parse_pools_lock:
+        pool = parse_pools.get(processes)
+        if pool is None:
+            # fresh interpreters, so no worker inherits locks held by other threads
+            pool = parse_pools[processes] = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        return pool
+
+
+def shutdown_parse_pools() -> None:
+    """
+    Stops the shared parser processes. Needed before a multiprocessing child exits,
+    which otherwise waits for them forever; the main process stops them at exit.
+    """
+    with parse_pools_lock:
+        pools = list(parse_pools.values())
+        parse_pools.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
+
+
+class StageStats:
+    """
+    Thread-safe counters of one pipeline stage.
+
+    Args:
+        name: The stage name, used as the metrics label.
+        workers: The number of threads or processes working the stage.
+        inbox: The queue the stage reads from, None for the first stage.
+    """
+
+    def __init__(self, name: str, workers: int, inbox: queue.Queue = None):
+        self.name = name
+        self.workers = workers
+        self.inbox = inbox
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, items: int, batches: int = 1) -> None:
+        with self.lock:
+            self.batches += batches
+            self.items += items
+            self.busy_seconds += seconds
+        metrics.pipeline_stage_seconds.inc(seconds, self.name)
+        metrics.pipeline_stage_items.inc(items, self.name)
+
+    def count_items(self, items: int) -> None:
+        """
+        Adds items found later, e.g. those of a fetched batch once it is parsed.
+        """
+        self.record(0.0, items, batches=0)
+
+    def sample_depth(self) -> None:
+        """
+        Records the depth of the input queue, called whenever the stage takes a batch.
+        """
+        if self.inbox is None:
+            return
+        depth = self.inbox.qsize()
+        with self.lock:
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+        metrics.pipeline_queue_depth.set(depth, self.name)
+
+    def stats(self, elapsed: float) -> dict:
+        """
+        Returns:
+            The stage statistics: workers, batches, items, busy seconds, utilization
+            (the share of the elapsed time its workers were busy), items per second
+            and the items per second it could sustain if it never waited for input,
+            and the current, mean and maximum depth of its input queue.
+        """
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "batches": self.batches,
+                "items": self.items,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "utilization": round(
+                    self.busy_seconds / (elapsed * self.workers) if elapsed else 0.0, 3
+                ),
+                "items_per_second": round(self.items / elapsed if elapsed else 0.0, 1),
+                "capacity_items_per_second": round(
+                    self.items * self.workers / self.busy_seconds
+                    if self.busy_seconds
+                    else 0.0,
+                    1,
+                ),
+                "queue_depth": self.inbox.qsize() if self.inbox is not None else None,
+                "mean_queue_depth": round(
+                    self.depth_total / self.depth_samples if self.depth_samples else 0.0, 2
+                ),
+                "max_queue_depth": self.max_depth,
+            }
+
+
+class IngestPipeline:
+    """
+    Runs batches of IDs through the fetch, parse and write stages.
+
+    Args:
+        schedule: Returns the (start_id, size) of the next batch, or None when there
+            are no more. Called by the fetch threads one at a time.
+        fetch: Downloads a batch, receiving its start ID and size and returning the raw
+            response. Runs in the fetch threads.
+        parse: Turns a raw response into a dictionary of items keyed by ID. Must be a
+            module-level function when parsers run in processes.
+        write: Stores a dictionary of items in one transaction.
+        fetchers: The number of fetch threads.
+        parsers: The number of parser processes, 0 to parse in a thread.
+        queue_size: The capacity in batches of the queues between the stages.
+        write_rows: The buffered rows that trigger a write.
+        write_interval: The seconds after which buffered rows are written anyway.
+        stop_at_empty: Stop at the first batch without items, which is not written.
+        on_batch: Called by the writer with the start ID, size and items of every
+            batch in ID order, empty ones included, once they are stored.
+            Returning False stops the pipeline.
+        stop_event: Optional event that stops the pipeline; batches already parsed
+            in order are still written.
+    """
+
+    def __init__(
+        self,
+        schedule: Callable[[], Optional[tuple]],
+        fetch: Callable[[int, int], object],
+        parse: Callable[[object], dict],
+        write: Callable[[dict], None],
+        fetchers: int,
+        parsers: int = PIPELINE_PARSERS,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        write_rows: int = PIPELINE_WRITE_ROWS,
+        write_interval: float = PIPELINE_WRITE_INTERVAL,
+        stop_at_empty: bool = False,
+        on_batch: Callable[[int, int, dict], bool] = None,
+        stop_event: threading.Event = None,
+    ):
+        self.schedule = schedule
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.fetchers = fetchers
+        self.parsers = parsers
+        self.write_rows = write_rows
+        self.write_interval = write_interval
+        self.stop_at_empty = stop_at_empty
+        self.on_batch = on_batch
+        self.stop_event = stop_event or threading.Event()
+        self.stopping = threading.Event()
+        self.fetched = queue.Queue(queue_size)
+        self.parsed = queue.Queue(queue_size)
+        # Batches between being scheduled and being written, so the writer's reorder
+        # buffer stays bounded while one slow batch holds back the ones after it
+        self.window = threading.Semaphore(fetchers + max(parsers, 1) + 2 * queue_size)
+        self.schedule_lock = threading.Lock()
+        self.sequence = 0
+        # set by the writer: stop_at_empty reached an empty batch, on_batch returned False
+        self.exhausted = False
+        self.cancelled = False
+        self.error = None
+        self.started = None
+        self.stages = {
+            FETCH: StageStats(FETCH, fetchers),
+            PARSE: StageStats(PARSE, max(parsers, 1), self.fetched),
+            WRITE: StageStats(WRITE, 1, self.parsed),
+        }
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The statistics of every stage by stage name, see StageStats.stats.
+        """
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {name: stage.stats(elapsed) for name, stage in self.stages.items()}
+
+    def run(self) -> bool:
+        """
+        Runs the pipeline until the schedule is exhausted or it is stopped.
+
+        Returns:
+            True if it was cancelled by the stop event or on_batch, False if the
+            schedule was exhausted or stop_at_empty reached an empty batch.
+
+        Raises:
+            The first exception raised by a stage, after all stages stopped.
+        """
+        self.started = time.monotonic()
+        pool = get_parse_pool(self.parsers) if self.parsers else None
+        fetchers = [
+            threading.Thread(target=self.guard, args=(self.fetch_worker,), name=f"fetch-{n}")
+            for n in range(self.fetchers)
+        ]
+        parsers = [
+            threading.Thread(target=self.guard, args=(self.parse_worker, pool), name=f"parse-{n}")
+            for n in range(max(self.parsers, 1))
+        ]
+        writer = threading.Thread(target=self.guard, args=(self.write_worker,), name="write")
+        try:
+            for thread in fetchers + parsers + [writer]:
+                thread.start()
+            for thread in fetchers:
+                thread.join()
+            for _ in parsers:
+                self.put(self.fetched, DONE)
+            for thread in parsers:
+                thread.join()
+            self.put(self.parsed, DONE)
+            writer.join()
+        finally:
+            self.stopping.set()
+        if isinstance(self.error, BrokenProcessPool):
+            # a parser process died; the next pipeline starts a new pool
+            with parse_pools_lock:
+                parse_pools.pop(self.parsers, None)
+        if self.error is not None:
+            raise self.error
+        return self.cancelled or (self.stop_event.is_set() and not self.exhausted)
+
+    def guard(self, worker: Callable, *args) -> None:
+        """
+        Runs a stage worker and stops the whole pipeline if it fails.
+        """
+        try:
+            worker(*args)
+        except BaseException as err:
+            if self.error is None:
+                self.error = err
+            self.stopping.set()
+
+    def halted(self) -> bool:
+        if self.stop_event.is_set():
+            self.stopping.set()
+        return self.stopping.is_set()
+
+    def put(self, inbox: queue.Queue, item) -> bool:
+        """
+        Puts an item on a bounded queue, waiting while it is full.
+
+        Returns:
+            False if the pipeline stopped before there was room.
+        """
+        while not self.stopping.is_set():
+            try:
+                inbox.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, inbox: queue.Queue, timeout: float = None):
+        """
+        Takes an item from a queue, waiting at most timeout seconds.
+
+        Raises:
+            queue.Empty: If the timeout passed or the pipeline stopped first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.stopping.is_set():
+            wait = POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            try:
+                return inbox.get(timeout=wait)
+            except queue.Empty:
+                continue
+        raise queue.Empty
+
+    def next_batch(self) -> Optional[tuple]:
+        """
+        Reserves a slot in the window and schedules the next batch.
+
+        Returns:
+            The sequence number, start ID and size of the batch, or None.
+        """
+        while not self.window.acquire(timeout=POLL_INTERVAL):
+            if self.halted():
+                return None
+        with self.schedule_lock:
+            batch = None if self.halted() else self.schedule()
+            if batch is None:
+                self.window.release()
+                return None
+            self.sequence += 1
+            return (self.sequence - 1, *batch)
+
+    def fetch_worker(self) -> None:
+        stage = self.stages[FETCH]
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            sequence, start_id, size = batch
+            started = time.monotonic()
+            response = self.fetch(start_id, size)
+            # the items of the batch are counted once it is parsed
+            stage.record(time.monotonic() - started, 0)
+            if not self.put(self.fetched, (sequence, start_id, size, response)):
+                return
+
+    def parse_worker(self, pool: Optional[ProcessPoolExecutor]) -> None:
+        stage = self.stages[PARSE]
+        while True:
+            try:
+                batch = self.get(self.fetched)
+            except queue.Empty:
+                return
+            if batch is DONE:
+                return
+            stage.sample_depth()
+            sequence, start_id, size, response = batch
+            started = time.monotonic()
+            if pool is None:
+                items_data = self.parse(response)
+            else:
+                items_data = pool.submit(self.parse, response).result()
+            stage.record(time.monotonic() - started, len(items_data))
+            self.stages[FETCH].count_items(len(items_data))
+            if not self.put(self.parsed, (sequence, start_id, size, items_data)):
+                return
+
+    def write_worker(self) -> None:
+        """
+        Reorders the parsed batches by sequence number and writes them in ID order.
+        Batches accepted before the pipeline stopped are still written.
+        """
+        stage = self.stages[WRITE]
+        waiting = {}  # parsed batches ahead of the next one in order
+        accepted = []  # batches in order, not yet written
+        rows = {}
+        next_sequence = 0
+        flushed_at = time.monotonic()
+        done = False
+        while not done:
+            timeout = max(0.0, flushed_at + self.write_interval - time.monotonic())
+            try:
+                batch = self.get(self.parsed, timeout)
+                if batch is DONE:
+                    done = True
+                else:
+                    stage.sample_depth()
+                    waiting[batch[0]] = batch[1:]
+            except queue.Empty:
+                done = self.stopping.is_set()
+            while next_sequence in waiting and not self.exhausted:
+                start_id, size, items_data = waiting.pop(next_sequence)
+                next_sequence += 1
+                self.window.release()
+                if self.stop_at_empty and not items_data:
+                    self.exhausted = True
+                    self.stopping.set()
+                    break
+                accepted.append((start_id, size, items_data))
+                rows.update(items_data)
+            due = time.monotonic() - flushed_at >= self.write_interval
+            if accepted and (done or due or len(rows) >= self.write_rows):
+                started = time.monotonic()
+                if rows:
+                    self.write(rows)
+                stage.record(time.monotonic() - started, len(rows), len(accepted))
+                for start_id, size, items_data in accepted:
+                    if self.on_batch is not None and (
+                        self.on_batch(start_id, size, items_data) is False
+                    ):
+                        self.cancelled = True
+                        self.stopping.set()
+                        return
+                accepted, rows = [], {}
+                flushed_at = time.monotonic()
+            elif due:
+                flushed_at = time.monotonic()
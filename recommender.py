@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import database
+
+# Recommender settings
+SIMILAR_COUNT = int(os.getenv("SIMILAR_COUNT", "20"))
+SIMILARITY_BATCH_SIZE = int(os.getenv("SIMILARITY_BATCH_SIZE", "256"))
+# Features shared by more than this share of the games carry almost no signal
+# and would make the similarity products dense, so they are dropped
+MAX_FEATURE_SHARE = 0.05
+# Candidates per game re-ranked by weight closeness before keeping the top SIMILAR_COUNT
+CANDIDATE_FACTOR = 3
+FEATURE_WEIGHTS = {
+    "mechanics": 1.0,
+    "categories": 0.8,
+    "designers": 0.6,
+    "families": 0.4,
+}
+
+# IDs of inserted items not yet included in the stored recommendations
+pending_ids = set()
+pending_lock = threading.Lock()
+
+
+def collect_inserted_ids(rows: list) -> None:
+    """
+    Remembers inserted items so their recommendations are built after the ingestion.
+    Used as insert listener.
+
+    Args:
+        rows: The inserted rows as dictionaries.
+    """
+    with pending_lock:
+        pending_ids.update(row["item_id"] for row in rows if row["type"] == "boardgame")
+
+
+database.insert_listeners.append(collect_inserted_ids)
+
+
+class FeatureMatrix:
+    """
+    Sparse TF-IDF matrix of the mechanics, categories, designers and families of all games.
+    Rows are L2-normalized, so the product of two rows is their cosine similarity.
+    """
+
+    def __init__(self):
+        items, links = database.get_feature_data()
+        self.item_ids = np.array([row.item_id for row in items], dtype=np.int64)
+        self.weights = np.array(
+            [row.average_weight if row.average_weight else -1 for row in items],
+            dtype=np.float32,
+        )
+        link_items = np.array([row.item_id for row in links], dtype=np.int64)
+        link_entities = np.array([row.entity_id for row in links], dtype=np.int64)
+        link_weights = np.array(
+            [FEATURE_WEIGHTS.get(row.kind, 0.0) for row in links], dtype=np.float32
+        )
+        keep = link_weights > 0
+        rows = np.searchsorted(self.item_ids, link_items[keep])
+        features, columns = np.unique(link_entities[keep], return_inverse=True)
+
+        item_count = max(len(self.item_ids), 1)
+        frequency = np.bincount(columns, minlength=len(features))
+        idf = np.log(item_count / np.maximum(frequency, 1)).astype(np.float32)
+        idf[frequency > max(MAX_FEATURE_SHARE * item_count, 2)] = 0
+        matrix = sparse.csr_matrix(
+            (link_weights[keep] * idf[columns], (rows, columns)),
+            shape=(len(self.item_ids), len(features)),
+        )
+        matrix.eliminate_zeros()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        self.matrix = sparse.diags(1 / norms) @ matrix
+        self.transposed = self.matrix.T.tocsc()
+
+    def rows_of(self, item_ids) -> np.ndarray:
+        """
+        Returns the matrix rows of the given games in the given order, skipping unknown IDs.
+        """
+        item_ids = np.fromiter(item_ids, dtype=np.int64)
+        rows = np.minimum(
+            np.searchsorted(self.item_ids, item_ids), max(len(self.item_ids) - 1, 0)
+        )
+        return rows[self.item_ids[rows] == item_ids] if len(self.item_ids) else rows[:0]
+
+    def weight_factor(self, rows, other_rows: np.ndarray) -> np.ndarray:
+        """
+        Scales similarities down by the difference in weight (complexity) of two games.
+        Games without a weight are not scaled.
+        """
+        weight = self.weights[rows]
+        other_weights = self.weights[other_rows]
+        known = (weight > 0) & (other_weights > 0)
+        return np.where(known, 1 - np.abs(weight - other_weights) / 5, 1.0)
+
+    def similarities(self, rows: np.ndarray):
+        """
+        Yields, batch by batch, the rows and their sparse similarities to every game.
+        """
+        for start in range(0, len(rows), SIMILARITY_BATCH_SIZE):
+            batch = rows[start : start + SIMILARITY_BATCH_SIZE]
+            yield batch, (self.matrix[batch] @ self.transposed).tocsr()
+
+    def top_similar(self, row: int, columns: np.ndarray, scores: np.ndarray) -> list:
+        """
+        Picks the most similar games of one game from its similarity row.
+
+        Returns:
+            A list of (similar_id, score) tuples, most similar first.
+        """
+        not_self = columns != row
+        columns, scores = columns[not_self], scores[not_self]
+        candidates = SIMILAR_COUNT * CANDIDATE_FACTOR
+        if len(scores) > candidates:
+            best = np.argpartition(-scores, candidates - 1)[:candidates]
+            columns, scores = columns[best], scores[best]
+        scores = scores * self.weight_factor(row, columns)
+        order = np.lexsort((self.item_ids[columns], -scores))[:SIMILAR_COUNT]
+        return [
+            (int(self.item_ids[columns[i]]), round(float(scores[i]), 6)) for i in order
+        ]
+
+
+def top_k_lists(model: FeatureMatrix, rows: np.ndarray) -> dict:
+    """
+    Computes the similar games lists of the given matrix rows in batches.
+
+    Returns:
+        A dictionary mapping item IDs to lists of (similar_id, score) tuples.
+    """
+    lists = {}
+    for batch, similarity in model.similarities(rows):
+        for position, row in enumerate(batch):
+            start, end = similarity.indptr[position], similarity.indptr[position + 1]
+            lists[int(model.item_ids[row])] = model.top_similar(
+                row, similarity.indices[start:end], similarity.data[start:end]
+            )
+    return lists
+
+
+def rebuild_recommendations() -> int:
+    """
+    Recomputes and stores the similar games lists of the whole catalog.
+
+    Returns:
+        The number of games with stored lists.
+    """
+    started = time.monotonic()
+    with pending_lock:
+        pending_ids.clear()
+    model = FeatureMatrix()
+    lists = top_k_lists(model, np.arange(len(model.item_ids)))
+    database.replace_similar_lists(lists, replace_all=True)
+    print(
+        f"Rebuilt recommendations of {len(lists)} games "
+        f"in {time.monotonic() - started:.1f}s."
+    )
+    return len(lists)
+
+
+def update_recommendations() -> int:
+    """
+    Adds the games inserted since the last update to the stored recommendations.
+    Computes the lists of the new games and merges the new games into the lists of
+    existing games they are now among the most similar of. The new games are the
+    ones collected by the insert listener and the ones whose list was never
+    computed, so games inserted by another process are picked up too. Falls back
+    to a full rebuild while no list was computed.
+
+    Returns:
+        The number of games whose lists were written.
+    """
+    if not database.has_recommendations():
+        return rebuild_recommendations()
+    with pending_lock:
+        new_ids = set(pending_ids)
+        pending_ids.clear()
+    new_ids.update(database.get_unrecommended_ids(FEATURE_WEIGHTS))
+    if not new_ids:
+        return 0
+
+    started = time.monotonic()
+    model = FeatureMatrix()
+    rows = model.rows_of(new_ids)
+    if not len(rows):
+        return 0
+    lists = top_k_lists(model, rows)
+
+    # every new game is a candidate for the lists of the games similar to it
+    other_rows, new_rows, scores = [], [], []
+    for batch, similarity in model.similarities(rows):
+        counts = np.diff(similarity.indptr)
+        batch_rows = np.repeat(batch, counts)
+        batch_scores = similarity.data * model.weight_factor(batch_rows, similarity.indices)
+        existing = ~np.isin(similarity.indices, rows)
+        other_rows.append(similarity.indices[existing])
+        new_rows.append(batch_rows[existing])
+        scores.append(batch_scores[existing])
+    other_rows = np.concatenate(other_rows)
+    new_rows = np.concatenate(new_rows)
+    scores = np.concatenate(scores)
+    order = np.lexsort((-scores, other_rows))
+    other_rows, new_rows, scores = other_rows[order], new_rows[order], scores[order]
+    group_starts = np.flatnonzero(np.r_[True, other_rows[1:] != other_rows[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(other_rows)])
+    rank = np.arange(len(other_rows)) - np.repeat(group_starts, group_sizes)
+    # only the best SIMILAR_COUNT candidates of an existing game can make its list,
+    # and only if they score above the lowest stored score of a full list
+    floor_scores = np.zeros(len(model.item_ids), dtype=np.float32)
+    full = [
+        (item_id, floor)
+        for item_id, (length, floor) in database.get_similar_floors().items()
+        if length >= SIMILAR_COUNT
+    ]
+    if full:
+        full_ids, floors = map(np.array, zip(*full))
+        full_rows = model.rows_of(full_ids)
+        floor_scores[full_rows] = floors[np.isin(full_ids, model.item_ids)]
+    best = (rank < SIMILAR_COUNT) & (scores > floor_scores[other_rows])
+    candidates = {}
+    for other_row, new_row, score in zip(
+        other_rows[best].tolist(), new_rows[best].tolist(), scores[best].tolist()
+    ):
+        candidates.setdefault(int(model.item_ids[other_row]), []).append(
+            (int(model.item_ids[new_row]), round(score, 6))
+        )
+
+    stored = database.get_similar_lists(candidates)
+    for other_id, new_similar in candidates.items():
+        merged = dict(stored.get(other_id, []))
+        merged.update(new_similar)
+        lists[other_id] = sorted(merged.items(), key=lambda pair: (-pair[1], pair[0]))[
+            :SIMILAR_COUNT
+        ]
+
+    database.replace_similar_lists(lists)
+    print(
+        f"Updated recommendations of {len(lists)} games for {len(new_ids)} new games "
+        f"in {time.monotonic() - started:.1f}s."
+    )
+    return len(lists)
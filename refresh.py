@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Callable
+
+from bgg_api import api_rate_limiter, create_session, get_api_data, parse_games_data
+from database import (
+    STAT_COLUMNS,
+    add_refresh_requests,
+    get_refresh_candidates,
+    get_refresh_requests,
+    update_refreshed_items,
+)
+from ingestion import BackgroundJob
+
+# Refresh settings
+REFRESH_DAILY_BUDGET = int(os.getenv("REFRESH_DAILY_BUDGET", "2000"))  # API requests
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", "20"))
+REFRESH_MIN_AGE_DAYS = float(os.getenv("REFRESH_MIN_AGE_DAYS", "7"))
+REFRESH_INTERVAL_HOURS = float(os.getenv("REFRESH_INTERVAL_HOURS", "1"))
+
+
+def changed_stats(stored_row, fetched_item: dict) -> dict:
+    """
+    Compares the stored stats of an item with freshly fetched ones.
+
+    Args:
+        stored_row: The stored row with the item ID and the stat columns.
+        fetched_item: The parsed item data from the BGG API.
+
+    Returns:
+        The item ID and the new stat columns if any stat changed, otherwise None.
+    """
+    new_stats = {column: fetched_item[column] for column in STAT_COLUMNS}
+    if all(getattr(stored_row, column) == value for column, value in new_stats.items()):
+        return None
+    return {"item_id": stored_row.item_id, **new_stats}
+
+
+def refresh_items(
+    budget: int = REFRESH_DAILY_BUDGET,
+    progress: Callable[[dict], None] = None,
+    stop_event: threading.Event = None,
+) -> dict:
+    """
+    Re-fetches the stats of stored items in priority order and writes the ones that changed.
+    Owned and ranked games are refreshed first, then the rows that are stale the longest.
+    Stops when the daily request budget is spent or no item is older than REFRESH_MIN_AGE_DAYS.
+
+    Args:
+        budget: The maximum number of BGG API requests per day, retries included.
+        progress: Optional callback receiving the statistics after every batch.
+        stop_event: Optional event that stops the refresh after the current batch.
+
+    Returns:
+        A dictionary with the refresh statistics: requests, checked, changed,
+        budget_left, cancelled, seconds and items_per_second.
+    """
+    stats = {
+        "requests": 0,
+        "checked": 0,
+        "changed": 0,
+        "budget_left": budget,
+        "cancelled": False,
+        "items_per_second": 0.0,
+    }
+    min_age = timedelta(days=REFRESH_MIN_AGE_DAYS)
+    started = time.monotonic()
+
+    with create_session(1) as session:
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                stats["cancelled"] = True
+                break
+            today = date.today()
+            stats["budget_left"] = budget - get_refresh_requests(today)
+            if stats["budget_left"] <= 0:
+                break
+            stored_rows = get_refresh_candidates(REFRESH_BATCH_SIZE, min_age)
+            if not stored_rows:
+                break
+
+            item_ids = ",".join(str(row.item_id) for row in stored_rows)
+            batch_stats = {"retries": 0}
+            try:
+                api_response = get_api_data(
+                    item_ids, session, api_rate_limiter, batch_stats
+                )
+            finally:
+                add_refresh_requests(today, 1 + batch_stats["retries"])
+            fetched = parse_games_data(api_response)
+
+            changed_rows = []
+            for row in stored_rows:
+                if row.item_id in fetched:
+                    changed = changed_stats(row, fetched[row.item_id])
+                    if changed:
+                        changed_rows.append(changed)
+            update_refreshed_items(changed_rows, [row.item_id for row in stored_rows])
+
+            stats["requests"] += 1 + batch_stats["retries"]
+            stats["budget_left"] -= 1 + batch_stats["retries"]
+            stats["checked"] += len(stored_rows)
+            stats["changed"] += len(changed_rows)
+            stats["items_per_second"] = stats["checked"] / (time.monotonic() - started)
+            if progress:
+                progress(stats)
+
+    stats["seconds"] = time.monotonic() - started
+    print(
+        f"Refreshed stats: {stats['checked']} items checked, {stats['changed']} changed, "
+        f"{stats['requests']} requests, {stats['budget_left']} left in today's budget."
+    )
+    return stats
+
+
+def refresh_scheduler(interval: float, stop_event: threading.Event) -> None:
+    """
+    Starts the refresh job every `interval` seconds until stop_event is set.
+    The job itself stops once the daily budget is spent.
+
+    Args:
+        interval: The seconds between two starts.
+        stop_event: The event that stops the scheduler.
+    """
+    while not stop_event.is_set():
+        refresh_job.start()
+        stop_event.wait(interval)
+
+
+def start_refresh_scheduler() -> threading.Event:
+    """
+    Runs the refresh scheduler in a background thread if REFRESH_INTERVAL_HOURS is positive.
+
+    Returns:
+        The event that stops the scheduler.
+    """
+    stop_event = threading.Event()
+    if REFRESH_INTERVAL_HOURS > 0:
+        threading.Thread(
+            target=refresh_scheduler,
+            args=(REFRESH_INTERVAL_HOURS * 3600, stop_event),
+            name="refresh-scheduler",
+            daemon=True,
+        ).start()
+    return stop_event
+
+
+refresh_job = BackgroundJob("refresh", refresh_items)
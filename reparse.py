@@ -0,0 +1,154 @@
+"""
+Rebuilds the games of the boardgames table from the XML archive, without network access.
+
+Usage:
+    python reparse.py
+    python reparse.py --parsers 4 --write-rows 2000
+    python reparse.py --item 174430
+    python reparse.py --stats
+    python reparse.py --compact
+
+Segments are mapped into memory one by one and worker processes decompress and
+parse the responses. A game is only written from its latest written response
+(XmlArchive.latest_locations), so concurrent writers appending to older segments
+cannot replay stale XML over newer data, and responses without any latest game
+are not parsed at all. Every column parsed from the API is replaced and
+the collection columns (owned, plays, comments) are kept. After extending
+bgg_api.parse_item with a new field, add its column to database.Boardgame and run
+this instead of crawling again; missing columns are added before reparsing.
+"""
+import argparse
+import json
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from typing import Callable
+
+import bgg_api
+import database
+import pipeline
+from archive import decompress, segment_codec, xml_archive
+from startup import check_schema_up_to_date, update_recommendations
+
+
+def parse_response(data: bytes, codec: str) -> dict:
+    """
+    Decompresses and parses one archived response, run by the parser processes.
+
+    Returns:
+        The parsed items of the response keyed by ID.
+    """
+    return bgg_api.parse_games_data(decompress(data, codec))
+
+
+def reparse(
+    parsers: int = pipeline.PIPELINE_PARSERS,
+    write_rows: int = pipeline.PIPELINE_WRITE_ROWS,
+    progress: Callable[[dict], None] = None,
+) -> dict:
+    """
+    Parses every archived response again and replaces the API data of the games.
+
+    Args:
+        parsers: The number of parser processes, 0 to parse in this process.
+        write_rows: The parsed games written per transaction.
+        progress: Optional callback receiving the statistics after every segment.
+
+    Returns:
+        A dictionary with the statistics: segments, responses, items, bytes (compressed
+        bytes read), seconds and items_per_second.
+    """
+    stats = {"segments": 0, "responses": 0, "items": 0, "bytes": 0, "items_per_second": 0.0}
+    started = time.monotonic()
+    pool = pipeline.get_parse_pool(parsers) if parsers else None
+    # parsed responses in flight, consumed in order so later responses win
+    pending = deque()
+    rows = {}
+    latest = xml_archive.latest_locations()
+
+    def collect(response, items_data: dict) -> None:
+        nonlocal rows
+        stats["responses"] += 1
+        items_data = {
+            item_id: data
+            for item_id, data in items_data.items()
+            if latest.get(item_id) == response.location
+        }
+        stats["items"] += len(items_data)
+        rows.update(items_data)
+        if len(rows) >= write_rows:
+            database.insert_items_data(rows, replace=True)
+            rows = {}
+
+    for segment in xml_archive.segments():
+        codec = segment_codec(segment)
+        for response, data in xml_archive.read_segment(segment):
+            if not any(latest.get(i) == response.location for i in response.item_ids):
+                continue
+            stats["bytes"] += len(data)
+            if pool is None:
+                collect(response, parse_response(data, codec))
+                continue
+            pending.append((response, pool.submit(parse_response, data, codec)))
+            while len(pending) > parsers * 4:
+                response, future = pending.popleft()
+                collect(response, future.result())
+        stats["segments"] += 1
+        stats["items_per_second"] = stats["items"] / (time.monotonic() - started)
+        print(
+            f"----Reparsed {segment}: {stats['items']} items from "
+            f"{stats['responses'] + len(pending)} responses "
+            f"({stats['items_per_second']:.1f} items/s)----"
+        )
+        if progress:
+            progress(stats)
+    while pending:
+        response, future = pending.popleft()
+        collect(response, future.result())
+    if rows:
+        database.insert_items_data(rows, replace=True)
+
+    stats["seconds"] = time.monotonic() - started
+    stats["items_per_second"] = stats["items"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(
+        f"Reparsed {stats['items']} items from {stats['responses']} responses "
+        f"in {stats['seconds']:.1f}s ({stats['items_per_second']:.1f} items/s)."
+    )
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--parsers", type=int, default=pipeline.PIPELINE_PARSERS)
+    parser.add_argument("--write-rows", type=int, default=pipeline.PIPELINE_WRITE_ROWS)
+    parser.add_argument("--item", type=int, help="print the latest archived XML of an item")
+    parser.add_argument("--stats", action="store_true", help="print the archive size")
+    parser.add_argument(
+        "--compact", action="store_true", help="drop responses replaced by later ones"
+    )
+    args = parser.parse_args()
+
+    if args.stats:
+        print(json.dumps(xml_archive.stats(), indent=2))
+        return
+    if args.compact:
+        print(json.dumps(xml_archive.compact(), indent=2))
+        return
+    if args.item is not None:
+        data = xml_archive.find(args.item)
+        item = None if data is None else ET.fromstring(data).find(f"item[@id='{args.item}']")
+        if item is None:
+            parser.exit(1, f"Item {args.item} is not in the archive.\n")
+        print(ET.tostring(item, encoding="unicode"))
+        return
+    database.create_database_tables()
+    check_schema_up_to_date(database.engine)
+    try:
+        reparse(args.parsers, args.write_rows)
+    finally:
+        pipeline.shutdown_parse_pools()
+    update_recommendations()
+
+
+if __name__ == "__main__":
+    main()
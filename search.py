@@ -0,0 +1,400 @@
+import math
+import re
+import threading
+from array import array
+
+import numpy as np
+from sqlalchemy import case, func, literal, select, text
+
+import database
+from database import Boardgame, list_view
+
+# Share of the query trigrams a name has to contain to count as a match
+MATCH_THRESHOLD = 0.4
+# Weight of log10(users_rated + 1) in the ranking, 100k ratings add 0.25 to a match
+POPULARITY_WEIGHT = 0.05
+# Number of best matches re-ranked by name bonus on SQLite
+RERANK_CANDIDATES = 400
+SEARCH_LIMIT = 200
+
+NON_WORD = re.compile(r"[^\w]+")
+
+
+class SearchError(ValueError):
+    """
+    Raised for a search term without any letter or digit, which neither backend can match.
+    """
+
+
+def check_search_term(query: str) -> None:
+    """
+    Rejects search terms without trigrams, the same way for Postgres and SQLite.
+
+    Raises:
+        SearchError: If the term has no letter or digit.
+    """
+    if not trigrams(query):
+        raise SearchError("The search term needs at least one letter or digit")
+
+
+def trigrams(value: str) -> set:
+    """
+    Splits a text into lowercase word trigrams the same way pg_trgm does:
+    every word is padded with two spaces in front and one behind.
+
+    Args:
+        value: The text to split.
+
+    Returns:
+        The set of trigrams.
+    """
+    grams = set()
+    for word in NON_WORD.split(value.lower()):
+        if word:
+            padded = f"  {word} "
+            grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramIndex:
+    """
+    In-process trigram index over the primary and alternate names, used when the
+    database has no trigram support (SQLite).
+
+    Every indexed version of an item's names is a document, and every trigram maps
+    to an array of document IDs. A rename adds a new document and supersedes the
+    old one, whose trigrams no longer count; the index is rebuilt once superseded
+    documents make up half of it. A query counts the matching trigrams of every
+    document with NumPy and ranks the items by the share of query trigrams they
+    contain plus their popularity.
+
+    Kept current by the insert and update listeners, and caught up with the writes
+    of other processes from the updated_at index before every search, see sync.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.postings = {}
+        # item ID and hash of the indexed names by document ID, document 0 is unused
+        self.doc_items = array("i", [0])
+        self.doc_hashes = array("q", [0])
+        # current document and number of ratings, indexed by item ID
+        self.item_docs = array("i")
+        self.users_rated = array("i")
+        self.superseded = 0
+        self.synced_at = None
+        self.built = False
+
+    def add(self, item_id: int, users_rated: int, *names: str) -> None:
+        """
+        Adds an item to the index, or replaces its names if they changed.
+
+        Args:
+            item_id: The ID of the item.
+            users_rated: The number of ratings of the item, used for ranking.
+            names: The texts to index (primary and alternate names).
+        """
+        names_hash = hash(names)
+        with self.lock:
+            if item_id >= len(self.item_docs):
+                grow_by = max(item_id + 1 - len(self.item_docs), len(self.item_docs))
+                for values in (self.item_docs, self.users_rated):
+                    values.frombytes(bytes(grow_by * values.itemsize))
+            self.users_rated[item_id] = max(users_rated or 0, 0)
+            doc = self.item_docs[item_id]
+            if doc and self.doc_hashes[doc] == names_hash:
+                return
+            if doc:
+                self.superseded += 1
+            grams = set()
+            for name in names:
+                if name:
+                    grams.update(trigrams(name))
+            new_doc = len(self.doc_items)
+            self.doc_items.append(item_id)
+            self.doc_hashes.append(names_hash)
+            self.item_docs[item_id] = new_doc
+            for gram in grams:
+                self.postings.setdefault(gram, array("i")).append(new_doc)
+
+    def add_rows(self, rows: list) -> None:
+        """
+        Adds inserted items that are not in the index yet. Existing items are left
+        alone, like the ON CONFLICT DO NOTHING insert. Used as insert listener.
+
+        Args:
+            rows: The inserted rows as dictionaries.
+        """
+        if not self.built:
+            return
+        with self.lock:
+            for row in rows:
+                item_id = row["item_id"]
+                if row["name"] == "-1":
+                    continue
+                if item_id < len(self.item_docs) and self.item_docs[item_id]:
+                    continue
+                self.add(item_id, row["users_rated"], row["name"], row["alternate_names"])
+
+    def update_rows(self, rows: list) -> None:
+        """
+        Applies changed names and rating counts of existing items. Used as update listener.
+
+        Args:
+            rows: Dictionaries with the item ID and the new values of the changed columns.
+        """
+        if not self.built:
+            return
+        with self.lock:
+            for row in rows:
+                item_id = row["item_id"]
+                if item_id >= len(self.item_docs) or not self.item_docs[item_id]:
+                    continue
+                users_rated = row.get("users_rated", self.users_rated[item_id])
+                if "name" in row and "alternate_names" in row:
+                    self.add(item_id, users_rated, row["name"], row["alternate_names"])
+                else:
+                    self.users_rated[item_id] = max(users_rated or 0, 0)
+
+    def names_query(self):
+        return select(
+            Boardgame.c.item_id,
+            Boardgame.c.users_rated,
+            Boardgame.c.name,
+            Boardgame.c.alternate_names,
+        ).where(Boardgame.c.name != "-1")
+
+    def build(self) -> None:
+        """
+        Builds the index from every named item in the database.
+        """
+        with self.lock:
+            if self.built:
+                return
+            # read first, so items written during the build are caught up by sync
+            self.synced_at = database.get_catalog_updated_at()
+            with database.engine.connect() as conn:
+                result = conn.execution_options(yield_per=10000).execute(self.names_query())
+                for item_id, users_rated, name, alternate_names in result:
+                    self.add(item_id, users_rated, name, alternate_names)
+            self.built = True
+
+    def sync(self) -> None:
+        """
+        Applies the items written since the index was built or last synced, by this or
+        any other process, and rebuilds the index once superseded documents make up
+        half of it. Costs one read of the end of the updated_at index while nothing
+        changed.
+        """
+        latest = database.get_catalog_updated_at()
+        with self.lock:
+            if not self.built:
+                return
+            if self.superseded * 2 > len(self.doc_items):
+                self.reset()
+                self.build()
+                return
+            if latest is None or (self.synced_at is not None and latest <= self.synced_at):
+                return
+            query = self.names_query()
+            if self.synced_at is not None:
+                # >= rereads items written in the same instant as the last sync
+                query = query.where(Boardgame.c.updated_at >= self.synced_at)
+            else:
+                query = query.where(Boardgame.c.updated_at != None)
+            with database.engine.connect() as conn:
+                rows = conn.execute(query).fetchall()
+            self.synced_at = latest
+            for item_id, users_rated, name, alternate_names in rows:
+                self.add(item_id, users_rated, name, alternate_names)
+
+    def search(self, query: str, limit: int) -> list:
+        """
+        Finds the items whose names contain the largest share of the query trigrams,
+        ranked together with their popularity.
+
+        Args:
+            query: The search term.
+            limit: The maximum number of matches.
+
+        Returns:
+            A list of (score, item_id) tuples, best match first.
+        """
+        if not self.built:
+            self.build()
+        self.sync()
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        needed = max(1, math.ceil(MATCH_THRESHOLD * len(query_grams)))
+        with self.lock:
+            counts = np.zeros(len(self.doc_items), dtype=np.uint16)
+            for gram in query_grams:
+                posting = self.postings.get(gram)
+                if posting:
+                    counts[np.frombuffer(posting, dtype=np.int32)] += 1
+            matched = np.flatnonzero(counts >= needed)
+            item_ids = np.frombuffer(self.doc_items, dtype=np.int32)[matched]
+            # documents of superseded names do not count
+            current = np.frombuffer(self.item_docs, dtype=np.int32)[item_ids] == matched
+            matched, item_ids = matched[current], item_ids[current]
+            users_rated = np.frombuffer(self.users_rated, dtype=np.int32)[item_ids]
+        if not matched.size:
+            return []
+        scores = counts[matched] / len(query_grams) + popularity(users_rated)
+        if matched.size > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(matched.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), int(item_ids[i])) for i in top]
+
+
+ngram_index = NgramIndex()
+database.insert_listeners.append(ngram_index.add_rows)
+database.update_listeners.append(ngram_index.update_rows)
+
+
+def prepare_search(engine) -> None:
+    """
+    Creates the trigram indexes on the primary and alternate names on Postgres.
+    Other databases use the in-process NgramIndex, which is built in a background thread.
+
+    Args:
+        engine: The SQLAlchemy engine object used for database connections.
+    """
+    if engine.dialect.name != "postgresql":
+        threading.Thread(target=ngram_index.build, name="ngram-index", daemon=True).start()
+        return
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_boardgames_name_trgm "
+                "ON boardgames USING gin (name gin_trgm_ops)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_boardgames_alternate_names_trgm "
+                "ON boardgames USING gin (alternate_names gin_trgm_ops)"
+            )
+        )
+
+
+def name_bonus(query: str, name: str) -> float:
+    """
+    Scores how the search term appears in the primary name, on top of the trigram match.
+
+    Args:
+        query: The search term.
+        name: The primary name of the item.
+
+    Returns:
+        1.0 for an exact name, 0.5 for a prefix, 0.25 for a substring, otherwise 0.
+    """
+    query = query.strip().lower()
+    name = name.lower()
+    if name == query:
+        return 1.0
+    if name.startswith(query):
+        return 0.5
+    if query in name:
+        return 0.25
+    return 0.0
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def popularity(users_rated):
+    """
+    Scores the popularity of items by their number of ratings, for ints and NumPy arrays.
+    """
+    return POPULARITY_WEIGHT * np.log10(np.maximum(users_rated, 0) + 1)
+
+
+def search_postgres(conn, query: str, limit: int) -> list:
+    """
+    Searches with the pg_trgm word similarity operators, which use the trigram indexes.
+    Typos still match as long as enough trigrams are shared.
+    """
+    conn.execute(
+        select(
+            func.set_config(
+                "pg_trgm.word_similarity_threshold", str(MATCH_THRESHOLD), True
+            )
+        )
+    )
+    term = literal(query)
+    pattern = "%" + escape_like(query) + "%"
+    lowered_name = func.lower(Boardgame.c.name)
+    lowered_query = query.strip().lower()
+    bonus = case(
+        (lowered_name == lowered_query, 1.0),
+        (lowered_name.startswith(lowered_query, autoescape=True), 0.5),
+        (Boardgame.c.name.ilike(pattern), 0.25),
+        else_=0.0,
+    )
+    score = (
+        func.greatest(
+            func.word_similarity(term, Boardgame.c.name),
+            0.9 * func.word_similarity(term, func.coalesce(Boardgame.c.alternate_names, "")),
+        )
+        + bonus
+        + POPULARITY_WEIGHT * func.log(func.greatest(Boardgame.c.users_rated, 0) + 1)
+    )
+    return conn.execute(
+        select(*list_view)
+        .where(Boardgame.c.name != "-1")
+        .where(
+            Boardgame.c.name.ilike(pattern)
+            | Boardgame.c.name.bool_op("%>")(term)
+            | Boardgame.c.alternate_names.ilike(pattern)
+            | Boardgame.c.alternate_names.bool_op("%>")(term)
+        )
+        .order_by(score.desc(), Boardgame.c.item_id)
+        .limit(limit)
+    ).fetchall()
+
+
+def search_ngram(conn, query: str, limit: int) -> list:
+    """
+    Searches with the in-process NgramIndex and re-ranks the best matches
+    by how the search term appears in the primary name.
+    """
+    matches = ngram_index.search(query, max(limit, RERANK_CANDIDATES))
+    if not matches:
+        return []
+    scores = {item_id: score for score, item_id in matches}
+    rows = conn.execute(
+        select(*list_view).where(Boardgame.c.item_id.in_(list(scores)))
+    ).fetchall()
+    rows.sort(key=lambda row: (-scores[row.item_id] - name_bonus(query, row.name), row.item_id))
+    return rows[:limit]
+
+
+def search_items(query: str, limit: int = SEARCH_LIMIT) -> list:
+    """
+    Searches the primary and alternate names of all items, tolerating typos.
+    Results are ranked by match quality and popularity (number of ratings).
+
+    Args:
+        query: The search term.
+        limit: The maximum number of items to return.
+
+    Returns:
+        A list of list view rows (database.LIST_VIEW_COLUMNS), best match first.
+
+    Raises:
+        SearchError: If the term has no letter or digit.
+    """
+    check_search_term(query)
+    with database.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            return search_postgres(conn, query, limit)
+        return search_ngram(conn, query, limit)
@@ -1,6 +1,10 @@
+from typing import Callable
+
+from sqlalchemy import inspect
 from sqlalchemy.exc import OperationalError
-from database import create_database_tables, get_highest_id
-from bgg_api import get_new_data
+from database import OBSOLETE_INDEXES, create_database_tables, metadata
+from crawler import crawl
+from recommender import update_recommendations
 
 
 def check_db_connection(engine) -> None:
@@ -16,9 +20,8 @@ def check_db_connection(engine) -> None:
     Prints a success message if the connection is successful, or a failure message otherwise.
     """
     try:
-        connection = engine.connect()
-        print("Database connected successfully.")
-        connection.close()
+        with engine.connect():
+            print("Database connected successfully.")
     except OperationalError:
         print("Failed to connect to the database.")
 
@@ -33,7 +36,9 @@ def check_table_exists(table_name: str, engine) -> None:
 
     Prints messages indicating whether the table exists or needs to be created.
     """
-    if engine.dialect.has_table(engine.connect(), table_name):
+    with engine.connect() as conn:
+        table_exists = engine.dialect.has_table(conn, table_name)
+    if table_exists:
         print(f"Table '{table_name}' exists.")
     else:
         print(f"Table '{table_name}' does not exist.")
@@ -42,11 +47,51 @@ def check_table_exists(table_name: str, engine) -> None:
         print(f"Table '{table_name}' created.")
 
 
-def new_data_job() -> None:
+def check_schema_up_to_date(engine) -> None:
+    """
+    Brings an existing database up to date with the table definitions:
+    creates missing tables, adds missing columns, creates missing indexes and
+    drops indexes that were replaced.
+
+    Args:
+        engine: The SQLAlchemy engine object used for database connections.
+
+    Prints a message for every column that had to be added.
+    """
+    create_database_tables()
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in metadata.sorted_tables:
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=conn.dialect)
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    )
+                    print(f"Column '{table.name}.{column.name}' added.")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for index_name in OBSOLETE_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def new_data_job(progress: Callable[[dict], None] = None, stop_event=None) -> dict:
     """
-    Retrieves the highest existing ID in the database, uses it as a starting point
-    to fetch new data from the BGG API.
-    The retrieved new board game data is input it in the database.
+    Crawls the BGG ID space from the stored crawl state on: resumes unfinished shards,
+    crosses gaps and probes past the highest known game for new ones.
+    The retrieved new board game data is input it in the database and
+    the similar games recommendations are updated for the new games.
+
+    Args:
+        progress: Optional callback receiving the crawl statistics after every batch.
+        stop_event: Optional threading.Event that cancels the crawl.
+
+    Returns:
+        The crawl statistics.
     """
-    last_id = get_highest_id()
-    get_new_data(last_id)
+    stats = crawl(progress=progress, stop_event=stop_event)
+    update_recommendations()
+    return stats